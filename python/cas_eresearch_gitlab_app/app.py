@@ -1,35 +1,79 @@
+import contextlib
+import hashlib
+import hmac
 import ipaddress
 import datetime
+import json
 import logging
 import os
+import sys
+import threading
+import time
 from decouple import AutoConfig
-from typing import Dict
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Union
 from fastapi import (
     Depends,
     FastAPI,
     HTTPException,
+    Query,
     Request,
     status,
 )
+from fastapi.encoders import jsonable_encoder
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
+from starlette.concurrency import run_in_threadpool
+
+
+from . import logs, storage
+
+try:
+    from . import cache, crud, ingest, metrics, models
+    from .database import (
+        AsyncReadSessionLocal,
+        AsyncSessionLocal,
+        DATABASE_FILENAME,
+        SessionLocal,
+        async_engine,
+        async_read_engine,
+        storage_settings,
+    )
+except storage.InvalidStorageSettingsError as e:
+    # The database engines are set up on import, before there is a log to write to
+    print(f"Invalid storage configuration: {e}", file=sys.stderr)
+    exit(1)
 
-
-from . import crud, events, models
-from .database import SessionLocal, engine
+if TYPE_CHECKING:
+    from . import events, spool
 
 package_name = __name__.split(".")[0]
 
-# Configure logger
+config = AutoConfig(search_path=os.getcwd())
+
+# Configure logger; records are written to the file by a background thread, so
+# that requests never wait on log I/O
 logger = logging.getLogger(f"{package_name}")
-handler = logging.FileHandler(f"{package_name}.log")
-formatter = logging.Formatter(fmt="%(asctime)s | %(levelname)-7s | %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+try:
+    log_listener = logs.configure_logging(
+        logger,
+        config("LOG_FILE", default=f"{package_name}.log"),
+        log_format=config("LOG_FORMAT", default="text"),
+        max_bytes=config("LOG_MAX_BYTES", default=0, cast=int),
+        backup_count=config("LOG_BACKUP_COUNT", default=5, cast=int),
+    )
+except ValueError as e:
+    # Nowhere to log this to yet
+    print(f"Invalid logging configuration: {e}", file=sys.stderr)
+    exit(1)
 logger.setLevel(logging.INFO)
 
 logger.info("========== Initialising service ==========")
 
-config = AutoConfig(search_path=os.getcwd())
-
 # Parse runtime configuration
 GATE_IP = config("GATE_IP", default=None)
 TOKEN = config("SECRET_TOKEN", default=None)
@@ -42,7 +86,8 @@ else:
 LOG_LEVEL = config("LOG_LEVEL", default=logging.DEBUG)
 logger.setLevel(LOG_LEVEL)
 logger.info(
-    f"Application logging level set to {logging.getLevelName(logger.getEffectiveLevel())}."
+    "Application logging level set to %s.",
+    logging.getLevelName(logger.getEffectiveLevel()),
 )
 
 # Check if a GATE_IP has been defined in the environment and parse it if so
@@ -53,13 +98,109 @@ if GATE_IP:
         GATE_IP = ipaddress.ip_address(GATE_IP_IN.split("/")[-1])
     except ValueError:
         logger.error(
-            f"The GATE_IP (value={GATE_IP_IN}) that has been passed from the environment is invalid."
+            "The GATE_IP (value=%s) that has been passed from the environment is invalid.",
+            GATE_IP_IN,
         )
         exit(1)
-    logger.info(f"IP gateing configured for {GATE_IP}.")
+    logger.info("IP gateing configured for %s.", GATE_IP)
 else:
     logger.warning("No IP gateing configured.")
 
+logger.info(
+    "Storage settings: %s.",
+    ", ".join(f"{name}={value}" for name, value in storage_settings.items())
+    or "SQLite defaults",
+)
+
+# Configure how incoming events are written to the database: directly, in batches
+# by a background thread, or through an on-disk spool drained by a single consumer
+# (for several workers sharing a database)
+INGEST_MODE = config("INGEST_MODE", default="direct")
+ingest_writer: Optional[Union[ingest.BatchWriter, "spool.SpoolWriter"]] = None
+spool_consumer: Optional["spool.SpoolConsumer"] = None
+if INGEST_MODE == "batch":
+    try:
+        ingest_writer = ingest.BatchWriter(
+            SessionLocal,
+            batch_size=config("INGEST_BATCH_SIZE", default=100, cast=int),
+            flush_interval=config("INGEST_FLUSH_INTERVAL", default=0.05, cast=float),
+            durability=config("INGEST_DURABILITY", default=ingest.DURABILITY_FLUSH),
+        )
+    except ValueError as e:
+        logger.error("Invalid batch ingest configuration: %s", e)
+        exit(1)
+    logger.info(
+        "Batch ingest configured (batch size=%s, flush interval=%ss, durability=%s).",
+        ingest_writer.batch_size,
+        ingest_writer.flush_interval,
+        ingest_writer.durability,
+    )
+elif INGEST_MODE == "spool":
+    # Imported here, since spools rely on file locks which are not available everywhere
+    from . import spool
+
+    INGEST_SPOOL_DIR = config("INGEST_SPOOL_DIR", default=f"{package_name}.spool")
+    try:
+        ingest_writer = spool.SpoolWriter(
+            INGEST_SPOOL_DIR,
+            sync_interval=config("INGEST_SYNC_INTERVAL", default=0.01, cast=float),
+            durability=config("INGEST_DURABILITY", default=ingest.DURABILITY_FLUSH),
+        )
+        spool_consumer = spool.SpoolConsumer(
+            INGEST_SPOOL_DIR,
+            SessionLocal,
+            poll_interval=config("INGEST_POLL_INTERVAL", default=0.1, cast=float),
+            batch_size=config("INGEST_BATCH_SIZE", default=1000, cast=int),
+        )
+    except ValueError as e:
+        logger.error("Invalid spool ingest configuration: %s", e)
+        exit(1)
+    logger.info(
+        "Spool ingest configured (directory=%s, sync interval=%ss, durability=%s).",
+        ingest_writer.path,
+        ingest_writer.sync_interval,
+        ingest_writer.durability,
+    )
+elif INGEST_MODE == "direct":
+    logger.info("Direct ingest configured.")
+else:
+    logger.error(
+        "The INGEST_MODE (value=%s) that has been passed from the environment is invalid.",
+        INGEST_MODE,
+    )
+    exit(1)
+
+
+# Configure which events are stored
+try:
+    ingest_rules = ingest.IngestRules(
+        config("INGEST_RULES", default=ingest.DEFAULT_INGEST_RULES),
+        unmatched=config("INGEST_UNMATCHED", default=ingest.UNMATCHED_DROP),
+    )
+except ValueError as e:
+    logger.error("Invalid ingest rules: %s", e)
+    exit(1)
+logger.info(
+    "Ingest rules configured (%s; action for unmatched events=%s).",
+    ingest_rules,
+    ingest_rules.unmatched,
+)
+
+# UUIDs of recent events, so that retried deliveries are not stored twice
+RECENT_EVENTS_SIZE = config("RECENT_EVENTS_SIZE", default=10000, cast=int)
+recent_events = ingest.RecentEvents(maxsize=RECENT_EVENTS_SIZE)
+
+# Responses of the read endpoints are cached until the next write to the database
+RESPONSE_CACHE_MAX_BYTES = config(
+    "RESPONSE_CACHE_MAX_BYTES", default=32 * 1024 * 1024, cast=int
+)
+try:
+    response_cache = cache.ResponseCache(max_bytes=RESPONSE_CACHE_MAX_BYTES)
+except ValueError as e:
+    logger.error("Invalid response cache configuration: %s", e)
+    exit(1)
+logger.info("Response cache configured (size=%s bytes).", RESPONSE_CACHE_MAX_BYTES)
+
 
 async def gate_ip_address(request: Request):
     # Allow GitHub IPs only
@@ -86,22 +227,194 @@ async def check_token(request: Request):
             "Received request does not have a 'X-Gitlab-Token' entry in it's header."
         )
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Token not specified")
-    if request_token != TOKEN:
+    if not hmac.compare_digest(request_token.encode(), TOKEN.encode()):
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Invalid token")
     return
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+def _unmatched_event(event_type: Optional[str], body_size: Optional[int]) -> Dict:
+    if ingest_rules.unmatched == ingest.UNMATCHED_REJECT:
+        logger.info("Event (type=%s, size=%s) rejected.", event_type, body_size)
+        if event_type in ingest_rules.max_sizes or "*" in ingest_rules.max_sizes:
+            raise HTTPException(
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "Payload too large."
+            )
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, "Event not accepted.")
+    logger.debug("Event (type=%s, size=%s) dropped.", event_type, body_size)
+    return {"message": "Webhook processed successfully"}
+
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-app = FastAPI()
+async def get_read_db():
+    # Read-only sessions, pooled separately so that reports do not hold up ingest
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+# Page sizes used when listing events
+EVENTS_PAGE_SIZE = config("EVENTS_PAGE_SIZE", default=1000, cast=int)
+EVENTS_PAGE_SIZE_MAX = 10000
+
+
+def _local_time(time: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    # Event times are stored as naive local times
+    if time is not None and time.tzinfo is not None:
+        time = time.astimezone().replace(tzinfo=None)
+    return time
 
-models.Base.metadata.create_all(bind=engine)
+
+async def _stream_time_entries(limit: Optional[int], filters: Dict):
+    stmt = crud.select_time_entries(**filters)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    # Use a session of our own; the request's may be closed before streaming finishes
+    async with AsyncReadSessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=EVENTS_PAGE_SIZE))
+        async for rows in result.partitions():
+            yield "".join(
+                json.dumps(crud.time_entry_record(row)) + "\n" for row in rows
+            )
+
+
+def _request_key(route: str, params: Dict) -> str:
+    return json.dumps({"route": route, **params}, default=str, sort_keys=True)
+
+
+def _etag(generation: int, params: Dict) -> str:
+    key = hashlib.sha1(json.dumps(params, default=str, sort_keys=True).encode())
+    return write_generation.etag(generation, key.hexdigest()[:16])
+
+
+async def _cached_response(
+    request: Request,
+    route: str,
+    params: Dict,
+    etag_params: Dict,
+    build: Callable[[], Awaitable],
+) -> Response:
+    # Responses are keyed by their parameters and the write generation they were
+    # built at, so that repeated polls are answered from memory (or with a '304
+    # Not Modified') until the next write
+    generation = write_generation.current()
+    headers = {"ETag": _etag(generation, etag_params)}
+    if request.headers.get("If-None-Match") == headers["ETag"]:
+        metrics.RESPONSE_CACHE_REQUESTS.inc(route=route, result="not_modified")
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    key = _request_key(route, params)
+    body = response_cache.get(key, generation)
+    if body is None:
+        metrics.RESPONSE_CACHE_REQUESTS.inc(route=route, result="miss")
+        body = JSONResponse(jsonable_encoder(await build())).body
+        response_cache.put(key, generation, body)
+    else:
+        metrics.RESPONSE_CACHE_REQUESTS.inc(route=route, result="hit")
+        logger.info("Response returned from cache.")
+    return Response(body, media_type="application/json", headers=headers)
+
+
+# Events are read once and then refreshed incrementally for each request
+_dataset = None
+_dataset_lock = threading.Lock()
+
+
+def load_events() -> "events.DataSet":
+    # Imported here, so that workers only load pandas once the legacy format is used
+    from . import events
+
+    global _dataset
+    with _dataset_lock:
+        if _dataset is None:
+            with metrics.DATASET_BUILD_DURATION.time(kind="load"):
+                _dataset = events.DataSet("./")
+        else:
+            with metrics.DATASET_BUILD_DURATION.time(kind="refresh"):
+                _dataset.refresh()
+        metrics.DATASET_ROWS.set(_dataset.count())
+        return _dataset
+
+
+def _database_size() -> int:
+    # Include the write-ahead log, which holds recent commits when WAL is enabled
+    return sum(
+        os.path.getsize(filename)
+        for filename in [DATABASE_FILENAME, f"{DATABASE_FILENAME}-wal"]
+        if os.path.exists(filename)
+    )
+
+
+metrics.REGISTRY.register(
+    metrics.Gauge(
+        "database_size_bytes", "Size of the database files", function=_database_size
+    )
+)
+metrics.REGISTRY.register(
+    metrics.Gauge(
+        "response_cache_size_bytes",
+        "Size of the responses held by the response cache",
+        function=lambda: response_cache.size,
+    )
+)
+if ingest_writer:
+    metrics.REGISTRY.register(
+        metrics.Gauge(
+            "ingest_queue_depth",
+            "Number of events waiting to be written by the batch writer (or synced to the spool)",
+            function=ingest_writer.depth,
+        )
+    )
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    if ingest_writer:
+        ingest_writer.start()
+    if spool_consumer:
+        # Also replays anything left in the spool (eg. after a crash)
+        spool_consumer.start()
+    yield
+    if ingest_writer:
+        ingest_writer.stop()
+    if spool_consumer:
+        spool_consumer.stop()
+    await async_engine.dispose()
+    await async_read_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    duration = time.perf_counter() - start
+    # Label with the route's path template, so that the number of series is bounded
+    route = request.scope.get("route")
+    route_path = route.path if route is not None else "unmatched"
+    metrics.HTTP_REQUEST_DURATION.observe(
+        duration, method=request.method, route=route_path
+    )
+    metrics.HTTP_REQUESTS.inc(
+        method=request.method, route=route_path, status=response.status_code
+    )
+    return response
+
+
+with SessionLocal() as db:
+    schema_version = crud.upgrade_database(db)
+if schema_version < models.SCHEMA_VERSION:
+    logger.info(
+        "Database upgraded from schema version %s to %s.",
+        schema_version,
+        models.SCHEMA_VERSION,
+    )
+write_generation = cache.WriteGeneration(DATABASE_FILENAME)
 
 
 @app.post("/", dependencies=[Depends(gate_ip_address), Depends(check_token)])
@@ -124,29 +437,75 @@ async def create_event(request: Request, db=Depends(get_db)) -> Dict:
         Event status report
     """
 
-    # Obtain the webhook payload
+    # Filter events on their headers, before reading the body
+    event_type = request.headers.get("X-Gitlab-Event")
+    try:
+        body_size = int(request.headers["Content-Length"])
+    except (KeyError, ValueError):
+        body_size = None
+    if not ingest_rules.match(event_type, body_size):
+        return _unmatched_event(event_type, body_size)
+
+    # Answer retried deliveries of recent events as before, without storing them again
+    event_uuid = request.headers.get("X-Gitlab-Event-UUID")
+    if event_uuid is not None and event_uuid in recent_events:
+        logger.info("Duplicate event (uuid=%s) ignored.", event_uuid)
+        return {"message": "Webhook processed successfully"}
+
+    # Obtain the webhook payload (checking the size of any body sent without a length)
+    body = await request.body()
+    if body_size is None and not ingest_rules.match(event_type, len(body)):
+        return _unmatched_event(event_type, len(body))
     try:
-        event_payload = await request.json()
+        with metrics.JSON_PARSE_DURATION.time():
+            event_payload = json.loads(body)
     except ValueError:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Payload not specified.")
 
     # Set the webhook date & time
     time = datetime.datetime.now()
 
-    # Create event and write it to the database
+    # Create event and write it to the database (or hand it to the batch writer)
     try:
-        event = crud.create_event(db=db, time=time, payload=event_payload)
+        if ingest_writer:
+            event_id = await ingest_writer.submit(
+                time=time, payload=event_payload, uuid=event_uuid
+            )
+        else:
+            with metrics.DB_COMMIT_DURATION.time(writer="direct"):
+                event = await crud.create_event_async(
+                    db=db, time=time, payload=event_payload, uuid=event_uuid
+                )
+            event_id = event.id
     except models.CreateEventError as e:
-        logger.error(f"Invalid payload: {e}")
+        logger.error("Invalid payload: %s", e)
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Payload invalid.")
+    write_generation.bump()
+    if event_uuid is not None:
+        recent_events.add(event_uuid, event_id)
 
     # Report success
-    logger.info(f"Event (id={event.id}) processed successfully.")
+    if event_id is None:
+        logger.info("Event queued successfully.")
+    else:
+        logger.info("Event (id=%s) processed successfully.", event_id)
     return {"message": "Webhook processed successfully"}
 
 
-@app.get("/events", dependencies=[Depends(check_token)])
-async def get_events(request: Request, db=Depends(get_db)) -> str:
+@app.get("/events", dependencies=[Depends(check_token)], response_model=None)
+async def get_events(
+    request: Request,
+    db=Depends(get_read_db),
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    dev: Optional[List[str]] = Query(default=None),
+    project: Optional[List[str]] = Query(default=None),
+    limit: Optional[int] = Query(default=None, ge=1, le=EVENTS_PAGE_SIZE_MAX),
+    cursor: Optional[int] = Query(default=None, ge=0),
+    response_format: Optional[str] = Query(
+        default=None, alias="format", pattern="^(legacy|json|ndjson)$"
+    ),
+) -> Response:
     """Get webhook events
 
     You can test this hook with the following:
@@ -154,24 +513,169 @@ async def get_events(request: Request, db=Depends(get_db)) -> str:
       $ uvicorn cas_eresearch_gitlab_app.app:app --reload
       $ ./scripts/test_get.sh
 
+    Without any query parameters, all events are returned in the original
+    ('legacy') format.  Otherwise, time entries matching the filters are returned
+    either as a page ('json'; the default) or streamed as newline-delimited JSON
+    ('ndjson').  The legacy format can not be filtered, so asking for it along
+    with any filters is an error.
+
+    Responses carry an ETag, which changes whenever the database is written to;
+    send it back in an 'If-None-Match' header to get a '304 Not Modified' if
+    nothing has changed.  Otherwise, responses (other than streams) are served
+    from memory until the next write.
+
     Parameters
     ----------
     request : Request
         Request object
+    since : Optional[datetime.datetime]
+        Only return entries at or after this time
+    until : Optional[datetime.datetime]
+        Only return entries before this time
+    dev : Optional[List[str]]
+        Only return entries for these devs
+    project : Optional[List[str]]
+        Only return entries for these projects
+    limit : Optional[int]
+        Maximum number of entries to return
+    cursor : Optional[int]
+        Only return entries after this one (use the 'next_cursor' of the previous page)
+    response_format : Optional[str]
+        One of 'legacy', 'json' or 'ndjson'
 
     Returns
     -------
-    str:
-        String containing a list of filtered events
+    Response:
+        The filtered events
     """
 
-    # Read events
-    ds = events.DataSet("./")
+    filters = dict(
+        since=_local_time(since),
+        until=_local_time(until),
+        dev=dev,
+        project=project,
+        after_id=cursor,
+    )
+    filtered = limit is not None or any(value is not None for value in filters.values())
+    if response_format is None:
+        response_format = "json" if filtered else "legacy"
+    elif response_format == "legacy" and filtered:
+        # The legacy format holds every event, so it can not honour any filters
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            "Filters can not be used with the 'legacy' format.",
+        )
 
-    # Report success
-    logger.info(f"{ds.count()} events returned.")
+    # The cursor and page size are left out of the ETag, so that a client which
+    # has paged through to the end gets a match until something new arrives
+    params = dict(filters, limit=limit, format=response_format)
+    etag_params = {
+        key: value for key, value in params.items() if key not in ["after_id", "limit"]
+    }
+
+    if response_format == "ndjson":
+        # Streams are not cached, since they can be arbitrarily large
+        generation = write_generation.current()
+        headers = {"ETag": _etag(generation, etag_params)}
+        if request.headers.get("If-None-Match") == headers["ETag"]:
+            logger.info("Events unchanged.")
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        logger.info("Streaming events.")
+        return StreamingResponse(
+            _stream_time_entries(limit, filters),
+            media_type="application/x-ndjson",
+            headers=headers,
+        )
+
+    async def build_page() -> Dict:
+        page_size = limit or EVENTS_PAGE_SIZE
+        page = await crud.get_time_entries_async(db, limit=page_size, **filters)
+        next_cursor = page[-1]["id"] if len(page) == page_size else None
+        logger.info("%s events returned.", len(page))
+        return {"events": page, "next_cursor": next_cursor}
+
+    async def build_legacy() -> str:
+        # Read events (in a worker thread, so that other requests are not blocked)
+        ds = await run_in_threadpool(load_events)
+        logger.info("%s events returned.", ds.count())
+        return ds.to_json()
+
+    return await _cached_response(
+        request,
+        "/events",
+        params,
+        etag_params,
+        build_page if response_format == "json" else build_legacy,
+    )
+
+
+@app.get("/totals", dependencies=[Depends(check_token)], response_model=None)
+async def get_totals(
+    request: Request,
+    db=Depends(get_read_db),
+    levels: List[str] = Query(default=["dev", "project", "issue"]),
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    dev: Optional[List[str]] = Query(default=None),
+    project: Optional[List[str]] = Query(default=None),
+) -> Response:
+    """Get the total time spent, grouped hierarchically
 
-    return ds.to_json()
+    Parameters
+    ----------
+    request : Request
+        Request object
+    levels : List[str]
+        Levels to group by, outermost first; any of 'dev', 'project', 'issue' and 'month'
+    since : Optional[datetime.datetime]
+        Only count entries at or after this time
+    until : Optional[datetime.datetime]
+        Only count entries before this time
+    dev : Optional[List[str]]
+        Only count entries for these devs
+    project : Optional[List[str]]
+        Only count entries for these projects
+
+    Returns
+    -------
+    Response:
+        Tree of totals (see crud.totals_tree()), as JSON
+    """
+
+    invalid_levels = [level for level in levels if level not in crud.TOTALS_LEVELS]
+    if invalid_levels or len(set(levels)) != len(levels):
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST, f"Invalid levels: {', '.join(levels)}"
+        )
+
+    params: Dict[str, Any] = dict(
+        levels=levels,
+        since=_local_time(since),
+        until=_local_time(until),
+        dev=dev,
+        project=project,
+    )
+
+    async def build_totals() -> Dict:
+        totals = await crud.get_totals_async(db, **params)
+        logger.info("Totals for %s events returned.", totals["count"])
+        return totals
+
+    return await _cached_response(request, "/totals", params, params, build_totals)
+
+
+@app.get(
+    "/metrics", dependencies=[Depends(check_token)], response_class=PlainTextResponse
+)
+async def get_metrics() -> PlainTextResponse:
+    """Get the service's metrics, in the Prometheus text format
+
+    Returns
+    -------
+    PlainTextResponse:
+        The metrics
+    """
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
 
 
 logger.info("========== Initialisation complete ==========")
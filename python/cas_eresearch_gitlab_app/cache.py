@@ -0,0 +1,100 @@
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from . import storage
+
+
+class WriteGeneration(object):
+    """Counter of the writes made to a database, which tells when responses are stale
+
+    The counter is bumped by the app after each event it ingests.  Writes made
+    elsewhere (by other workers, or committed later by the batch writer) are
+    noticed by checking the database's files whenever the current generation is
+    asked for, so that it can be relied on for invalidation across processes.
+
+    Generations restart with the process, so each process also has a random boot
+    ID, which is included in the ETags built from its generations.
+    """
+
+    def __init__(self, filename: str | Path):
+        self.filename = filename
+        self.boot_id = uuid.uuid4().hex[:8]
+        self._generation = 0
+        self._stamp = storage.file_stamp(filename)
+        self._lock = threading.Lock()
+
+    def bump(self) -> int:
+        """Record a write, returning the new generation"""
+        stamp = storage.file_stamp(self.filename)
+        with self._lock:
+            self._stamp = stamp
+            self._generation += 1
+            return self._generation
+
+    def current(self) -> int:
+        """Return the current generation, bumping it first if the database has changed"""
+        stamp = storage.file_stamp(self.filename)
+        with self._lock:
+            if stamp != self._stamp:
+                self._stamp = stamp
+                self._generation += 1
+            return self._generation
+
+    def etag(self, generation: int, key: str) -> str:
+        """Return a (weak) ETag for a response built at a given generation"""
+        return f'W/"{self.boot_id}-{generation}-{key}"'
+
+
+class CachedResponse(NamedTuple):
+    generation: int
+    body: bytes
+
+
+class ResponseCache(object):
+    """Bounded, least-recently-used cache of serialised responses
+
+    Responses are stored with the write generation they were built at and are
+    only returned for that generation, so stale entries are never served; they
+    are replaced when next built, or evicted once the cache is full.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        if max_bytes < 0:
+            raise ValueError(f"Invalid size ({max_bytes}); must be >= 0.")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._responses: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def get(self, key: str, generation: int) -> Optional[bytes]:
+        """Return a cached response body (None if not cached for this generation)"""
+        with self._lock:
+            response = self._responses.get(key)
+            if response is None or response.generation != generation:
+                self.misses += 1
+                return None
+            self._responses.move_to_end(key)
+            self.hits += 1
+            return response.body
+
+    def put(self, key: str, generation: int, body: bytes) -> None:
+        """Cache a response body, evicting the least recently used ones to make room"""
+        with self._lock:
+            previous = self._responses.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous.body)
+            if len(body) > self.max_bytes:
+                return
+            self._responses[key] = CachedResponse(generation, body)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self._responses.popitem(last=False)
+                self.size -= len(evicted.body)
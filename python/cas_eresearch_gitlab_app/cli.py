@@ -1,7 +1,9 @@
 import click
 
-import importlib.metadata
 import collections
+import datetime
+import importlib.metadata
+from typing import Optional, Tuple
 
 
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
@@ -25,6 +27,17 @@ class _OrderedGroup(click.Group):
         return self.commands
 
 
+def _check_storage_settings() -> None:
+    # Importing the models sets up the app's database engines, which fails if the
+    # storage settings of the runtime configuration are invalid
+    from . import storage
+
+    try:
+        from . import models  # noqa: F401
+    except storage.InvalidStorageSettingsError as e:
+        raise click.ClickException(f"Invalid storage configuration: {e}")
+
+
 @click.group(cls=_OrderedGroup, context_settings=CONTEXT_SETTINGS)
 @click.version_option(importlib.metadata.version("cas_eresearch_gitlab_app"))
 @click.pass_context
@@ -64,3 +77,186 @@ def process_file(filename: str, inverse: bool) -> None:
     """Process a file"""
 
     pass
+
+
+@cli.command(context_settings=CONTEXT_SETTINGS)
+@click.argument(
+    "filename", type=click.Path(exists=True), default="cas_eresearch_gitlab_app.db"
+)
+def upgrade_db(filename: str) -> None:
+    """Upgrade a database written by an earlier version of the app (eg. backfill its time entries)"""
+    _check_storage_settings()
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from . import crud, models
+
+    engine = create_engine(f"sqlite:///{filename}")
+    with sessionmaker(bind=engine)() as db:
+        schema_version = crud.upgrade_database(db)
+    if schema_version < models.SCHEMA_VERSION:
+        click.echo(
+            f"Database upgraded from schema version {schema_version} to {models.SCHEMA_VERSION}."
+        )
+    else:
+        click.echo(f"Database already at schema version {schema_version}.")
+
+
+@cli.command(context_settings=CONTEXT_SETTINGS)
+@click.argument(
+    "filename", type=click.Path(exists=True), default="cas_eresearch_gitlab_app.db"
+)
+@click.option(
+    "--output-dir",
+    "-o",
+    type=click.Path(file_okay=False),
+    default="partitions",
+    show_default=True,
+    help="Directory to write the monthly partitions to",
+)
+def partition_db(filename: str, output_dir: str) -> None:
+    """Copy new events from a database into monthly partitions (completed months are made read-only)"""
+    from . import partitions
+
+    try:
+        written = partitions.partition_database(filename, output_dir)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for filename_partition in written:
+        click.echo(f"Partition updated: {filename_partition}")
+
+
+@cli.command(context_settings=CONTEXT_SETTINGS)
+@click.argument(
+    "filename", type=click.Path(exists=True), default="cas_eresearch_gitlab_app.db"
+)
+def rebuild_totals(filename: str) -> None:
+    """Rebuild the monthly totals of a database from its time entries"""
+    _check_storage_settings()
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from . import crud
+
+    engine = create_engine(f"sqlite:///{filename}")
+    with sessionmaker(bind=engine)() as db:
+        # The totals are rebuilt from the time entries, which older databases lack
+        crud.upgrade_database(db)
+        n_rows = crud.rebuild_monthly_totals(db)
+        db.commit()
+    click.echo(f"Monthly totals rebuilt ({n_rows} rows).")
+
+
+@cli.command(context_settings=CONTEXT_SETTINGS)
+@click.argument(
+    "filename", type=click.Path(exists=True), default="cas_eresearch_gitlab_app.db"
+)
+@click.option(
+    "--output-dir",
+    "-o",
+    type=click.Path(file_okay=False),
+    default=".",
+    show_default=True,
+    help="Directory to write the files (one per table) to",
+)
+@click.option(
+    "--format",
+    "-f",
+    "export_format",
+    type=click.Choice(["tsv", "ndjson", "parquet"]),
+    default="tsv",
+    show_default=True,
+    help="Format to write (parquet needs pyarrow)",
+)
+@click.option(
+    "--table",
+    "-t",
+    "tables",
+    multiple=True,
+    help="Table to export (can be repeated; default: all tables)",
+)
+@click.option(
+    "--since",
+    type=click.DateTime(),
+    default=None,
+    help="Only export rows at or after this time",
+)
+@click.option(
+    "--until",
+    type=click.DateTime(),
+    default=None,
+    help="Only export rows before this time",
+)
+@click.option(
+    "--chunk-size",
+    "-c",
+    type=click.IntRange(min=1),
+    default=10000,
+    show_default=True,
+    help="Number of rows to read and write at a time",
+)
+@click.option(
+    "--payload-field",
+    "-p",
+    "payload_fields",
+    multiple=True,
+    help="Payload field (eg. 'user.username') to add as a column of the events (can be repeated)",
+)
+def export(
+    filename: str,
+    output_dir: str,
+    export_format: str,
+    tables: Tuple[str, ...],
+    since: Optional[datetime.datetime],
+    until: Optional[datetime.datetime],
+    chunk_size: int,
+    payload_fields: Tuple[str, ...],
+) -> None:
+    """Export the tables of a database, streaming their rows in chunks"""
+    from . import export
+
+    try:
+        n_rows = export.export_database(
+            filename,
+            output_dir,
+            export_format=export_format,
+            tables=tables or None,
+            since=since,
+            until=until,
+            chunk_size=chunk_size,
+            payload_fields=payload_fields,
+        )
+    except (ImportError, ValueError) as e:
+        raise click.ClickException(str(e))
+    for table, n_table in n_rows.items():
+        click.echo(f"{n_table} rows exported from {table}.")
+
+
+@cli.command(context_settings=CONTEXT_SETTINGS)
+@click.argument("spool_dir", type=click.Path(exists=True, file_okay=False))
+@click.argument(
+    "filename", type=click.Path(exists=True), default="cas_eresearch_gitlab_app.db"
+)
+def replay_spool(spool_dir: str, filename: str) -> None:
+    """Write the events left in an ingest spool to a database (eg. while the app is down)"""
+    _check_storage_settings()
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from . import crud, spool
+
+    engine = create_engine(f"sqlite:///{filename}")
+    session_factory = sessionmaker(bind=engine)
+    # Spooled events carry UUIDs, which older databases have no column for
+    with session_factory() as db:
+        crud.upgrade_database(db)
+    consumer = spool.SpoolConsumer(spool_dir, session_factory)
+    if not consumer.acquire():
+        raise click.ClickException(
+            f"The spool in {spool_dir} is already being drained."
+        )
+    try:
+        n_entries = consumer.drain()
+    finally:
+        consumer.release()
+    click.echo(f"{n_entries} spooled events replayed.")
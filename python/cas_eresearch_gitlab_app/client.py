@@ -1,16 +1,29 @@
+import hashlib
+import json
 import os
 import requests
-import pandas as pd
-from io import StringIO
 from decouple import AutoConfig
-from .events import DataSet
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, Optional
+
+if TYPE_CHECKING:
+    from .events import DataSet
+
+package_name = __name__.split(".")[0]
 
 config = AutoConfig(search_path=os.getcwd())
 
+# Largest page of events the server will return
+PAGE_SIZE = 10000
+
 
 class Client(object):
     def __init__(
-        self, url="https://cas-eresearch-gitlab.adacs-gpoole.cloud.edu.au", token=None
+        self,
+        url="https://cas-eresearch-gitlab.adacs-gpoole.cloud.edu.au",
+        token=None,
+        cache_dir: Optional[str | Path] = None,
+        session=None,
     ):
         self.url = url
         if not token:
@@ -23,8 +36,155 @@ class Client(object):
             "X-Gitlab-Token": self.token,
         }
 
-    def get(self):
-        response = requests.get(f"{self.url}/events", headers=self.headers)
-        df = pd.read_json(StringIO(response.json()))
-        df.index.name = "date"
+        # Events already fetched are kept in a local cache, one per server
+        if not cache_dir:
+            cache_dir = config(
+                "CLIENT_CACHE_DIR",
+                default=Path.home() / ".cache" / package_name,
+            )
+        url_hash = hashlib.sha1(url.encode()).hexdigest()[:16]
+        self.cache_dir = Path(cache_dir) / url_hash
+
+        # Reuse connections between requests (responses are gzipped by default)
+        if session is None:
+            session = requests.Session()
+        self.session = session
+
+    def _get(self, path: str, params: Optional[Dict] = None, headers=None):
+        if params:
+            params = {key: value for key, value in params.items() if value is not None}
+        return self.session.get(
+            f"{self.url}{path}",
+            params=params,
+            headers={**self.headers, **(headers or {})},
+        )
+
+    def _read_state(self) -> Dict:
+        if not (self.cache_dir / "events.ndjson").exists():
+            return {"cursor": 0, "etag": None}
+        try:
+            with open(self.cache_dir / "state.json") as file_in:
+                return json.load(file_in)
+        except FileNotFoundError:
+            return {"cursor": 0, "etag": None}
+
+    def _write_state(self, state: Dict) -> None:
+        filename_tmp = self.cache_dir / "state.json.tmp"
+        with open(filename_tmp, "w") as file_out:
+            json.dump(state, file_out)
+        os.replace(filename_tmp, self.cache_dir / "state.json")
+
+    def sync(self) -> int:
+        """Fetch the events added since the last sync into the local cache
+
+        Returns
+        -------
+        int:
+            Number of new events fetched
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        state = self._read_state()
+        (self.cache_dir / "events.ndjson").touch()
+
+        n_events = 0
+        # An unchanged dataset is answered with a '304 Not Modified'.  The ETag is
+        # the same for every page, so it is only sent with the first request.
+        headers = {"If-None-Match": state["etag"]} if state["etag"] else None
+        while True:
+            response = self._get(
+                "/events",
+                params={
+                    "format": "json",
+                    "cursor": state["cursor"],
+                    "limit": PAGE_SIZE,
+                },
+                headers=headers,
+            )
+            if response.status_code == requests.codes.not_modified:
+                break
+            response.raise_for_status()
+            page = response.json()
+
+            # Append the events before moving the cursor; any events written twice
+            # after an interruption are dropped when the cache is read
+            if page["events"]:
+                with open(self.cache_dir / "events.ndjson", "a") as file_out:
+                    for event in page["events"]:
+                        file_out.write(json.dumps(event) + "\n")
+                state["cursor"] = page["events"][-1]["id"]
+                n_events += len(page["events"])
+            # Only a completed sync is marked as up to date
+            done = page["next_cursor"] is None
+            state["etag"] = response.headers.get("ETag") if done else None
+            self._write_state(state)
+            headers = None
+
+            if done:
+                break
+
+        return n_events
+
+    def get(self) -> "DataSet":
+        """Get all events, fetching only those which are not already cached
+
+        Returns
+        -------
+        DataSet:
+            The events
+        """
+        # Imported here, so that pandas is only loaded when it is needed
+        import pandas as pd
+
+        from .events import DataSet
+
+        self.sync()
+
+        filename_events = self.cache_dir / "events.ndjson"
+        if filename_events.stat().st_size > 0:
+            df = pd.read_json(filename_events, lines=True, convert_dates=False)
+            df = df.drop_duplicates(subset="id").drop(columns="id")
+        else:
+            df = pd.DataFrame(
+                columns=["date", "dev", "project", "time", "issue", "month"]
+            )
+        df["date"] = pd.to_datetime(df["date"])
         return DataSet(df=df)
+
+    def totals(
+        self,
+        levels: Iterable[str] = ("dev", "project", "issue"),
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        dev: Optional[Iterable[str]] = None,
+        project: Optional[Iterable[str]] = None,
+    ) -> Dict:
+        """Get the total time spent, grouped hierarchically, as computed by the server
+
+        Parameters
+        ----------
+        levels : Iterable[str]
+            Levels to group by, outermost first; any of 'dev', 'project', 'issue' and 'month'
+        since : Optional[str]
+            Only count entries at or after this (ISO 8601) time
+        until : Optional[str]
+            Only count entries before this (ISO 8601) time
+        dev : Optional[Iterable[str]]
+            Only count entries for these devs
+        project : Optional[Iterable[str]]
+            Only count entries for these projects
+
+        Returns
+        -------
+        Dict:
+            Tree of totals, with the groups of each level under 'groups'
+        """
+        params = {
+            "levels": list(levels),
+            "since": since,
+            "until": until,
+            "dev": dev,
+            "project": project,
+        }
+        response = self._get("/totals", params=params)
+        response.raise_for_status()
+        return response.json()
@@ -1,22 +1,536 @@
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 import datetime
-from typing import Dict
+from typing import Dict, Iterable, List, Optional, Sequence
 
-from . import models
+from . import models, payloads
 
 
 def get_events(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Event).offset(skip).limit(limit).all()
 
 
-def create_event(db: Session, time: datetime.date, payload: Dict):
+async def get_events_async(db: AsyncSession, skip: int = 0, limit: int = 100):
+    result = await db.execute(select(models.Event).offset(skip).limit(limit))
+    return result.scalars().all()
+
+
+def select_time_entries(
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    dev: Optional[Iterable[str]] = None,
+    project: Optional[Iterable[str]] = None,
+    after_id: Optional[int] = None,
+):
+    """Build a query for time entries, in the order they were written
+
+    Parameters
+    ----------
+    since : Optional[datetime.datetime]
+        Only select entries at or after this time
+    until : Optional[datetime.datetime]
+        Only select entries before this time
+    dev : Optional[Iterable[str]]
+        Only select entries for these devs
+    project : Optional[Iterable[str]]
+        Only select entries for these projects
+    after_id : Optional[int]
+        Only select entries with IDs greater than this (ie. a pagination cursor)
+    """
+    stmt = select(
+        models.TimeEntry.id,
+        models.TimeEntry.time,
+        models.TimeEntry.dev,
+        models.TimeEntry.project,
+        models.TimeEntry.hours,
+        models.TimeEntry.issue,
+    ).order_by(models.TimeEntry.id)
+    stmt = _filter_time_entries(stmt, since, until, dev, project)
+    if after_id is not None:
+        stmt = stmt.where(models.TimeEntry.id > after_id)
+    return stmt
+
+
+def _filter_time_entries(stmt, since, until, dev, project):
+    if since is not None:
+        stmt = stmt.where(models.TimeEntry.time >= since)
+    if until is not None:
+        stmt = stmt.where(models.TimeEntry.time < until)
+    if dev:
+        stmt = stmt.where(models.TimeEntry.dev.in_(dev))
+    if project:
+        stmt = stmt.where(models.TimeEntry.project.in_(project))
+    return stmt
+
+
+async def get_time_entries_async(
+    db: AsyncSession, limit: Optional[int] = None, **filters
+) -> List[Dict]:
+    stmt = select_time_entries(**filters)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    result = await db.execute(stmt)
+    return [time_entry_record(row) for row in result]
+
+
+def time_entry_record(row) -> Dict:
+    """Convert a row selected by select_time_entries() to a JSON-serialisable dictionary"""
+    return {
+        "id": row.id,
+        "date": row.time.isoformat(),
+        "dev": row.dev,
+        "project": row.project,
+        "time": row.hours,
+        "issue": row.issue,
+        "month": f"{row.time:%Y-%m}",
+    }
+
+
+# Levels that time entries can be totalled over
+TOTALS_LEVELS = ("dev", "project", "issue", "month")
+
+
+def _totals_column(level: str):
+    if level == "month":
+        return func.strftime("%Y-%m", models.TimeEntry.time)
+    return getattr(models.TimeEntry, level)
+
+
+def _is_month_start(time: Optional[datetime.datetime]) -> bool:
+    return time is None or time == datetime.datetime(time.year, time.month, 1)
+
+
+def _select_monthly_totals(
+    levels: Sequence[str],
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    dev: Optional[Iterable[str]] = None,
+    project: Optional[Iterable[str]] = None,
+):
+    group_columns = [
+        getattr(models.MonthlyTotal, level).label(level) for level in levels
+    ]
+    stmt = select(
+        *group_columns,
+        func.sum(models.MonthlyTotal.hours).label("time"),
+        func.sum(models.MonthlyTotal.count).label("count"),
+    ).group_by(*group_columns)
+    if since is not None:
+        stmt = stmt.where(models.MonthlyTotal.month >= f"{since:%Y-%m}")
+    if until is not None:
+        stmt = stmt.where(models.MonthlyTotal.month < f"{until:%Y-%m}")
+    if dev:
+        stmt = stmt.where(models.MonthlyTotal.dev.in_(dev))
+    if project:
+        stmt = stmt.where(models.MonthlyTotal.project.in_(project))
+    return stmt
+
+
+def select_totals(
+    levels: Sequence[str],
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    dev: Optional[Iterable[str]] = None,
+    project: Optional[Iterable[str]] = None,
+):
+    """Build a query summing the hours of time entries for every combination of levels
+
+    Parameters
+    ----------
+    levels : Sequence[str]
+        Levels to group by; each one of TOTALS_LEVELS
+    since, until, dev, project :
+        Filters, as for select_time_entries()
+    """
+    # Whole months can be totalled from the (much smaller) monthly_totals table
+    if _is_month_start(since) and _is_month_start(until):
+        return _select_monthly_totals(levels, since, until, dev, project)
+
+    group_columns = [_totals_column(level).label(level) for level in levels]
+    stmt = select(
+        *group_columns,
+        func.sum(models.TimeEntry.hours).label("time"),
+        func.count().label("count"),
+    ).group_by(*group_columns)
+    return _filter_time_entries(stmt, since, until, dev, project)
+
+
+def totals_tree(rows: Iterable, levels: Sequence[str]) -> Dict:
+    """Assemble the rows returned by a select_totals() query into a tree of totals
+
+    Parameters
+    ----------
+    rows : Iterable
+        Result rows of the query
+    levels : Sequence[str]
+        Levels the query was grouped by
+
+    Returns
+    -------
+    Dict:
+        The total 'time' and 'count' of all entries, with the totals of each group
+        of the first level under 'groups', each of those having the totals of the
+        next level under its own 'groups' entry, etc.  Groups are sorted by time.
+    """
+
+    def new_node():
+        return {"time": 0.0, "count": 0, "groups": {}}
+
+    root = new_node()
+    for row in rows:
+        node = root
+        node["time"] += row.time
+        node["count"] += row.count
+        for level in levels:
+            node = node["groups"].setdefault(row._mapping[level], new_node())
+            node["time"] += row.time
+            node["count"] += row.count
+
+    def to_lists(node):
+        groups = [
+            {"name": name, **to_lists(child)} for name, child in node["groups"].items()
+        ]
+        groups.sort(key=lambda group: group["time"], reverse=True)
+        totals = {"time": node["time"], "count": node["count"]}
+        if groups:
+            totals["groups"] = groups
+        return totals
+
+    return {"levels": list(levels), **to_lists(root)}
+
+
+async def get_totals_async(db: AsyncSession, levels: Sequence[str], **filters) -> Dict:
+    result = await db.execute(select_totals(levels, **filters))
+    return totals_tree(result, levels)
+
+
+def build_event(
+    time: datetime.date, payload: Dict, uuid: Optional[str] = None
+) -> models.Event:
     # Get the webhook event ID from the payload
     try:
         dev_id = payload["user"]["id"]
     except KeyError as e:
         raise models.CreateEventError("Missing event user ID in payload JSON") from e
-    db_event = models.Event(dev_id=dev_id, time=time, payload=payload)
+    # Extract any time tracking information from the payload
+    try:
+        time_entries = [
+            models.TimeEntry(time=time, **entry)
+            for entry in payloads.time_entries_from_payload(payload)
+        ]
+    except (KeyError, TypeError):
+        # Store the event, but leave it out of the time tracking (as
+        # backfill_time_entries() does)
+        time_entries = []
+    return models.Event(
+        dev_id=dev_id,
+        time=time,
+        payload=payload,
+        uuid=uuid,
+        time_entries=time_entries,
+    )
+
+
+def _monthly_totals_upsert(db_events: Iterable[models.Event]):
+    # Add the hours of the events' time entries to the monthly totals
+    totals: Dict = {}
+    for db_event in db_events:
+        for entry in db_event.time_entries:
+            key = (f"{entry.time:%Y-%m}", entry.dev, entry.project, entry.issue)
+            hours, count = totals.get(key, (0.0, 0))
+            totals[key] = (hours + entry.hours, count + 1)
+    if not totals:
+        return None
+
+    stmt = insert(models.MonthlyTotal).values(
+        [
+            dict(
+                month=month,
+                dev=dev,
+                project=project,
+                issue=issue,
+                hours=hours,
+                count=count,
+            )
+            for (month, dev, project, issue), (hours, count) in totals.items()
+        ]
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["month", "dev", "project", "issue"],
+        set_={
+            "hours": models.MonthlyTotal.hours + stmt.excluded.hours,
+            "count": models.MonthlyTotal.count + stmt.excluded.count,
+        },
+    )
+
+
+def rebuild_monthly_totals(db: Session) -> int:
+    """Recompute the monthly_totals table from the time entries (the caller commits)
+
+    Parameters
+    ----------
+    db : Session
+        Database session
+
+    Returns
+    -------
+    int:
+        Number of rows in the rebuilt table
+    """
+    db.execute(models.MonthlyTotal.__table__.delete())
+    group_columns = [
+        func.strftime("%Y-%m", models.TimeEntry.time),
+        models.TimeEntry.dev,
+        models.TimeEntry.project,
+        models.TimeEntry.issue,
+    ]
+    db.execute(
+        insert(models.MonthlyTotal).from_select(
+            ["month", "dev", "project", "issue", "hours", "count"],
+            select(
+                *group_columns, func.sum(models.TimeEntry.hours), func.count()
+            ).group_by(*group_columns),
+        )
+    )
+    return db.scalar(select(func.count()).select_from(models.MonthlyTotal)) or 0
+
+
+def create_event(
+    db: Session, time: datetime.date, payload: Dict, uuid: Optional[str] = None
+):
+    db_event = build_event(time, payload, uuid)
     db.add(db_event)
-    db.commit()
+    # The monthly totals are updated in the same transaction as the event is stored
+    upsert = _monthly_totals_upsert([db_event])
+    if upsert is not None:
+        db.execute(upsert)
+    try:
+        db.commit()
+    except IntegrityError:
+        # A retried delivery of an event which has already been stored
+        db.rollback()
+        db_existing = get_event_by_uuid(db, uuid) if uuid is not None else None
+        if db_existing is None:
+            raise
+        return db_existing
     db.refresh(db_event)
     return db_event
+
+
+async def create_event_async(
+    db: AsyncSession, time: datetime.date, payload: Dict, uuid: Optional[str] = None
+):
+    db_event = build_event(time, payload, uuid)
+    db.add(db_event)
+    # The monthly totals are updated in the same transaction as the event is stored
+    upsert = _monthly_totals_upsert([db_event])
+    if upsert is not None:
+        await db.execute(upsert)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A retried delivery of an event which has already been stored
+        await db.rollback()
+        db_existing = (
+            await get_event_by_uuid_async(db, uuid) if uuid is not None else None
+        )
+        if db_existing is None:
+            raise
+        return db_existing
+    await db.refresh(db_event)
+    return db_event
+
+
+def get_event_by_uuid(db: Session, uuid: str) -> Optional[models.Event]:
+    return db.scalars(select(models.Event).where(models.Event.uuid == uuid)).first()
+
+
+async def get_event_by_uuid_async(
+    db: AsyncSession, uuid: str
+) -> Optional[models.Event]:
+    result = await db.scalars(select(models.Event).where(models.Event.uuid == uuid))
+    return result.first()
+
+
+def create_events(db: Session, db_events: Iterable[models.Event]) -> List[int]:
+    """Write several events to the database in a single transaction
+
+    Parameters
+    ----------
+    db : Session
+        Database session
+    db_events : Iterable[models.Event]
+        Events to write, as generated by build_event()
+
+    Returns
+    -------
+    List[int]:
+        The database IDs of the written events, in the order given.  Events with
+        the UUID of one already stored (or earlier in the batch) are not written
+        again and are given the ID of the original.
+    """
+    db_events = list(db_events)
+
+    uuids = {db_event.uuid for db_event in db_events if db_event.uuid is not None}
+    if uuids:
+        originals = dict(
+            db.execute(
+                select(models.Event.uuid, models.Event.id).where(
+                    models.Event.uuid.in_(uuids)
+                )
+            ).all()
+        )
+    else:
+        originals = {}
+    new_events = {}
+    db_events_added = []
+    for db_event in db_events:
+        if db_event.uuid is None:
+            db_events_added.append(db_event)
+        elif db_event.uuid not in originals and db_event.uuid not in new_events:
+            new_events[db_event.uuid] = db_event
+            db_events_added.append(db_event)
+    db.add_all(db_events_added)
+    upsert = _monthly_totals_upsert(db_events_added)
+    if upsert is not None:
+        db.execute(upsert)
+
+    # Flush first so that IDs can be read without re-querying after the commit
+    db.flush()
+    event_ids = []
+    for db_event in db_events:
+        if db_event.uuid is None:
+            event_ids.append(db_event.id)
+        elif db_event.uuid in originals:
+            event_ids.append(originals[db_event.uuid])
+        else:
+            event_ids.append(new_events[db_event.uuid].id)
+    db.commit()
+    return event_ids
+
+
+def backfill_time_entries(db: Session, chunk_size: int = 1000) -> int:
+    """Create time entries for events stored before the time_entries table existed
+
+    Events are read in chunks, so that memory use does not grow with the number
+    of events; the entries are all written in the caller's transaction.
+
+    Parameters
+    ----------
+    db : Session
+        Database session
+    chunk_size : int
+        Number of events to read at a time
+
+    Returns
+    -------
+    int:
+        Number of time entries created
+    """
+    has_entries = (
+        select(models.TimeEntry.id)
+        .where(models.TimeEntry.event_id == models.Event.id)
+        .exists()
+    )
+    n_entries = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(models.Event.id, models.Event.time, models.Event.payload)
+            .where(models.Event.id > last_id, ~has_entries)
+            .order_by(models.Event.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        for event_id, time, payload in rows:
+            try:
+                entries = payloads.time_entries_from_payload(payload)
+            except (KeyError, TypeError):
+                # Leave malformed events out of the time tracking, as before
+                continue
+            db.add_all(
+                [
+                    models.TimeEntry(event_id=event_id, time=time, **entry)
+                    for entry in entries
+                ]
+            )
+            n_entries += len(entries)
+        db.flush()
+        last_id = rows[-1].id
+    return n_entries
+
+
+def add_event_uuids(db: Session) -> None:
+    """Add the (uniquely indexed) UUID column to an events table without one (the caller commits)"""
+    columns = [row[1] for row in db.execute(text("PRAGMA table_info(events)"))]
+    if "uuid" not in columns:
+        db.execute(text("ALTER TABLE events ADD COLUMN uuid VARCHAR"))
+    db.execute(
+        text("CREATE UNIQUE INDEX IF NOT EXISTS ix_events_uuid ON events (uuid)")
+    )
+
+
+def get_schema_version(db: Session) -> int:
+    return db.execute(text("PRAGMA user_version")).scalar_one()
+
+
+def _begin_immediate(db: Session) -> None:
+    # Take the database's write lock for the session's transaction, waiting for
+    # as long as another process holds it (eg. while it upgrades the database)
+    while True:
+        try:
+            db.execute(text("BEGIN IMMEDIATE"))
+            return
+        except OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            db.rollback()
+
+
+def upgrade_database(db: Session) -> int:
+    """Create a database's tables, and bring one written by an earlier version of the app up to date
+
+    The upgrade is made in a single transaction, holding the database's write
+    lock, so that it is safe for any number of processes to run it at once:
+    whichever takes the lock first upgrades the database, and the others find
+    it up to date once they get the lock.  Must be called before anything else
+    is done with the session.
+
+    Parameters
+    ----------
+    db : Session
+        Database session
+
+    Returns
+    -------
+    int:
+        The schema version the database had before the upgrade
+    """
+    # Nothing to do (or lock) if the database is already up to date
+    version = get_schema_version(db)
+    if version >= models.SCHEMA_VERSION:
+        return version
+    db.rollback()
+
+    _begin_immediate(db)
+    try:
+        # Read again, now that no other process can be upgrading the database
+        version = get_schema_version(db)
+        if version < models.SCHEMA_VERSION:
+            models.Base.metadata.create_all(bind=db.connection())
+            if version < 1:
+                backfill_time_entries(db)
+            if version < 2:
+                add_event_uuids(db)
+            if version < 3:
+                rebuild_monthly_totals(db)
+            db.execute(text(f"PRAGMA user_version = {models.SCHEMA_VERSION}"))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return version
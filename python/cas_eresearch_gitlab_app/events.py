@@ -1,18 +1,24 @@
 import sqlite3
 import json
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
 import numpy as np
-from typing import Dict
-from dateutil.relativedelta import relativedelta
+from typing import Dict, List, Optional, Tuple
 from pandas.api.types import is_list_like
 from pathlib import Path
 from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
 from pandas.core.frame import DataFrame
 
+from . import partitions, payloads, storage
+
+TIME_STR_FMT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Columns with few distinct values, which are stored as categoricals
+CATEGORICAL_COLUMNS = ["dev", "project", "issue"]
+SNAPSHOT_METADATA_KEY = b"cas_eresearch_gitlab_app"
+
 
 class BaseException(Exception):
     """Base class for exceptions"""
@@ -30,6 +36,170 @@ class InvalidGroupError(BaseException):
     pass
 
 
+def _read_time_entries(
+    con: sqlite3.Connection, after_id: int, last_id: int
+) -> DataFrame:
+    df = pd.read_sql_query(
+        "SELECT time AS date, dev, project, hours AS time, issue FROM time_entries"
+        " WHERE event_id > ? AND event_id <= ? ORDER BY id",
+        con,
+        params=(after_id, last_id),
+    )
+    df["date"] = pd.to_datetime(df["date"], format=TIME_STR_FMT)
+    return df
+
+
+# Time entries extracted from the raw event payloads by SQLite itself, so that only
+# time tracking events (and only the fields needed) are passed back to Python
+_EXTRACT_EVENTS_SQL = """
+SELECT
+    time AS date,
+    json_extract(payload, '$.user.name') AS dev,
+    json_extract(payload, '$.project.namespace') || '/' ||
+        json_extract(payload, '$.project.name') AS project,
+    json_extract(payload, '$.changes.total_time_spent.current') -
+        json_extract(payload, '$.changes.total_time_spent.previous') AS seconds,
+    json_extract(payload, '$.object_attributes.title') AS issue
+FROM events
+WHERE id > ? AND id <= ?
+    AND json_type(payload, '$.changes.total_time_spent') IS NOT NULL
+ORDER BY id
+"""
+
+
+def _extract_events(con: sqlite3.Connection, after_id: int, last_id: int) -> DataFrame:
+    df = pd.read_sql_query(_EXTRACT_EVENTS_SQL, con, params=(after_id, last_id))
+    df["date"] = pd.to_datetime(df["date"], format=TIME_STR_FMT)
+
+    # Same rounding as payloads.timedelta_to_hours()
+    df["time"] = np.floor(df.pop("seconds").astype(float) / 60) / 60
+
+    return df[["date", "dev", "project", "time", "issue"]]
+
+
+def _parse_events(con: sqlite3.Connection, after_id: int, last_id: int) -> DataFrame:
+    # Read event table into a dataframe
+    df_sql = pd.read_sql_query(
+        "SELECT * from events WHERE id > ? AND id <= ?", con, params=(after_id, last_id)
+    )
+
+    # Select time entry events and create new dataframe
+    event_list = []
+    for time_str, payload_str in zip(df_sql.time, df_sql.payload):
+        event_time = datetime.strptime(time_str, TIME_STR_FMT)
+        for entry in payloads.time_entries_from_payload(json.loads(payload_str)):
+            event_list.append(
+                [
+                    event_time,
+                    entry["dev"],
+                    entry["project"],
+                    entry["hours"],
+                    entry["issue"],
+                ]
+            )
+
+    return pd.DataFrame(
+        event_list, columns=["date", "dev", "project", "time", "issue"]
+    ).astype({"date": "datetime64[ns]"})
+
+
+def read_database(filename: str | Path, after_id: int = 0) -> Tuple[DataFrame, int]:
+    """Read the time entries from an app database
+
+    Databases which have been upgraded to include the time_entries table are read
+    from it directly.  Older ones have their raw event payloads parsed instead.
+
+    Parameters
+    ----------
+    filename : str | Path
+        SQLite database file
+    after_id : int
+        Only read entries for events with IDs greater than this
+
+    Returns
+    -------
+    DataFrame:
+        Time entries, with columns 'date', 'dev', 'project', 'time', 'issue' and
+        'month' (a monthly period)
+    int:
+        ID of the last event read, to be passed as after_id for the next read
+    """
+
+    # Create a SQL connection to our SQLite database
+    con = storage.connect_read_only(filename)
+    try:
+        # Use one transaction, so the high-water mark is consistent with what is read
+        con.execute("BEGIN")
+        last_id = con.execute("SELECT max(id) FROM events").fetchone()[0] or 0
+        last_id = max(last_id, after_id)
+        schema_version = con.execute("PRAGMA user_version").fetchone()[0]
+        if schema_version >= 1:
+            df = _read_time_entries(con, after_id, last_id)
+        else:
+            try:
+                df = _extract_events(con, after_id, last_id)
+            except pd.errors.DatabaseError:
+                # SQLite may have been built without its JSON functions
+                df = _parse_events(con, after_id, last_id)
+    finally:
+        con.close()
+
+    df["month"] = df["date"].dt.to_period("M")
+
+    return df, last_id
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+    except ImportError as e:
+        raise ImportError(
+            "Snapshots need pyarrow; install it with the 'snapshot' extra."
+        ) from e
+    return pyarrow, pyarrow.feather
+
+
+def time_to_string(time: float) -> str:
+    weeks = time / 40.0
+    if weeks < 1:
+        return f"{time}h"
+    else:
+        return f"{time/40.:.1f}w"
+
+
+def _compact(df: DataFrame) -> DataFrame:
+    # Store repeated strings once each, with integer codes on every row
+    for column in CATEGORICAL_COLUMNS:
+        if column in df and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype("category")
+    df["month"] = df.index.to_period("M")
+    return df
+
+
+def _align_categories(df: DataFrame, df_new: DataFrame) -> DataFrame:
+    # Give the categoricals of a new frame the same categories as an existing
+    # one (adding any new values to the end of both), so that the two can be
+    # concatenated without falling back to object columns
+    for column in CATEGORICAL_COLUMNS:
+        if column in df and column in df_new:
+            categories = df[column].cat.categories
+            new = df_new[column].cat.categories.difference(categories)
+            if len(new) > 0:
+                df[column] = df[column].cat.add_categories(new)
+            df_new[column] = df_new[column].cat.set_categories(
+                df[column].cat.categories
+            )
+    return df_new
+
+
+def _monthly_totals(df: DataFrame) -> pd.Series:
+    return df.groupby(pd.Grouper(freq="ME", closed="left", label="left"))["time"].sum()
+
+
+_NO_ROWS = np.array([], dtype=np.intp)
+
+
 class Groups(object):
     def __init__(self, ds_in: "DataSet", columns: Iterable[str] | str):
 
@@ -44,9 +214,9 @@ class Groups(object):
             raise TypeError("'columns' is not string or iterable of strings")
 
         self._ds = ds_in
-        self._subgroups = self._ds.df.groupby(by=columns)
+        self._subgroups = self._ds.df.groupby(by=columns, observed=True)
         self._group_names = self._subgroups.indices
-        self._group_columns = columns
+        self._group_columns: List[str] = list(columns)
 
     def get_by_name(self, columns: str) -> DataFrame:
         try:
@@ -86,13 +256,46 @@ class Groups(object):
         for group_name in self._group_names:
             yield self.get_by_name(group_name)
 
-    def plot(self, groups: Iterable[str] = None, plot="time", n=None, title=None):
+    def monthly(self, group_names=None, column="time") -> DataFrame:
+        """Monthly totals of each group
+
+        Parameters
+        ----------
+        group_names : optional
+            Groups to return, in order (default: all of them, in the current order)
+        column : str
+            Column to total
+
+        Returns
+        -------
+        DataFrame:
+            Matrix of totals, with one row for each of the dataset's dates and one
+            column for each group
+        """
+        if group_names is None:
+            group_names = self._group_names
+        monthly = (
+            self._ds.df.groupby(
+                [pd.Grouper(freq="ME", closed="left", label="left")]
+                + self._group_columns,
+                observed=True,
+            )[column]
+            .sum()
+            .unstack(level=list(range(1, len(self._group_columns) + 1)), fill_value=0)
+        )
+        return monthly.reindex(
+            index=self._ds.dates, columns=list(group_names), fill_value=0
+        )
 
+    def _figure(
+        self, groups: Optional[Iterable[str]] = None, plot="time", n=None, title=None
+    ):
+        # Assemble everything needed to render a figure with plotting.render_figure()
         if groups:
 
             # Validate that the groups passed in is a string or list of strings
             if isinstance(groups, str):
-                group_names = [groups]
+                groups = [groups]
             elif isinstance(groups, Iterable):
                 for group_name in groups:
                     if not isinstance(group_name, str):
@@ -100,53 +303,10 @@ class Groups(object):
             else:
                 raise TypeError("'groups' is not string or iterable of strings")
 
-            group_names = groups
+            group_names = list(groups)
 
         else:
-            group_names = self._group_names
-
-        sns.set_theme()
-        fig, ax = plt.subplots()
-        ax.set_ylabel("Monthly Total [h]")
-        ax.set_xlabel("Date")
-
-        bottom_master = np.zeros(len(self._ds.dates))
-        sum_other = np.zeros(len(self._ds.dates))
-
-        for i_group, group_name in enumerate(group_names):
-            time_series = self.time_series(group_name, column=plot)
-            dates = time_series["date"]
-            amounts = time_series[plot]
-
-            if n is None or i_group < n:
-                bottom = np.zeros(len(dates))
-                for i_date, date in enumerate(dates):
-                    bottom[i_date] = bottom_master[self._ds.dates.index(date)]
-                ax.bar(
-                    dates,
-                    amounts,
-                    width=relativedelta(months=1),
-                    bottom=bottom,
-                    label=group_name,
-                )
-                for date, amount in zip(dates, amounts):
-                    bottom_master[self._ds.dates.index(date)] += amount
-            else:
-                for date, amount in zip(dates, amounts):
-                    sum_other[self._ds.dates.index(date)] += amount
-
-        if n is not None:
-            ax.bar(
-                self._ds.dates,
-                sum_other,
-                width=relativedelta(months=1),
-                bottom=bottom_master,
-                label="Other",
-            )
-        ax.legend()
-        if title:
-            ax.set_title(title)
-        fig.autofmt_xdate()
+            group_names = list(self._group_names)
 
         if title:
             filename_fig = f"plot_{title}.pdf"
@@ -155,13 +315,57 @@ class Groups(object):
                 filename_fig = f"plot_{group_names[0]}.pdf"
             else:
                 filename_fig = "plot_groups.pdf"
-        fig.savefig(filename_fig)
-        plt.close()
+        # Project names include their namespace
+        filename_fig = filename_fig.replace("/", "_")
+
+        return dict(
+            dates=self._ds.dates,
+            amounts=self.monthly(group_names, column=plot).to_numpy(),
+            labels=[
+                ", ".join(group_name) if isinstance(group_name, tuple) else group_name
+                for group_name in group_names
+            ],
+            n=n,
+            title=title,
+            filename_fig=filename_fig,
+        )
+
+    def plot(
+        self, groups: Optional[Iterable[str]] = None, plot="time", n=None, title=None
+    ):
+        # Imported here, so that matplotlib is only loaded when something is plotted
+        from . import plotting
+
+        filename_fig = plotting.render_figure(**self._figure(groups, plot, n, title))
         print(f"Figure written to file: {filename_fig}")
 
 
 class DataSet(object):
-    def __init__(self, path: str | Path = None, df=None):
+    def __init__(
+        self,
+        path: Optional[str | Path] = None,
+        df=None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        processes: int = 1,
+    ):
+        """Time entries, read from the databases in a directory or given as a dataframe
+
+        Parameters
+        ----------
+        path : str | Path
+            Directory of the databases to read
+        df : DataFrame
+            Time entries to start from
+        since : datetime
+            Only keep entries at or after this time (monthly partitions of the
+            databases which end before it are not read at all)
+        until : datetime
+            Only keep entries before this time (monthly partitions which start at
+            or after it are not read at all)
+        processes : int
+            Number of processes to read the databases with (None to use every core)
+        """
 
         # Either path or df needs to be passed
         if path is None and df is None:
@@ -176,92 +380,211 @@ class DataSet(object):
         else:
             dfs = []
 
+        # High-water marks (last event ID and file stamp) of each database read
+        self._path = path
+        self._since = pd.Timestamp(since) if since is not None else None
+        self._until = pd.Timestamp(until) if until is not None else None
+        self._processes = processes
+        self._watermarks: Dict[str, Tuple[int, Tuple]] = {}
         if path:
-            for filename_in in [
-                filename for filename in os.listdir(path) if filename.endswith(".db")
-            ]:
-
-                table_name = "events"
-                time_str_fmt = "%Y-%m-%d %H:%M:%S.%f"
-
-                def timedelta_to_hours(delta):
-                    hours, remainder = divmod(delta.total_seconds(), 3600)
-                    minutes, seconds = divmod(remainder, 60)
-                    return hours + minutes / 60.0
-
-                # Create a SQL connection to our SQLite database
-                con = sqlite3.connect(filename_in)
-
-                # Read event table into a dataframe
-                df_sql = pd.read_sql_query(f"SELECT * from {table_name}", con)
-
-                # Select time entry events and create new dataframe
-                event_list = []
-                for i_payload, (time_str, payload_str) in enumerate(
-                    zip(df_sql.time, df_sql.payload)
-                ):
-                    event_time = datetime.strptime(time_str, time_str_fmt)
-                    payload = json.loads(payload_str)
-                    user = payload["user"]
-                    project = payload["project"]
-                    changes = payload["changes"]
-                    metadata = payload["object_attributes"]
-
-                    if "total_time_spent" in changes.keys():
-                        # print(json.dumps(payload,sort_keys=True,indent=4))
-                        t_1 = changes["total_time_spent"]["previous"]
-                        t_2 = changes["total_time_spent"]["current"]
-                        delta = timedelta(seconds=(t_2 - t_1))
-                        event_list.append(
-                            [
-                                event_time,
-                                user["name"],
-                                f"{project['namespace']}/{project['name']}",
-                                timedelta_to_hours(delta),
-                                metadata["title"],
-                            ]
-                        )
-
-                df = pd.DataFrame(
-                    event_list, columns=["date", "dev", "project", "time", "issue"]
-                )
+            dfs.extend(self._read_new(path))
 
-                df["month"] = df["date"].apply(lambda row: f"{row:%Y-%m}")
-
-                dfs.append(df)
-
-        self.df = pd.concat(dfs, ignore_index=True)
+        # Leave out empty frames (eg. partitions with no entries in the date range)
+        self.df = pd.concat([df for df in dfs if len(df) > 0] or dfs, ignore_index=True)
         self.df = self.df.set_index("date")
         self.df.sort_index(inplace=True)
+        self.df = _compact(self.df)
+        self._clear_caches()
+
+    @classmethod
+    def _view(cls, df: DataFrame) -> "DataSet":
+        # A DataSet of some of another's (sorted and compacted) entries, which is not
+        # tied to any databases
+        ds = cls.__new__(cls)
+        ds.df = df
+        ds._path = None
+        ds._since = None
+        ds._until = None
+        ds._processes = 1
+        ds._watermarks = {}
+        ds._clear_caches()
+        return ds
+
+    def _clear_caches(self) -> None:
+        # Monthly totals and the row positions of each column's values are only
+        # computed when they are first needed
+        self._time_t = None
+        self._indices: Dict[str, Dict] = {}
+
+    @property
+    def date_min(self):
+        return self.df.index.min()
+
+    @property
+    def date_max(self):
+        return self.df.index.max()
+
+    @property
+    def time_t(self) -> pd.Series:
+        if self._time_t is None:
+            self._time_t = _monthly_totals(self.df)
+        return self._time_t
+
+    @property
+    def dates(self) -> List:
+        return sorted(self.time_t.index)
+
+    def _read_new(self, path: str | Path) -> List[DataFrame]:
+        reads = []
+        for filename_in in sorted(os.listdir(path)):
+            # Skip monthly partitions outside of the date range
+            if not filename_in.endswith(".db") or not partitions.partition_overlaps(
+                filename_in, self._since, self._until
+            ):
+                continue
+
+            # Skip databases which have not been written to since they were last read
+            filename_db = os.path.join(path, filename_in)
+            stamp = storage.file_stamp(filename_db)
+            after_id, stamp_last = self._watermarks.get(filename_in, (0, None))
+            if stamp == stamp_last:
+                continue
+            reads.append((filename_in, filename_db, after_id, stamp))
+
+        filenames_db = [filename_db for _, filename_db, _, _ in reads]
+        after_ids = [after_id for _, _, after_id, _ in reads]
+        if self._processes == 1 or len(reads) < 2:
+            results = list(map(read_database, filenames_db, after_ids))
+        else:
+            with ProcessPoolExecutor(max_workers=self._processes) as executor:
+                results = list(executor.map(read_database, filenames_db, after_ids))
+
+        dfs = []
+        for (filename_in, _, _, stamp), (df, last_id) in zip(reads, results):
+            self._watermarks[filename_in] = (last_id, stamp)
+            if self._since is not None:
+                df = df[df["date"] >= self._since]
+            if self._until is not None:
+                df = df[df["date"] < self._until]
+            dfs.append(df)
+        return dfs
+
+    def refresh(self) -> int:
+        """Add any entries written to the databases since they were last read
+
+        Returns
+        -------
+        int:
+            Number of entries added
+        """
+        if not self._path:
+            return 0
+
+        dfs = [df for df in self._read_new(self._path) if len(df) > 0]
+        if not dfs:
+            return 0
+        df_new = pd.concat(dfs, ignore_index=True).set_index("date").sort_index()
+        df_new = _align_categories(self.df, _compact(df_new))
+
+        # New entries will normally all be later than the existing ones
+        if len(self.df) == 0:
+            self.df = df_new
+        elif df_new.index[0] >= self.df.index[-1]:
+            self.df = pd.concat([self.df, df_new])
+        else:
+            self.df = pd.concat([self.df, df_new]).sort_index(kind="stable")
+
+        # Update any monthly totals, filling any new months without entries
+        time_t = self._time_t
+        self._clear_caches()
+        if time_t is not None:
+            time_t = time_t.add(_monthly_totals(df_new), fill_value=0)
+            self._time_t = time_t.reindex(
+                pd.date_range(
+                    time_t.index.min(), time_t.index.max(), freq="ME", name="date"
+                ),
+                fill_value=0,
+            )
 
-        # Date range
-        self.date_min = self.df.index.min()
-        self.date_max = self.df.index.max()
-        # print(f"Date range: {self.date_min} -> {self.date_max}")
-
-        self.time_t = self.df.groupby(
-            pd.Grouper(freq="ME", closed="left", label="left")
-        )["time"].sum()
-        self.dates = sorted(self.time_t.index)
+        return len(df_new)
+
+    def _positions(self, column: str, value) -> np.ndarray:
+        # Row positions (in order) of the entries with any of the given values
+        if column not in self._indices:
+            if column not in self.df:
+                raise InvalidGroupError(f"Invalid column: {column}")
+            self._indices[column] = self.df.groupby(
+                column, observed=True, sort=False
+            ).indices
+        indices = self._indices[column]
+        if isinstance(value, (set, frozenset, list, tuple)):
+            # Each value once, so that no position is repeated
+            keys = {self._key(column, item) for item in value}
+            positions = [indices[key] for key in keys if key in indices]
+            if len(positions) == 1:
+                return positions[0]
+            return np.sort(np.concatenate(positions)) if positions else _NO_ROWS
+        return indices.get(self._key(column, value), _NO_ROWS)
+
+    def _key(self, column: str, value):
+        # Convert a value to the type of the column's index keys (eg. '2024-01' to
+        # a Period for the month column)
+        dtype = self.df[column].dtype
+        if isinstance(dtype, pd.PeriodDtype) and not isinstance(value, pd.Period):
+            try:
+                return pd.Period(value, freq=dtype.freq)
+            except (TypeError, ValueError):
+                return value
+        return value
+
+    def select(self, since=None, until=None, **columns) -> "DataSet":
+        """Select entries by date range and column values
+
+        Values are looked up in an index of each column's row positions, which is
+        built once and reused by later selections.
+
+        Parameters
+        ----------
+        since : optional
+            Only select entries at or after this time
+        until : optional
+            Only select entries before this time
+        **columns :
+            Values to select for each column, either single values or sets (or
+            lists) of values, eg. dev='dev_a' or project={'group/a', 'group/b'}
+
+        Returns
+        -------
+        DataSet:
+            The selected entries, whose monthly totals are only computed if needed
+        """
+        # Dates are sorted, so a date range is a slice of positions
+        start = 0 if since is None else self.df.index.searchsorted(since, side="left")
+        stop = (
+            len(self.df)
+            if until is None
+            else self.df.index.searchsorted(until, side="left")
+        )
 
-    def subselect(self, queries: Dict):
-        def reformat_string(string_to_escape, reverse=False):
-            if reverse:
-                return string_to_escape.replace('\\"', '"').replace("\\'", "'")
+        positions = None
+        for column, value in columns.items():
+            column_positions = self._positions(column, value)
+            if positions is None:
+                positions = column_positions
             else:
-                return string_to_escape.replace('"', '\\"').replace("'", "\\'")
+                positions = np.intersect1d(
+                    positions, column_positions, assume_unique=True
+                )
 
-        query_string = None
-        for query in queries.keys():
-            if not query_string:
-                query_string = ""
-            else:
-                query_string = query_string + " & "
-            query_string = (
-                query_string + f'`{query}` == "{reformat_string(queries[query])}"'
-            )
+        if positions is None:
+            return DataSet._view(self.df.iloc[start:stop])
+        if start > 0 or stop < len(self.df):
+            positions = positions[(positions >= start) & (positions < stop)]
+        return DataSet._view(self.df.iloc[positions])
 
-        return DataSet(df=self.df.query(query_string))
+    def subselect(self, queries: Dict) -> "DataSet":
+        """Select the entries with the given value of each column (see select())"""
+        return self.select(**queries)
 
     def group(self, columns):
         return Groups(self, columns)
@@ -285,42 +608,74 @@ class DataSet(object):
         else:
             print("Empty dataset.")
 
+    def totals(self, levels=["dev", "project", "issue"]) -> DataFrame:
+        """Compute the total time of every group, at every level, in one pass
+
+        Parameters
+        ----------
+        levels : list
+            Columns to group by, outermost first
+
+        Returns
+        -------
+        DataFrame:
+            One row for each combination of groups present in the data, indexed by
+            the levels.  The column named after each level holds the total time of
+            the enclosing group at that level (so the last holds the row's own total).
+        """
+        levels = list(levels)
+        time = self.df.groupby(levels, sort=False, observed=True)["time"].sum()
+        totals = pd.DataFrame(index=time.index)
+        for i_level, level in enumerate(levels[:-1]):
+            totals[level] = time.groupby(
+                level=list(range(i_level + 1)), sort=False, observed=True
+            ).transform("sum")
+        totals[levels[-1]] = time
+        return totals
+
     def print_totals(
         self,
         levels=["dev", "project", "issue"],
         sort_levels=["project", "dev"],
         _i_level=0,
     ):
-        level = levels[0]
-        groups = self.group(level).reorder(column="time", ascending=False)
-
-        def time_to_string(time: int) -> str:
-            weeks = time / 40.0
-            if weeks < 1:
-                return f"{time}h"
-            else:
-                return f"{time/40.:.1f}w"
-
-        # Sort order of printing?
-        group_names = groups._group_names.values
-        if level in sort_levels:
-            group_names = sorted(group_names, key=str.casefold)
-
-        # Print lines
-        for group in group_names:
-            ds_group = self.subselect({f"{level}": group})
+        totals = self.totals(levels)
+
+        # Sort order of printing: by decreasing time, or alphabetically for
+        # sort_levels, with the groups of each level kept together
+        def sort_key(item):
+            names, times = item
+            key = []
+            for level, name, time in zip(levels, names, times):
+                if level in sort_levels:
+                    key.extend([str(name).casefold(), -time])
+                else:
+                    key.extend(["", -time])
+                key.append(str(name))
+            return key
 
-            time = 0
-            for _, row in ds_group.df.iterrows():
-                time = time + row["time"]
+        rows = sorted(
+            zip(totals.index, totals.itertuples(index=False, name=None)), key=sort_key
+        )
 
-            print(f"{4*_i_level*' '}{group}: {time_to_string(time)}")
-            if len(levels) > 1:
-                self.subselect({f"{level}": group}).print_totals(
-                    levels[1:], sort_levels, _i_level + 1
+        # Print lines, starting a new group whenever a level's name changes
+        names_last = None
+        for names, times in rows:
+            if not isinstance(names, tuple):
+                names = (names,)
+            i_new = 0
+            if names_last is not None:
+                while names[i_new] == names_last[i_new]:
+                    i_new += 1
+                if i_new == 0 and _i_level == 0 and len(levels) > 1:
+                    print()
+            for i_level in range(i_new, len(levels)):
+                print(
+                    f"{4*(_i_level+i_level)*' '}{names[i_level]}: {time_to_string(times[i_level])}"
                 )
+            names_last = names
 
-        if _i_level == 1:
+        if names_last is not None and _i_level + len(levels) > 1 and _i_level <= 1:
             print()
 
     def print_summary(self, tail=20):
@@ -334,20 +689,113 @@ class DataSet(object):
         self.print_totals(["project", "dev", "issue"])
 
     def to_json(self):
-        return self.df.to_json()
-
-    def plot(self, column="time", n=5):
+        # Written with the months as strings, as they always have been
+        return self.df.assign(month=self.df["month"].astype(str)).to_json()
+
+    def save_snapshot(self, filename: str | Path) -> None:
+        """Write the DataSet to an (uncompressed, so memory-mappable) Arrow/Feather file
+
+        The high-water marks of the databases the DataSet was read from are stored
+        with it, so that load_snapshot() only needs to read what has been added since.
+
+        Parameters
+        ----------
+        filename : str | Path
+            Snapshot file to write
+        """
+        pa, feather = _import_pyarrow()
+
+        table = pa.Table.from_pandas(self.df.reset_index(), preserve_index=False)
+        source = {
+            "path": str(self._path) if self._path else None,
+            "since": self._since.isoformat() if self._since is not None else None,
+            "until": self._until.isoformat() if self._until is not None else None,
+            "watermarks": self._watermarks,
+        }
+        table = table.replace_schema_metadata(
+            {**table.schema.metadata, SNAPSHOT_METADATA_KEY: json.dumps(source)}
+        )
+        feather.write_feather(table, filename, compression="uncompressed")
+
+    @classmethod
+    def load_snapshot(
+        cls,
+        filename: str | Path,
+        path: Optional[str | Path] = None,
+        refresh: bool = True,
+    ) -> "DataSet":
+        """Read a DataSet written with save_snapshot()
+
+        Parameters
+        ----------
+        filename : str | Path
+            Snapshot file to read
+        path : str | Path
+            Directory of the databases to refresh from (default: the one the
+            snapshot was read from)
+        refresh : bool
+            Read any entries added to the databases since the snapshot was taken
+
+        Returns
+        -------
+        DataSet:
+            The snapshot's DataSet
+        """
+        pa, feather = _import_pyarrow()
+
+        table = feather.read_table(filename, memory_map=True)
+        source = json.loads(table.schema.metadata[SNAPSHOT_METADATA_KEY])
+
+        ds = cls(df=table.to_pandas())
+        ds._path = path or source["path"]
+        for bound in ["since", "until"]:
+            if source.get(bound):
+                setattr(ds, f"_{bound}", pd.Timestamp(source[bound]))
+        ds._watermarks = {
+            filename_db: (last_id, tuple(tuple(s) if s else s for s in stamp))
+            for filename_db, (last_id, stamp) in source["watermarks"].items()
+        }
+        if refresh:
+            ds.refresh()
+        return ds
+
+    def plot(self, column="time", n=5, processes=1):
+        """Write figures of the monthly time spent on the top projects and by the top devs
+
+        Parameters
+        ----------
+        column : str
+            Column to rank the projects and devs by
+        n : int
+            Number of projects/devs to show individually in each figure
+        processes : int
+            Number of processes to render the figures with (None to use every core)
+        """
+        figures = []
         prjs = self.group("project").reorder(column=column, ascending=False)
         n_plot_prj = min(n, len(prjs._group_names))
-        prjs.plot(n=n_plot_prj, title="Projects")
+        figures.append(prjs._figure(n=n_plot_prj, title="Projects"))
         for i_prj, prj_name in enumerate(prjs._group_names[0:n_plot_prj]):
             ds_prj = self.subselect({"project": prj_name})
             devs = ds_prj.group("dev").reorder(column=column, ascending=False)
             n_plot_dev = min(n, len(devs._group_names))
-            devs.plot(n=n_plot_dev, title=f"{prj_name}")
+            figures.append(devs._figure(n=n_plot_dev, title=f"{prj_name}"))
         devs = self.group("dev").reorder(column=column, ascending=False)
+        n_plot_dev = min(n, len(devs._group_names))
         for i_dev, dev_name in enumerate(devs._group_names[0:n_plot_dev]):
             ds_dev = self.subselect({"dev": dev_name})
             prj = ds_dev.group("project").reorder(column=column, ascending=False)
-            n_plot_dev = min(n, len(prj._group_names))
-            prj.plot(n=n_plot_dev, title=f"{dev_name}")
+            n_plot_prj = min(n, len(prj._group_names))
+            figures.append(prj._figure(n=n_plot_prj, title=f"{dev_name}"))
+
+        from . import plotting
+
+        if processes == 1:
+            filenames = [plotting.render_figure(**figure) for figure in figures]
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                filenames = list(
+                    executor.map(plotting.render_figure_kwargs, figures, chunksize=1)
+                )
+        for filename_fig in filenames:
+            print(f"Figure written to file: {filename_fig}")
@@ -0,0 +1,311 @@
+import csv
+import datetime
+import json
+import sqlite3
+from dateutil.relativedelta import relativedelta
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
+
+from . import storage
+
+DEFAULT_CHUNK_SIZE = 10000
+
+# Columns the rows of each table are filtered on by date; tables not listed here
+# are exported in full
+TIME_COLUMNS = {"events": "time", "time_entries": "time"}
+MONTH_COLUMNS = {"monthly_totals": "month"}
+
+# Format of the times stored by SQLAlchemy, which compare correctly as strings
+SQL_TIME_FMT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def _import_parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError(
+            "Parquet exports need pyarrow; install it with the 'snapshot' extra."
+        ) from e
+    return pyarrow, pyarrow.parquet
+
+
+def payload_column(field: str) -> str:
+    """Return the name of the column a (dotted) payload field is expanded into"""
+    return f"payload.{field}"
+
+
+def _payload_path(field: str) -> str:
+    # Quote each key, so that any field name gives a valid JSON path
+    return "$" + "".join(f'."{key}"' for key in field.split("."))
+
+
+def _table_columns(con: sqlite3.Connection, table: str) -> List[Tuple[str, str]]:
+    return [
+        (row[1], row[2].upper())
+        for row in con.execute("SELECT * FROM pragma_table_info(?)", (table,))
+    ]
+
+
+def _table_query(
+    con: sqlite3.Connection,
+    table: str,
+    since: Optional[datetime.datetime],
+    until: Optional[datetime.datetime],
+    payload_fields: Sequence[str],
+) -> Tuple[str, List, List[Tuple[str, str]]]:
+    columns = _table_columns(con, table)
+    names = [name for name, _ in columns]
+    selected = [f'"{name}"' for name in names]
+    params: List = []
+    if "payload" in names:
+        for field in payload_fields:
+            selected.append("json_extract(payload, ?)")
+            params.append(_payload_path(field))
+            columns.append((payload_column(field), "JSON"))
+
+    conditions = []
+    if table in TIME_COLUMNS:
+        if since is not None:
+            conditions.append(f'"{TIME_COLUMNS[table]}" >= ?')
+            params.append(f"{since:{SQL_TIME_FMT}}")
+        if until is not None:
+            conditions.append(f'"{TIME_COLUMNS[table]}" < ?')
+            params.append(f"{until:{SQL_TIME_FMT}}")
+    elif table in MONTH_COLUMNS:
+        # Include every month which overlaps the range
+        if since is not None:
+            conditions.append(f'"{MONTH_COLUMNS[table]}" >= ?')
+            params.append(f"{since:%Y-%m}")
+        if until is not None:
+            conditions.append(f'"{MONTH_COLUMNS[table]}" <= ?')
+            params.append(f"{until - relativedelta(microseconds=1):%Y-%m}")
+
+    query = f'SELECT {", ".join(selected)} FROM "{table}"'
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+    order = "id" if "id" in names else "rowid"
+    return f"{query} ORDER BY {order}", params, columns
+
+
+def iter_chunks(
+    con: sqlite3.Connection,
+    table: str,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    payload_fields: Sequence[str] = (),
+) -> Tuple[List[Tuple[str, str]], Iterator[List[Tuple]]]:
+    """Read the rows of a table in chunks, so that memory use does not grow with its size
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Connection to the database
+    table : str
+        Table to read
+    since : Optional[datetime.datetime]
+        Only read rows at or after this time (for tables with a time or month)
+    until : Optional[datetime.datetime]
+        Only read rows before this time (for tables with a time or month)
+    chunk_size : int
+        Number of rows per chunk
+    payload_fields : Sequence[str]
+        Dotted paths of payload fields to add as columns (for tables with a payload)
+
+    Returns
+    -------
+    Tuple[List[Tuple[str, str]], Iterator[List[Tuple]]]:
+        The names and (declared) types of the columns, and an iterator over the chunks
+    """
+    if chunk_size < 1:
+        raise ValueError(f"Invalid chunk size ({chunk_size}); must be >= 1.")
+    query, params, columns = _table_query(con, table, since, until, payload_fields)
+
+    def chunks():
+        cursor = con.execute(query, params)
+        try:
+            while rows := cursor.fetchmany(chunk_size):
+                yield rows
+        finally:
+            cursor.close()
+
+    return columns, chunks()
+
+
+class _TsvWriter(object):
+    def __init__(self, filename: Path, columns: List[Tuple[str, str]]):
+        self._file = open(filename, "w", newline="")
+        self._writer = csv.writer(self._file, delimiter="\t", lineterminator="\n")
+        self._writer.writerow([name for name, _ in columns])
+
+    def write(self, rows: List[Tuple]) -> None:
+        self._writer.writerows(rows)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _NdjsonWriter(object):
+    def __init__(self, filename: Path, columns: List[Tuple[str, str]]):
+        self._file = open(filename, "w")
+        self._names = [name for name, _ in columns]
+        # Payloads are written as JSON, rather than as strings holding JSON
+        self._json = [name == "payload" for name in self._names]
+
+    def write(self, rows: List[Tuple]) -> None:
+        lines = []
+        for row in rows:
+            record = {
+                name: json.loads(value) if is_json and value is not None else value
+                for name, value, is_json in zip(self._names, row, self._json)
+            }
+            lines.append(json.dumps(record) + "\n")
+        self._file.writelines(lines)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _ParquetWriter(object):
+    def __init__(self, filename: Path, columns: List[Tuple[str, str]]):
+        self._pa, parquet = _import_parquet()
+        pa = self._pa
+        types = {"INTEGER": pa.int64(), "FLOAT": pa.float64(), "REAL": pa.float64()}
+        fields = []
+        self._converters: List[Optional[Callable[[str], Any]]] = []
+        for name, declared_type in columns:
+            if declared_type == "DATETIME":
+                fields.append(pa.field(name, pa.timestamp("us")))
+                self._converters.append(datetime.datetime.fromisoformat)
+            elif declared_type in types:
+                fields.append(pa.field(name, types[declared_type]))
+                self._converters.append(None)
+            else:
+                # Anything else (including JSON) is written as text
+                fields.append(pa.field(name, pa.string()))
+                self._converters.append(str)
+        self._schema = pa.schema(fields)
+        # Each chunk is written as a row group
+        self._writer = parquet.ParquetWriter(filename, self._schema)
+
+    def write(self, rows: List[Tuple]) -> None:
+        arrays = []
+        for values, converter, field in zip(zip(*rows), self._converters, self._schema):
+            column: Sequence[Any] = values
+            if converter is not None:
+                column = [
+                    None if value is None else converter(value) for value in values
+                ]
+            arrays.append(self._pa.array(column, type=field.type))
+        self._writer.write_batch(self._pa.record_batch(arrays, schema=self._schema))
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+# Writers for each export format, which also name the files written
+EXPORT_FORMATS: Dict[str, Type[Union[_TsvWriter, _NdjsonWriter, _ParquetWriter]]] = {
+    "tsv": _TsvWriter,
+    "ndjson": _NdjsonWriter,
+    "parquet": _ParquetWriter,
+}
+
+
+def export_database(
+    filename: str | Path,
+    output_dir: str | Path,
+    export_format: str = "tsv",
+    tables: Optional[Sequence[str]] = None,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    payload_fields: Sequence[str] = (),
+) -> Dict[str, int]:
+    """Export the tables of a database, one file per table
+
+    Rows are streamed from the database to the files in chunks, so memory use
+    depends on the chunk size rather than on the size of the database.
+
+    Parameters
+    ----------
+    filename : str | Path
+        Database to export (opened read-only)
+    output_dir : str | Path
+        Directory to write the files ('<table>.<format>') to
+    export_format : str
+        One of 'tsv', 'ndjson' or 'parquet'
+    tables : Optional[Sequence[str]]
+        Tables to export (default: all of them)
+    since : Optional[datetime.datetime]
+        Only export rows at or after this time (for tables with a time or month)
+    until : Optional[datetime.datetime]
+        Only export rows before this time (for tables with a time or month)
+    chunk_size : int
+        Number of rows to read and write at a time
+    payload_fields : Sequence[str]
+        Dotted paths of payload fields (eg. 'user.username') to add as columns
+        'payload.<field>' (for tables with a payload)
+
+    Returns
+    -------
+    Dict[str, int]:
+        Number of rows exported from each table
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Invalid export format ({export_format}); must be one of {list(EXPORT_FORMATS)}."
+        )
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    con = storage.connect_read_only(filename)
+    try:
+        table_names = [
+            row[0]
+            for row in con.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+            )
+        ]
+        if tables is not None:
+            unknown = [table for table in tables if table not in table_names]
+            if unknown:
+                raise ValueError(
+                    f"Unknown tables ({', '.join(unknown)}); must be any of {table_names}."
+                )
+            table_names = list(tables)
+
+        n_rows = {}
+        for table in table_names:
+            columns, chunks = iter_chunks(
+                con,
+                table,
+                since=since,
+                until=until,
+                chunk_size=chunk_size,
+                payload_fields=payload_fields,
+            )
+            writer = EXPORT_FORMATS[export_format](
+                output_dir / f"{table}.{export_format}", columns
+            )
+            try:
+                n_rows[table] = 0
+                for rows in chunks:
+                    writer.write(rows)
+                    n_rows[table] += len(rows)
+            finally:
+                writer.close()
+    finally:
+        con.close()
+    return n_rows
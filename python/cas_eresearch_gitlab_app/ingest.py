@@ -0,0 +1,350 @@
+import asyncio
+import datetime
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from . import crud, metrics, models
+
+package_name = __name__.split(".")[0]
+
+logger = logging.getLogger(f"{package_name}")
+
+DURABILITY_FLUSH = "flush"
+DURABILITY_QUEUED = "queued"
+DURABILITY_MODES = (DURABILITY_FLUSH, DURABILITY_QUEUED)
+
+# Delays (in seconds) between attempts to write a batch which failed to commit
+# because the database was locked, and the number of attempts made before giving up
+RETRY_DELAY_MIN = 0.05
+RETRY_DELAY_MAX = 5.0
+RETRY_ATTEMPTS = 10
+
+
+# What to do with events which match no ingest rule: 'drop' answers them as if they
+# had been stored (so that GitLab does not retry them or disable the webhook) and
+# 'reject' answers them with an error
+UNMATCHED_DROP = "drop"
+UNMATCHED_REJECT = "reject"
+UNMATCHED_ACTIONS = (UNMATCHED_DROP, UNMATCHED_REJECT)
+
+# Only issue and merge request events carry time tracking information
+DEFAULT_INGEST_RULES = "Issue Hook,Confidential Issue Hook,Merge Request Hook"
+
+
+class IngestRules(object):
+    """Rules deciding which webhook events are stored, from their headers alone
+
+    Rules are given as a comma-separated list of event types (as sent by GitLab in
+    the X-Gitlab-Event header), each optionally followed by the largest body size
+    (in bytes) accepted for it, eg. 'Issue Hook:1048576,Merge Request Hook'.  The
+    event type '*' matches any event.
+    """
+
+    def __init__(
+        self, rules: str = DEFAULT_INGEST_RULES, unmatched: str = UNMATCHED_DROP
+    ):
+        if unmatched not in UNMATCHED_ACTIONS:
+            raise ValueError(
+                f"Invalid action for unmatched events ({unmatched}); must be one of {UNMATCHED_ACTIONS}."
+            )
+        self.unmatched = unmatched
+
+        self.max_sizes: Dict[str, Optional[int]] = {}
+        for rule in rules.split(","):
+            event_type, _, max_size = rule.strip().rpartition(":")
+            if not event_type:
+                event_type, max_size = max_size, ""
+            try:
+                self.max_sizes[event_type.strip()] = (
+                    int(max_size) if max_size.strip() else None
+                )
+            except ValueError as e:
+                raise ValueError(f"Invalid ingest rule ({rule}).") from e
+
+    def __str__(self) -> str:
+        return ",".join(
+            event_type if max_size is None else f"{event_type}:{max_size}"
+            for event_type, max_size in self.max_sizes.items()
+        )
+
+    def match(self, event_type: Optional[str], body_size: Optional[int]) -> bool:
+        """Check if an event should be stored
+
+        Parameters
+        ----------
+        event_type : Optional[str]
+            Value of the X-Gitlab-Event header, if given
+        body_size : Optional[int]
+            Size of the body in bytes, if known
+
+        Returns
+        -------
+        bool:
+            True if a rule matches the event
+        """
+        for rule_type in [event_type, "*"]:
+            if rule_type in self.max_sizes:
+                max_size = self.max_sizes[rule_type]
+                if max_size is None or body_size is None or body_size <= max_size:
+                    return True
+        return False
+
+
+class _PendingEvent(NamedTuple):
+    db_event: models.Event
+    loop: Optional[asyncio.AbstractEventLoop]
+    future: Optional[asyncio.Future]
+
+
+def is_transient(e: OperationalError) -> bool:
+    """Return True if a failed write might succeed if tried again (ie. the database was locked)"""
+    message = str(e.orig).lower()
+    return "locked" in message or "busy" in message
+
+
+def _resolve(future: asyncio.Future, result=None, exception=None) -> None:
+    # The waiting request may have been cancelled (eg. client disconnect)
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+class RecentEvents(object):
+    """Bounded, least-recently-used record of the UUIDs of recently received events
+
+    GitLab retries a webhook delivery (with the same X-Gitlab-Event-UUID) when it
+    does not get a timely response, so most duplicates arrive shortly after the
+    original and can be answered from here without touching the database.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        if maxsize < 0:
+            raise ValueError(f"Invalid size ({maxsize}); must be >= 0.")
+        self.maxsize = maxsize
+        self._event_ids: OrderedDict[str, Optional[int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, uuid: str) -> bool:
+        with self._lock:
+            if uuid in self._event_ids:
+                self._event_ids.move_to_end(uuid)
+                return True
+            return False
+
+    def __len__(self) -> int:
+        return len(self._event_ids)
+
+    def get(self, uuid: str) -> Optional[int]:
+        """Return the database ID of an event (None if unknown or only queued)"""
+        with self._lock:
+            return self._event_ids.get(uuid)
+
+    def add(self, uuid: str, event_id: Optional[int] = None) -> None:
+        """Record an event, forgetting the least recently seen one if full"""
+        with self._lock:
+            self._event_ids[uuid] = event_id
+            self._event_ids.move_to_end(uuid)
+            while len(self._event_ids) > self.maxsize:
+                self._event_ids.popitem(last=False)
+
+
+class BatchWriter(object):
+    """Write webhook events to the database in batches from a background thread
+
+    Events are handed to the writer with submit() and committed together, with
+    a batch being flushed once it holds batch_size events or once flush_interval
+    seconds have passed since its first event arrived, whichever comes first.
+
+    The durability setting decides when submit() returns: with 'flush' it waits
+    until the batch holding the event has been committed, with 'queued' it
+    returns as soon as the event has been queued.
+
+    Batches which fail to commit because the database is locked (or busy) are
+    kept and retried, with backoff, up to RETRY_ATTEMPTS times.  Other
+    operational errors (eg. a missing table or a full disk) fail the whole batch
+    at once.  If a batch fails for any other reason, its events are retried one
+    at a time, so that only the events at fault fail.  The events of batches
+    which fail are logged and dropped.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        batch_size: int = 100,
+        flush_interval: float = 0.05,
+        durability: str = DURABILITY_FLUSH,
+    ):
+        if batch_size < 1:
+            raise ValueError(f"Invalid batch size ({batch_size}); must be >= 1.")
+        if flush_interval < 0:
+            raise ValueError(
+                f"Invalid flush interval ({flush_interval}); must be >= 0."
+            )
+        if durability not in DURABILITY_MODES:
+            raise ValueError(
+                f"Invalid durability mode ({durability}); must be one of {DURABILITY_MODES}."
+            )
+
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start the writer thread, if it is not already running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name=f"{package_name}-writer", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self) -> None:
+        """Flush all queued events and stop the writer thread"""
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def depth(self) -> int:
+        """Return the (approximate) number of events waiting to be written"""
+        return self._queue.qsize()
+
+    async def submit(
+        self, time: datetime.datetime, payload: Dict, uuid: Optional[str] = None
+    ) -> Optional[int]:
+        """Queue an event for writing
+
+        Parameters
+        ----------
+        time : datetime.datetime
+            Time the event was received
+        payload : Dict
+            Webhook payload
+        uuid : Optional[str]
+            GitLab's UUID for the event; events already stored are not written again
+
+        Returns
+        -------
+        Optional[int]:
+            The database ID of the event if the durability mode is 'flush', None otherwise
+        """
+
+        # Validate now, so that bad payloads are reported to the sender
+        db_event = crud.build_event(time, payload, uuid)
+
+        self.start()
+        if self.durability == DURABILITY_QUEUED:
+            self._queue.put(_PendingEvent(db_event, None, None))
+            return None
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put(_PendingEvent(db_event, loop, future))
+        return await future
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            pending = self._queue.get()
+            if pending is None:
+                break
+
+            # Collect events until the batch is full or the window closes
+            batch = [pending]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0:
+                        pending = self._queue.get(timeout=timeout)
+                    else:
+                        pending = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if pending is None:
+                    stopping = True
+                    break
+                batch.append(pending)
+
+            self._flush(batch)
+
+    def _fail(self, batch: List[_PendingEvent], e: Exception) -> None:
+        logger.error(
+            "Failed to write batch of %s events (dropped, with UUIDs %s): %s",
+            len(batch),
+            ", ".join(str(pending.db_event.uuid) for pending in batch),
+            e,
+        )
+        for pending in batch:
+            if pending.loop is not None and pending.future is not None:
+                pending.loop.call_soon_threadsafe(_resolve, pending.future, None, e)
+
+    def _write(self, batch: List[_PendingEvent]) -> List[int]:
+        db = self.session_factory()
+        try:
+            with metrics.DB_COMMIT_DURATION.time(writer="batch"):
+                return crud.create_events(db, [pending.db_event for pending in batch])
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _flush(self, batch: List[_PendingEvent]) -> None:
+        retry_delay = RETRY_DELAY_MIN
+        attempt = 1
+        while True:
+            try:
+                event_ids = self._write(batch)
+            except OperationalError as e:
+                if is_transient(e) and attempt < RETRY_ATTEMPTS:
+                    # Queued events have already been acknowledged, so keep the batch
+                    # and try again
+                    logger.warning(
+                        "Failed to write batch of %s events (retrying in %ss): %s",
+                        len(batch),
+                        retry_delay,
+                        e,
+                    )
+                    time.sleep(retry_delay)
+                    retry_delay = min(2 * retry_delay, RETRY_DELAY_MAX)
+                    attempt += 1
+                    continue
+                # A problem with the database rather than the events
+                self._fail(batch, e)
+                return
+            except Exception as e:
+                if len(batch) > 1:
+                    # Find the events at fault, so that the others are still written
+                    logger.warning(
+                        "Failed to write batch of %s events (retrying one at a time): %s",
+                        len(batch),
+                        e,
+                    )
+                    for pending in batch:
+                        self._flush([pending])
+                    return
+                self._fail(batch, e)
+                return
+            break
+
+        logger.debug("Batch of %s events written.", len(batch))
+        for pending, event_id in zip(batch, event_ids):
+            if pending.loop is not None and pending.future is not None:
+                pending.loop.call_soon_threadsafe(_resolve, pending.future, event_id)
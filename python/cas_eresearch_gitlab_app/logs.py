@@ -0,0 +1,131 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+from typing import Optional
+
+LOG_FORMATS = ("text", "json")
+
+TEXT_FORMAT = "%(asctime)s | %(levelname)-7s | %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as single-line JSON objects (eg. for log aggregators)"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+_EXCEPTION_FORMATTER = logging.Formatter()
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # Queues records for the listener which writes them, and keeps a reference to it
+    listener: Optional[logging.handlers.QueueListener] = None
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # QueueHandler.prepare() formats any exception into the message and drops it,
+        # which leaves nothing for the listener's formatter (eg. JSON) to place.
+        # Instead, keep the formatted exception in exc_text, which every formatter
+        # reads (the traceback in exc_info itself can not be pickled).
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _EXCEPTION_FORMATTER.formatException(record.exc_info)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+def _file_handler(
+    filename: str, max_bytes: int, backup_count: int
+) -> logging.FileHandler:
+    if max_bytes > 0:
+        return logging.handlers.RotatingFileHandler(
+            filename, maxBytes=max_bytes, backupCount=backup_count
+        )
+    return logging.FileHandler(filename)
+
+
+def stop_logging(listener: logging.handlers.QueueListener) -> None:
+    """Write out any queued records, then stop a listener and close its handlers"""
+    # Stopping a listener twice fails on older versions of Python
+    if getattr(listener, "_thread", None) is not None:
+        listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+def configure_logging(
+    logger: logging.Logger,
+    filename: str,
+    log_format: str = "text",
+    max_bytes: int = 0,
+    backup_count: int = 5,
+) -> logging.handlers.QueueListener:
+    """Log to a file from a background thread, so that logging never waits on I/O
+
+    Records are put on a queue by a QueueHandler attached to the logger, and
+    written to the file by a QueueListener's thread.  Any pipeline set up by an
+    earlier call for the same logger (eg. before the app was reloaded) is
+    stopped and replaced.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        Logger to attach the queue to
+    filename : str
+        File to write to
+    log_format : str
+        One of 'text' or 'json' (one object per line)
+    max_bytes : int
+        Size at which the file is rotated (0 to never rotate)
+    backup_count : int
+        Number of rotated files to keep
+
+    Returns
+    -------
+    logging.handlers.QueueListener:
+        The (running) listener, which stop_logging() flushes and stops
+    """
+    if log_format not in LOG_FORMATS:
+        raise ValueError(
+            f"Invalid log format ({log_format}); must be one of {list(LOG_FORMATS)}."
+        )
+
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+            if isinstance(handler, _QueueHandler) and handler.listener is not None:
+                stop_logging(handler.listener)
+
+    handler = _file_handler(filename, max_bytes, backup_count)
+    if log_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(fmt=TEXT_FORMAT))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        log_queue, handler, respect_handler_level=True
+    )
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.listener = listener
+    logger.addHandler(queue_handler)
+
+    listener.start()
+    atexit.register(stop_logging, listener)
+    return listener
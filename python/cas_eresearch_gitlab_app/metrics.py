@@ -0,0 +1,239 @@
+import bisect
+import contextlib
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+package_name = __name__.split(".")[0]
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Default histogram buckets (in seconds), as used by the Prometheus client libraries
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.075,
+    0.1,
+    0.25,
+    0.5,
+    0.75,
+    1.0,
+    2.5,
+    5.0,
+    7.5,
+    10.0,
+)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = [
+        str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        for value in values
+    ]
+    return (
+        "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+    )
+
+
+class _Metric(object):
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = f"{package_name}_{name}"
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(
+                f"Invalid labels ({list(labels)}) for metric {self.name}; expected {list(self.label_names)}."
+            )
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> Iterator[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for suffix, names, values, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}"
+            )
+        return "\n".join(lines) + "\n"
+
+
+class Counter(_Metric):
+    """Count of events, which only ever increases"""
+
+    type_name = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield "_total", self.label_names, key, value
+
+
+class Gauge(_Metric):
+    """Current value of something, either set directly or read when rendered"""
+
+    type_name = "gauge"
+
+    def __init__(self, *args, function: Optional[Callable[[], float]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.function = function
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.function is not None:
+            value = self.function()
+            if value is not None:
+                yield "", (), (), value
+            return
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield "", self.label_names, key, value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (eg. durations, in seconds)"""
+
+    type_name = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: the (non-cumulative) bucket counts, the sum and the count
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        i_bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = self._values[key]
+            counts[0][i_bucket] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the time taken (in seconds) by the enclosed block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(
+                (key, (list(counts), total, n))
+                for key, (counts, total, n) in self._values.items()
+            )
+        bucket_names = self.label_names + ("le",)
+        for key, (counts, total, n) in values:
+            cumulative = 0
+            for upper, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield "_bucket", bucket_names, key + (_format_value(upper),), cumulative
+            yield "_sum", self.label_names, key, total
+            yield "_count", self.label_names, key, n
+
+
+MetricT = TypeVar("MetricT", bound=_Metric)
+
+
+class Registry(object):
+    """Collection of metrics, rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: MetricT) -> MetricT:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self._metrics.values())
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(
+    Counter(
+        "http_requests",
+        "Number of HTTP requests handled",
+        labels=("method", "route", "status"),
+    )
+)
+HTTP_REQUEST_DURATION = REGISTRY.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Time taken to handle HTTP requests (up to the start of the response)",
+        labels=("method", "route"),
+    )
+)
+DB_COMMIT_DURATION = REGISTRY.register(
+    Histogram(
+        "db_commit_duration_seconds",
+        "Time taken to write incoming events to the database",
+        labels=("writer",),
+    )
+)
+JSON_PARSE_DURATION = REGISTRY.register(
+    Histogram(
+        "json_parse_duration_seconds",
+        "Time taken to parse webhook payloads",
+        buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1),
+    )
+)
+DATASET_BUILD_DURATION = REGISTRY.register(
+    Histogram(
+        "dataset_build_duration_seconds",
+        "Time taken to load or refresh the DataSet of events",
+        labels=("kind",),
+    )
+)
+DATASET_ROWS = REGISTRY.register(
+    Gauge("dataset_rows", "Number of time entries in the DataSet of events")
+)
+RESPONSE_CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "response_cache_requests",
+        "Number of read requests answered from (hit) or added to (miss) the response cache",
+        labels=("route", "result"),
+    )
+)
@@ -1,7 +1,24 @@
-from sqlalchemy import Column, Integer, DateTime, JSON
+import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import (
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    DateTime,
+    JSON,
+    String,
+)
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .database import Base
 
+# Version of the database schema, stored with SQLite's 'user_version' pragma.
+# Version 1 added the time_entries table, version 2 the event UUIDs and version 3
+# the monthly_totals table.
+SCHEMA_VERSION = 3
+
 
 class CreateEventError(Exception):
     """Raised when a failure is encountered while creating an event"""
@@ -12,7 +29,49 @@ class CreateEventError(Exception):
 class Event(Base):
     __tablename__ = "events"
 
-    id = Column(Integer, primary_key=True, index=True)
-    time = Column(DateTime, index=True)
-    dev_id = Column(Integer, index=True)
-    payload = Column(JSON)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    time: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime, index=True)
+    dev_id: Mapped[Optional[int]] = mapped_column(Integer, index=True)
+    payload: Mapped[Optional[Dict]] = mapped_column(JSON)
+    # Set by GitLab (X-Gitlab-Event-UUID) and unchanged when a delivery is retried
+    uuid: Mapped[Optional[str]] = mapped_column(String, unique=True, index=True)
+
+    time_entries: Mapped[List["TimeEntry"]] = relationship(
+        "TimeEntry", back_populates="event"
+    )
+
+
+class TimeEntry(Base):
+    __tablename__ = "time_entries"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    event_id: Mapped[Optional[int]] = mapped_column(
+        Integer, ForeignKey("events.id"), index=True
+    )
+    time: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime, index=True)
+    dev: Mapped[Optional[str]] = mapped_column(String, index=True)
+    project: Mapped[Optional[str]] = mapped_column(String, index=True)
+    hours: Mapped[Optional[float]] = mapped_column(Float)
+    issue: Mapped[Optional[str]] = mapped_column(String)
+
+    event: Mapped[Optional[Event]] = relationship(
+        "Event", back_populates="time_entries"
+    )
+
+
+class MonthlyTotal(Base):
+    """Rollup of the time entries of each month, dev, project and issue"""
+
+    __tablename__ = "monthly_totals"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    month: Mapped[Optional[str]] = mapped_column(String)  # YYYY-MM
+    dev: Mapped[Optional[str]] = mapped_column(String)
+    project: Mapped[Optional[str]] = mapped_column(String)
+    issue: Mapped[Optional[str]] = mapped_column(String)
+    hours: Mapped[Optional[float]] = mapped_column(Float)
+    count: Mapped[Optional[int]] = mapped_column(Integer)
+
+    __table_args__ = (
+        Index("ix_monthly_totals_key", "month", "dev", "project", "issue", unique=True),
+    )
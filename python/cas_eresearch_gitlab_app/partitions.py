@@ -0,0 +1,161 @@
+import datetime
+import os
+import re
+import sqlite3
+import stat
+from dateutil.relativedelta import relativedelta
+from pathlib import Path
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from typing import List, Optional
+
+from . import crud, models, storage
+
+# Monthly partitions are named '<name of the database they came from>-YYYY-MM.db'
+PARTITION_PATTERN = re.compile(r"-(\d{4})-(\d{2})\.db$")
+
+
+def partition_filename(filename: str | Path, month: datetime.date) -> str:
+    """Return the filename of a database's partition for a given month"""
+    return f"{Path(filename).stem}-{month:%Y-%m}.db"
+
+
+def partition_month(filename: str | Path) -> Optional[datetime.datetime]:
+    """Return the start of the month held by a partition (None if not a partition)"""
+    match = PARTITION_PATTERN.search(str(filename))
+    if match is None:
+        return None
+    return datetime.datetime(int(match.group(1)), int(match.group(2)), 1)
+
+
+def partition_overlaps(
+    filename: str | Path,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+) -> bool:
+    """Check if a database may hold entries in the range [since, until)
+
+    Only partitions can be ruled out; any other database may hold entries from any time.
+    """
+    month = partition_month(filename)
+    if month is None:
+        return True
+    if since is not None and month + relativedelta(months=1) <= since:
+        return False
+    if until is not None and month >= until:
+        return False
+    return True
+
+
+def _is_read_only(filename: Path) -> bool:
+    return not os.stat(filename).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _make_read_only(filename: Path) -> None:
+    mode = os.stat(filename).st_mode
+    os.chmod(filename, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def partition_database(
+    filename: str | Path,
+    path: str | Path,
+    now: Optional[datetime.datetime] = None,
+) -> List[Path]:
+    """Copy the events (and time entries) of a database into one database per month
+
+    Partitions are updated incrementally: only events with IDs beyond those already
+    copied are added.  Once a month has ended its partition is completed and made
+    read-only, after which it is never written again.  Event IDs are kept, so the
+    partitions can be read incrementally in the same way as the original database.
+
+    Parameters
+    ----------
+    filename : str | Path
+        Database to partition (at the current schema version)
+    path : str | Path
+        Directory to write the partitions to (not the directory of the database)
+    now : Optional[datetime.datetime]
+        Current time, which decides which months have ended (default: now)
+
+    Returns
+    -------
+    List[Path]:
+        The partitions written to
+    """
+    filename = Path(filename).absolute()
+    path = Path(path)
+    # DataSet reads every database in a directory, so partitions written next
+    # to their source would be counted twice
+    if path.resolve() == filename.parent.resolve():
+        raise ValueError(
+            f"Partitions can not be written to the directory of the database ({path})."
+        )
+    path.mkdir(parents=True, exist_ok=True)
+    now = now or datetime.datetime.now()
+    month_current = datetime.datetime(now.year, now.month, 1)
+
+    con = sqlite3.connect(storage.read_only_uri(filename), uri=True)
+    try:
+        schema_version = con.execute("PRAGMA user_version").fetchone()[0]
+        if schema_version != models.SCHEMA_VERSION:
+            raise ValueError(
+                f"Database {filename} is at schema version {schema_version}; upgrade it to version {models.SCHEMA_VERSION} first."
+            )
+        months = [
+            datetime.datetime.strptime(row[0], "%Y-%m")
+            for row in con.execute(
+                "SELECT DISTINCT strftime('%Y-%m', time) FROM events WHERE time IS NOT NULL"
+            )
+        ]
+    finally:
+        con.close()
+
+    written = []
+    for month in sorted(months):
+        filename_partition = path / partition_filename(filename, month)
+        if filename_partition.exists() and _is_read_only(filename_partition):
+            continue
+
+        engine = create_engine(f"sqlite:///{filename_partition}")
+        models.Base.metadata.create_all(bind=engine)
+        con = sqlite3.connect(filename_partition)
+        try:
+            con.execute("ATTACH DATABASE ? AS source", (str(filename),))
+            with con:
+                last_id = con.execute("SELECT max(id) FROM main.events").fetchone()[0]
+                params = {
+                    "start": f"{month:%Y-%m-%d}",
+                    "end": f"{month + relativedelta(months=1):%Y-%m-%d}",
+                    "after_id": last_id or 0,
+                }
+                con.execute(
+                    """
+                    INSERT INTO main.events (id, time, dev_id, payload, uuid)
+                    SELECT id, time, dev_id, payload, uuid FROM source.events
+                    WHERE time >= :start AND time < :end AND id > :after_id
+                    """,
+                    params,
+                )
+                con.execute(
+                    """
+                    INSERT INTO main.time_entries (event_id, time, dev, project, hours, issue)
+                    SELECT event_id, time, dev, project, hours, issue FROM source.time_entries
+                    WHERE time >= :start AND time < :end AND event_id > :after_id
+                    ORDER BY id
+                    """,
+                    params,
+                )
+                con.execute(f"PRAGMA user_version = {models.SCHEMA_VERSION}")
+            con.execute("DETACH DATABASE source")
+        finally:
+            con.close()
+        with Session(engine) as db:
+            crud.rebuild_monthly_totals(db)
+            db.commit()
+        engine.dispose()
+
+        if month < month_current:
+            _make_read_only(filename_partition)
+        written.append(filename_partition)
+
+    return written
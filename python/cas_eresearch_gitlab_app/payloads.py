@@ -0,0 +1,41 @@
+from datetime import timedelta
+from typing import Dict, List
+
+
+def timedelta_to_hours(delta: timedelta) -> float:
+    hours, remainder = divmod(delta.total_seconds(), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return hours + minutes / 60.0
+
+
+def time_entries_from_payload(payload: Dict) -> List[Dict]:
+    """Extract the time-tracking entries from a webhook payload
+
+    Parameters
+    ----------
+    payload : Dict
+        Webhook payload
+
+    Returns
+    -------
+    List[Dict]:
+        One dictionary (with keys 'dev', 'project', 'hours' and 'issue') for each
+        change to the time spent on an issue or merge request.  Empty for all other events.
+    """
+    changes = payload.get("changes") or {}
+    if "total_time_spent" not in changes:
+        return []
+
+    user = payload["user"]
+    project = payload["project"]
+    metadata = payload["object_attributes"]
+    t_1 = changes["total_time_spent"]["previous"]
+    t_2 = changes["total_time_spent"]["current"]
+    return [
+        {
+            "dev": user["name"],
+            "project": f"{project['namespace']}/{project['name']}",
+            "hours": timedelta_to_hours(timedelta(seconds=(t_2 - t_1))),
+            "issue": metadata["title"],
+        }
+    ]
@@ -0,0 +1,50 @@
+import matplotlib.pyplot as plt
+import numpy as np
+import seaborn as sns
+from dateutil.relativedelta import relativedelta
+from typing import Dict
+
+
+def render_figure(dates, amounts, labels, n, title, filename_fig) -> str:
+    """Write a stacked bar chart of monthly amounts (one column per label) to a file
+
+    The first n columns (or all of them if n is None) are plotted individually
+    and the remainder are summed into an 'Other' bar.
+    """
+    n_plot = amounts.shape[1] if n is None else min(n, amounts.shape[1])
+    tops = np.cumsum(amounts[:, :n_plot], axis=1)
+
+    sns.set_theme()
+    fig, ax = plt.subplots()
+    ax.set_ylabel("Monthly Total [h]")
+    ax.set_xlabel("Date")
+
+    for i_group in range(n_plot):
+        ax.bar(
+            dates,
+            amounts[:, i_group],
+            width=relativedelta(months=1),
+            bottom=tops[:, i_group] - amounts[:, i_group],
+            label=labels[i_group],
+        )
+
+    if n is not None:
+        ax.bar(
+            dates,
+            amounts[:, n_plot:].sum(axis=1),
+            width=relativedelta(months=1),
+            bottom=tops[:, -1] if n_plot > 0 else np.zeros(len(dates)),
+            label="Other",
+        )
+    ax.legend()
+    if title:
+        ax.set_title(title)
+    fig.autofmt_xdate()
+
+    fig.savefig(filename_fig)
+    plt.close(fig)
+    return filename_fig
+
+
+def render_figure_kwargs(figure: Dict) -> str:
+    return render_figure(**figure)
@@ -0,0 +1,450 @@
+"""Durable on-disk spool of incoming events, drained into the database by a single consumer
+
+Each process appends the events it receives to journal segments of its own
+(append-only files of one JSON entry per line), syncing them to disk in
+batches, so that any number of workers can accept events without contending
+for the database's write lock.  Writers hold an exclusive lock on the segment
+they are writing to, which is released when it is rotated or the writer exits
+(or crashes).
+
+One process at a time (whichever holds the spool's consumer lock) reads the
+entries from the segments and writes them to the database, recording how far
+it has read each segment.  Segments which are no longer locked by a writer are
+deleted once they have been read.  Entries are written to the database with
+the event's UUID, so replaying them (eg. after a crash between writing a batch
+and recording the offset) never stores an event twice.  Entries which can not
+be stored are moved to a dead-letter file, so that they do not hold up the
+entries after them.
+"""
+
+import asyncio
+import datetime
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid as uuid_lib
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from . import crud, metrics, models
+from .ingest import DURABILITY_FLUSH, DURABILITY_MODES, _resolve
+
+package_name = __name__.split(".")[0]
+
+logger = logging.getLogger(f"{package_name}")
+
+SEGMENT_SUFFIX = ".journal"
+OFFSET_SUFFIX = ".offset"
+CONSUMER_LOCK = "consumer.lock"
+DEAD_LETTER = "dead_letter.ndjson"
+
+
+def _segments(path: Path) -> List[Path]:
+    # Segments are named '<pid>-<creation time in ns>', so sort roughly by age
+    # (and ignore any other files, which were not written by a SpoolWriter)
+    segments = []
+    for filename in path.glob(f"*{SEGMENT_SUFFIX}"):
+        pid, _, time_ns = filename.stem.partition("-")
+        if pid.isdigit() and time_ns.isdigit():
+            segments.append((int(time_ns), filename))
+    return [filename for _, filename in sorted(segments)]
+
+
+def _sync_dir(path: Path) -> None:
+    # Make changes to a directory's entries (eg. renames) durable
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _try_lock(file: BinaryIO | int) -> bool:
+    try:
+        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+class SpoolWriter(object):
+    """Append events to a journal segment, syncing it to disk in batches
+
+    Appends are written straight to the segment and synced to disk by a
+    background thread, at most every sync_interval seconds, so that the cost
+    of a sync is shared by all of the events appended in the meantime.
+
+    The durability setting decides when submit() returns: with 'flush' it waits
+    until the event has been synced to disk, with 'queued' it returns as soon
+    as the event has been appended.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        sync_interval: float = 0.01,
+        durability: str = DURABILITY_FLUSH,
+        segment_bytes: int = 16 * 1024 * 1024,
+    ):
+        if sync_interval < 0:
+            raise ValueError(f"Invalid sync interval ({sync_interval}); must be >= 0.")
+        if durability not in DURABILITY_MODES:
+            raise ValueError(
+                f"Invalid durability mode ({durability}); must be one of {DURABILITY_MODES}."
+            )
+        if segment_bytes < 1:
+            raise ValueError(f"Invalid segment size ({segment_bytes}); must be >= 1.")
+
+        self.path = Path(path).absolute()
+        self.sync_interval = sync_interval
+        self.durability = durability
+        self.segment_bytes = segment_bytes
+
+        self._file: Optional[BinaryIO] = None
+        self._size = 0
+        # Events appended since the last sync, and the requests waiting on it
+        self._n_unsynced = 0
+        self._waiting: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start the sync thread, if it is not already running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self.path.mkdir(parents=True, exist_ok=True)
+                self._stopping = False
+                self._thread = threading.Thread(
+                    target=self._run, name=f"{package_name}-spool-sync", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self) -> None:
+        """Sync all appended events, close the segment and stop the sync thread"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+            self._stopping = True
+            self._wake.set()
+        if thread is not None:
+            thread.join()
+
+    def depth(self) -> int:
+        """Return the number of events appended but not yet synced to disk"""
+        return self._n_unsynced
+
+    def _open_segment(self) -> BinaryIO:
+        filename = self.path / f"{os.getpid()}-{time.time_ns()}{SEGMENT_SUFFIX}"
+        # Locked before it is given its name, so that the consumer never takes an
+        # empty segment as complete.  Unbuffered, so that each entry reaches the
+        # file (and the consumer) in one write.
+        file = open(f"{filename}.tmp", "ab", buffering=0)
+        fcntl.flock(file, fcntl.LOCK_EX)
+        os.rename(f"{filename}.tmp", filename)
+        # Otherwise the segment (and the events synced to it) could be lost in a crash
+        _sync_dir(self.path)
+        self._size = 0
+        return file
+
+    async def submit(
+        self, time: datetime.datetime, payload: Dict, uuid: Optional[str] = None
+    ) -> None:
+        """Append an event to the spool
+
+        Parameters
+        ----------
+        time : datetime.datetime
+            Time the event was received
+        payload : Dict
+            Webhook payload
+        uuid : Optional[str]
+            GitLab's UUID for the event (one is generated if not given, so that
+            the event can be recognised if it is replayed)
+        """
+
+        # Validate now, so that bad payloads are reported to the sender
+        crud.build_event(time, payload, uuid)
+
+        entry = {
+            "time": time.isoformat(),
+            "uuid": uuid or str(uuid_lib.uuid4()),
+            "payload": payload,
+        }
+        line = (json.dumps(entry, separators=(",", ":")) + "\n").encode()
+
+        self.start()
+        future = None
+        with self._lock:
+            if self._file is None:
+                self._file = self._open_segment()
+            self._file.write(line)
+            self._size += len(line)
+            self._n_unsynced += 1
+            if self.durability == DURABILITY_FLUSH:
+                loop = asyncio.get_running_loop()
+                future = loop.create_future()
+                self._waiting.append((loop, future))
+        self._wake.set()
+        if future is not None:
+            await future
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            if not self._stopping and self.sync_interval > 0:
+                # Give other appends the chance to share the sync
+                time.sleep(self.sync_interval)
+            with self._lock:
+                self._wake.clear()
+                stopping = self._stopping
+                file, waiting = self._file, self._waiting
+                self._waiting = []
+                self._n_unsynced = 0
+                # Only this thread rotates (or closes) segments, so the file stays
+                # open while it is synced below
+                rotate = stopping or self._size >= self.segment_bytes
+                if rotate:
+                    self._file = None
+
+            error = None
+            if file is not None:
+                try:
+                    os.fsync(file.fileno())
+                except OSError as e:
+                    logger.error("Failed to sync spool segment: %s", e)
+                    error = e
+                if rotate:
+                    # Also releases the lock, marking the segment as complete
+                    file.close()
+            for loop, future in waiting:
+                loop.call_soon_threadsafe(_resolve, future, None, error)
+
+            if stopping:
+                break
+
+
+class SpoolConsumer(object):
+    """Write the events in a spool's segments to the database
+
+    Only one consumer (across all processes) drains a spool at a time.  Once
+    started, a consumer repeatedly tries to take the spool's consumer lock, and
+    while it holds it, writes new entries to the database every poll_interval
+    seconds.  Any entries left from before (eg. after a crash) are replayed
+    when the lock is first taken.
+
+    If a batch of entries fails to be written because of the database (an
+    operational error, eg. it is locked), the drain stops and the batch is
+    retried from the same offset by the next one.  If it fails for any other
+    reason, its entries are written one at a time, and those at fault are
+    appended (with the error) to the spool's dead-letter file.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        session_factory: Callable[[], Session],
+        poll_interval: float = 0.1,
+        batch_size: int = 1000,
+    ):
+        if poll_interval <= 0:
+            raise ValueError(f"Invalid poll interval ({poll_interval}); must be > 0.")
+        if batch_size < 1:
+            raise ValueError(f"Invalid batch size ({batch_size}); must be >= 1.")
+
+        self.path = Path(path).absolute()
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+
+        self._lock_file: Optional[BinaryIO] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def active(self) -> bool:
+        """True if this consumer holds the spool's consumer lock"""
+        return self._lock_file is not None
+
+    def acquire(self) -> bool:
+        """Try to take the spool's consumer lock, returning True if it is held"""
+        if self._lock_file is None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            lock_file = open(self.path / CONSUMER_LOCK, "ab")
+            if _try_lock(lock_file):
+                self._lock_file = lock_file
+                logger.info("Spool consumer started (pid=%s).", os.getpid())
+            else:
+                lock_file.close()
+        return self.active
+
+    def release(self) -> None:
+        """Release the spool's consumer lock (if held)"""
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def start(self) -> None:
+        """Start the consumer thread, if it is not already running"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name=f"{package_name}-spool-consumer", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Write any remaining entries (if the lock is held) and stop the consumer thread"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self.active:
+            try:
+                self.drain()
+            except Exception as e:
+                logger.error("Failed to drain spool: %s", e)
+        self.release()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if self.acquire():
+                try:
+                    self.drain()
+                except Exception as e:
+                    # Nothing is lost; the entries are retried from the same offsets
+                    logger.error("Failed to drain spool: %s", e)
+            self._stop.wait(self.poll_interval)
+
+    def drain(self) -> int:
+        """Write the entries added to the spool since the last drain to the database
+
+        Must only be called while holding the consumer lock (see acquire()).
+
+        Returns
+        -------
+        int:
+            Number of entries read
+        """
+        if not self.active:
+            raise RuntimeError("The spool's consumer lock is not held.")
+        return sum(self._drain_segment(filename) for filename in _segments(self.path))
+
+    def _read_offset(self, filename: Path) -> int:
+        try:
+            with open(filename.with_suffix(OFFSET_SUFFIX)) as file_in:
+                return int(file_in.read())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_offset(self, filename: Path, offset: int) -> None:
+        filename_offset = filename.with_suffix(OFFSET_SUFFIX)
+        with open(f"{filename_offset}.tmp", "w") as file_out:
+            file_out.write(str(offset))
+        os.replace(f"{filename_offset}.tmp", filename_offset)
+
+    def _drain_segment(self, filename: Path) -> int:
+        try:
+            file = open(filename, "rb")
+        except FileNotFoundError:
+            return 0
+        with file:
+            # Taken before reading, so that nothing can be added after the last read
+            complete = _try_lock(file)
+            offset = offset_start = self._read_offset(filename)
+            file.seek(offset)
+
+            n_entries = 0
+            entries: List[Dict] = []
+            for line in iter(file.readline, b""):
+                if not line.endswith(b"\n"):
+                    # Still being written, or cut short by a crash
+                    if complete:
+                        logger.warning(
+                            "Incomplete entry at the end of spool segment %s dropped.",
+                            filename.name,
+                        )
+                    break
+                offset += len(line)
+                try:
+                    entries.append(json.loads(line))
+                except ValueError as e:
+                    self._dead_letter({"line": line.decode(errors="replace")}, e)
+                if len(entries) == self.batch_size:
+                    self._write(entries)
+                    self._write_offset(filename, offset)
+                    n_entries += len(entries)
+                    entries = []
+            if entries:
+                self._write(entries)
+                n_entries += len(entries)
+
+            if complete:
+                os.remove(filename)
+                filename.with_suffix(OFFSET_SUFFIX).unlink(missing_ok=True)
+            elif offset != offset_start:
+                self._write_offset(filename, offset)
+        return n_entries
+
+    def _dead_letter(self, entry: Dict, e: Exception) -> None:
+        logger.error("Spool entry moved to %s: %s", DEAD_LETTER, e)
+        record = {"error": str(e), "entry": entry}
+        with open(self.path / DEAD_LETTER, "a") as file_out:
+            file_out.write(json.dumps(record, default=str) + "\n")
+            file_out.flush()
+            os.fsync(file_out.fileno())
+
+    def _write(self, entries: List[Dict]) -> None:
+        valid, db_events = [], []
+        for entry in entries:
+            try:
+                db_events.append(
+                    crud.build_event(
+                        datetime.datetime.fromisoformat(entry["time"]),
+                        entry["payload"],
+                        entry["uuid"],
+                    )
+                )
+            except (KeyError, TypeError, ValueError, models.CreateEventError) as e:
+                self._dead_letter(entry, e)
+                continue
+            valid.append(entry)
+        if db_events:
+            self._write_events(valid, db_events)
+
+    def _write_events(self, entries: List[Dict], db_events: List[models.Event]) -> None:
+        error: Optional[Exception] = None
+        db = self.session_factory()
+        try:
+            with metrics.DB_COMMIT_DURATION.time(writer="spool"):
+                crud.create_events(db, db_events)
+        except OperationalError:
+            # The database is at fault, not the entries; they are retried next drain
+            db.rollback()
+            raise
+        except Exception as e:
+            db.rollback()
+            error = e
+        finally:
+            db.close()
+
+        if error is None:
+            logger.debug("Batch of %s spooled events written.", len(db_events))
+        elif len(db_events) > 1:
+            # Find the entries at fault, so that the others are still written
+            logger.warning(
+                "Failed to write batch of %s spooled events (retrying one at a time): %s",
+                len(db_events),
+                error,
+            )
+            for entry, db_event in zip(entries, db_events):
+                self._write_events([entry], [db_event])
+        else:
+            self._dead_letter(entries[0], error)
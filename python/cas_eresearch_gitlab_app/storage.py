@@ -0,0 +1,118 @@
+import os
+import sqlite3
+import urllib.parse
+from decouple import AutoConfig
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+config = AutoConfig(search_path=os.getcwd())
+
+
+class InvalidStorageSettingsError(ValueError):
+    """Raised when the storage settings of the runtime configuration are invalid"""
+
+    pass
+
+
+class InvalidStorageProfileError(InvalidStorageSettingsError):
+    """Raised when an unknown storage profile is configured"""
+
+    pass
+
+
+# SQLite settings (pragmas and connection pool sizes) for each storage profile:
+#   default: SQLite's own defaults (rollback journal, synchronous=FULL)
+#   wal:     write-ahead logging, so that readers and the writer do not block each
+#            other, with a single pooled writer connection and larger caches
+#   durable: as for 'wal', but with every commit synced to disk
+STORAGE_PROFILES = {
+    "default": {},
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,  # in KiB when negative
+        "mmap_size": 268435456,
+        "busy_timeout": 5000,  # in ms
+        "writer_pool_size": 1,
+    },
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+        "writer_pool_size": 1,
+    },
+}
+
+PRAGMAS = ["journal_mode", "synchronous", "cache_size", "mmap_size", "busy_timeout"]
+POOL_SIZES = ["writer_pool_size", "reader_pool_size"]
+
+
+def storage_settings() -> Dict:
+    """Read the storage settings from the runtime configuration
+
+    The profile is selected with STORAGE_PROFILE and any of its settings can be
+    overridden individually (eg. SQLITE_SYNCHRONOUS=FULL or SQLITE_READER_POOL_SIZE=10).
+
+    Returns
+    -------
+    Dict:
+        Settings, keyed by pragma or pool name
+    """
+    profile = config("STORAGE_PROFILE", default="default")
+    try:
+        settings = dict(STORAGE_PROFILES[profile])
+    except KeyError as e:
+        raise InvalidStorageProfileError(
+            f"Invalid storage profile ({profile}); must be one of {list(STORAGE_PROFILES)}."
+        ) from e
+    for name in PRAGMAS + POOL_SIZES:
+        value = config(f"SQLITE_{name.upper()}", default=None)
+        if value is None:
+            continue
+        if name in POOL_SIZES:
+            try:
+                value = int(value)
+            except ValueError as e:
+                raise InvalidStorageSettingsError(
+                    f"Invalid SQLITE_{name.upper()} ({value}); must be an integer."
+                ) from e
+        settings[name] = value
+    return settings
+
+
+def apply_pragmas(dbapi_connection, settings: Dict, read_only: bool = False) -> None:
+    """Apply the pragmas of a set of storage settings to a new DBAPI connection"""
+    cursor = dbapi_connection.cursor()
+    for name in PRAGMAS:
+        if name in settings:
+            # Changing the journal mode needs write access (and persists anyway)
+            if not (read_only and name == "journal_mode"):
+                cursor.execute(f"PRAGMA {name} = {settings[name]}")
+    if read_only:
+        cursor.execute("PRAGMA query_only = ON")
+    cursor.close()
+
+
+def read_only_uri(filename: str | Path) -> str:
+    return f"file:{urllib.parse.quote(str(Path(filename).absolute()))}?mode=ro"
+
+
+def connect_read_only(filename: str | Path) -> sqlite3.Connection:
+    """Open a read-only connection to an SQLite database, with the configured pragmas"""
+    con = sqlite3.connect(read_only_uri(filename), uri=True)
+    apply_pragmas(con, storage_settings(), read_only=True)
+    return con
+
+
+def file_stamp(filename: str | Path) -> Tuple:
+    """Return a stamp of a database's files, which changes whenever it is written to"""
+    # Writes in WAL mode only reach the main file when the journal is checkpointed
+    stamps: List[Optional[Tuple[int, int]]] = []
+    for suffix in ["", "-wal"]:
+        try:
+            stat = os.stat(f"{filename}{suffix}")
+        except FileNotFoundError:
+            stamps.append(None)
+        else:
+            stamps.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(stamps)
@@ -0,0 +1,358 @@
+"""Benchmarks of the import, ingest, loading and reporting paths
+
+Run with (for example):
+
+  $ python -m cas_eresearch_gitlab_app.tests.benchmark --n-events 1000000 -o results.json
+
+and compare the JSON results written by different commits.
+"""
+import asyncio
+import contextlib
+import datetime
+import importlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import click
+
+from .resources.payloads import generate_events, write_database
+
+TOKEN = "benchmark-token"
+
+# Import time budgets (in seconds) for the CLI, the client and a cold-started worker
+IMPORT_BUDGETS = {
+    "cas_eresearch_gitlab_app.cli": 0.5,
+    "cas_eresearch_gitlab_app.client": 1.0,
+    "cas_eresearch_gitlab_app.app": 3.0,
+}
+
+# Modules which should only be loaded once they are needed
+HEAVY_MODULES = ["matplotlib", "numpy", "pandas", "seaborn"]
+
+
+@contextlib.contextmanager
+def _working_directory(path: str | Path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def _percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_import(module: str, repeats: int = 3) -> Dict:
+    """Measure the time taken to import a module in a fresh interpreter
+
+    Parameters
+    ----------
+    module : str
+        Module to import
+    repeats : int
+        Number of imports to take the fastest of
+
+    Returns
+    -------
+    Dict:
+        Import time (as reported by 'python -X importtime') and the heavy modules loaded
+    """
+    code = (
+        f"import sys, {module}; "
+        f"print(','.join(name for name in {HEAVY_MODULES} if name in sys.modules))"
+    )
+    # The app needs a token, and writes its database and log to the working directory
+    env = {**os.environ, "SECRET_TOKEN": TOKEN}
+    times = []
+    with tempfile.TemporaryDirectory() as path:
+        for _ in range(repeats):
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", code],
+                cwd=path,
+                env=env,
+                capture_output=True,
+                check=True,
+                text=True,
+            )
+            for line in result.stderr.splitlines():
+                fields = [field.strip() for field in line.split("|")]
+                if len(fields) == 3 and fields[2] == module:
+                    times.append(int(fields[1]) / 1e6)
+    heavy_modules = result.stdout.strip()
+    return {
+        "seconds": min(times),
+        "budget_seconds": IMPORT_BUDGETS.get(module),
+        "heavy_modules": heavy_modules.split(",") if heavy_modules else [],
+    }
+
+
+def benchmark_ingest(path: str | Path, n_events: int, concurrency: int = 32) -> Dict:
+    """Measure the webhook ingest throughput of the app, through its ASGI interface
+
+    Parameters
+    ----------
+    path : str | Path
+        Empty directory to run the app (and write its database) in
+    n_events : int
+        Number of events to post
+    concurrency : int
+        Number of requests in flight at once
+
+    Returns
+    -------
+    Dict:
+        Throughput and latency results
+    """
+    import httpx
+
+    import cas_eresearch_gitlab_app.database as database
+    import cas_eresearch_gitlab_app.models as models
+
+    # Payloads are serialised up front, so that only the app is timed
+    requests = [
+        (
+            {
+                "X-Gitlab-Token": TOKEN,
+                "X-Gitlab-Event": event.event_type,
+                "X-Gitlab-Event-UUID": event.uuid,
+                "Content-Type": "application/json",
+            },
+            json.dumps(event.payload).encode(),
+        )
+        for event in generate_events(n_events)
+    ]
+
+    os.environ["SECRET_TOKEN"] = TOKEN
+    with _working_directory(path):
+        # The database location is fixed when the engines are created
+        importlib.reload(database)
+        importlib.reload(models)
+        if "cas_eresearch_gitlab_app.app" in sys.modules:
+            app = importlib.reload(sys.modules["cas_eresearch_gitlab_app.app"])
+        else:
+            app = importlib.import_module("cas_eresearch_gitlab_app.app")
+
+        async def post_all():
+            latencies = []
+            semaphore = asyncio.Semaphore(concurrency)
+            transport = httpx.ASGITransport(app=app.app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://benchmark"
+            ) as client:
+
+                async def post(headers, body):
+                    async with semaphore:
+                        start = time.perf_counter()
+                        response = await client.post("/", headers=headers, content=body)
+                        latencies.append(time.perf_counter() - start)
+                        response.raise_for_status()
+
+                start = time.perf_counter()
+                await asyncio.gather(*[post(*request) for request in requests])
+                if app.ingest_writer:
+                    app.ingest_writer.stop()
+                duration = time.perf_counter() - start
+            await app.async_engine.dispose()
+            await app.async_read_engine.dispose()
+            return duration, latencies
+
+        duration, latencies = asyncio.run(post_all())
+
+    return {
+        "n_events": n_events,
+        "concurrency": concurrency,
+        "ingest_mode": app.INGEST_MODE,
+        "seconds": duration,
+        "events_per_second": n_events / duration,
+        "latency_p50_seconds": _percentile(latencies, 0.5),
+        "latency_p99_seconds": _percentile(latencies, 0.99),
+    }
+
+
+def benchmark_dataset(path: str | Path) -> Dict:
+    """Measure the time and memory taken to build a DataSet from the databases in a directory
+
+    Parameters
+    ----------
+    path : str | Path
+        Directory holding the databases
+
+    Returns
+    -------
+    Dict:
+        Timing and memory results
+    """
+    from cas_eresearch_gitlab_app.events import DataSet
+
+    with _working_directory(path):
+        start = time.perf_counter()
+        ds = DataSet("./")
+        duration = time.perf_counter() - start
+
+        # Measured separately, since tracing allocations slows everything down
+        tracemalloc.start()
+        DataSet("./")
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    df_memory = int(ds.df.memory_usage(deep=True).sum())
+    return {
+        "n_rows": ds.count(),
+        "seconds": duration,
+        "rows_per_second": ds.count() / duration,
+        "peak_memory_bytes": peak,
+        "df_memory_bytes": df_memory,
+        "df_memory_bytes_per_row": df_memory / max(ds.count(), 1),
+    }
+
+
+def benchmark_reports(path: str | Path, processes: int = 1) -> Dict:
+    """Measure the time taken by the print_totals() and plot() reports
+
+    Parameters
+    ----------
+    path : str | Path
+        Directory holding the databases (figures are also written here)
+    processes : int
+        Number of processes to render figures with
+
+    Returns
+    -------
+    Dict:
+        Timing results
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from cas_eresearch_gitlab_app.events import DataSet
+
+    results = {}
+    with _working_directory(path):
+        ds = DataSet("./")
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            ds.print_totals()
+            results["print_totals_seconds"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            ds.plot(processes=processes)
+            results["plot_seconds"] = time.perf_counter() - start
+    results["plot_processes"] = processes
+    return results
+
+
+def run(n_events: int, n_ingest: int, path: str | Path, processes: int = 1) -> Dict:
+    """Run all benchmarks
+
+    Parameters
+    ----------
+    n_events : int
+        Number of events to generate for the loading and reporting benchmarks
+    n_ingest : int
+        Number of events to post for the ingest benchmark (0 to skip it)
+    path : str | Path
+        Empty directory to work in
+    processes : int
+        Number of processes to render figures with
+
+    Returns
+    -------
+    Dict:
+        Results of each benchmark, with details of the environment they were run in
+    """
+    results: Dict[str, Any] = {
+        "commit": _git_commit(),
+        "time": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "n_events": n_events,
+    }
+    path = Path(path)
+
+    results["import"] = {module: benchmark_import(module) for module in IMPORT_BUDGETS}
+
+    if n_ingest > 0:
+        (path / "ingest").mkdir()
+        results["ingest"] = benchmark_ingest(path / "ingest", n_ingest)
+
+    (path / "data").mkdir()
+    start = time.perf_counter()
+    n_entries = write_database(path / "data" / "benchmark.db", n_events)
+    results["generate"] = {
+        "n_time_entries": n_entries,
+        "seconds": time.perf_counter() - start,
+    }
+    results["dataset"] = benchmark_dataset(path / "data")
+    results["reports"] = benchmark_reports(path / "data", processes=processes)
+
+    return results
+
+
+@click.command()
+@click.option(
+    "--n-events",
+    "-n",
+    type=int,
+    default=100000,
+    show_default=True,
+    help="Number of events to load and report on",
+)
+@click.option(
+    "--n-ingest",
+    type=int,
+    default=10000,
+    show_default=True,
+    help="Number of events to post to the app (0 to skip)",
+)
+@click.option(
+    "--processes",
+    "-p",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Number of processes to render figures with",
+)
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False),
+    default="benchmark.json",
+    show_default=True,
+    help="File to write the results to",
+)
+def main(n_events: int, n_ingest: int, processes: int, output: str) -> None:
+    """Benchmark the app's ingest, loading and reporting paths"""
+    with tempfile.TemporaryDirectory() as path:
+        results = run(n_events, n_ingest, path, processes=processes)
+    with open(output, "w") as file_out:
+        json.dump(results, file_out, indent=2)
+    click.echo(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
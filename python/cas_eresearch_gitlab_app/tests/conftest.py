@@ -0,0 +1,15 @@
+import pytest
+from pathlib import Path
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import cas_eresearch_gitlab_app.models as models
+
+
+@pytest.fixture
+def session_factory(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Create an empty app database in a temporary working directory"""
+    monkeypatch.chdir(tmp_path)
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -0,0 +1,258 @@
+import datetime
+import json
+import random
+import sqlite3
+import uuid
+from pathlib import Path
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from typing import Dict, Iterator, NamedTuple
+
+from cas_eresearch_gitlab_app import crud, models, payloads
+from cas_eresearch_gitlab_app.events import TIME_STR_FMT
+
+# Time is logged in multiples of this many seconds (ie. quarter hours)
+TIME_STEP = 900
+
+
+class GeneratedEvent(NamedTuple):
+    event_type: str  # as sent by GitLab in the X-Gitlab-Event header
+    uuid: str  # as sent by GitLab in the X-Gitlab-Event-UUID header
+    time: datetime.datetime
+    payload: Dict
+
+
+def _user(i_dev: int) -> Dict:
+    return {
+        "id": 1000000 + i_dev,
+        "name": f"Developer {i_dev:03d}",
+        "username": f"dev{i_dev:03d}",
+        "avatar_url": f"https://gitlab.com/uploads/-/system/user/avatar/{1000000 + i_dev}/avatar.png",
+        "email": "[REDACTED]",
+    }
+
+
+def _project(i_project: int) -> Dict:
+    name = f"project_{i_project:03d}"
+    namespace = f"group_{i_project % 7}"
+    path = f"cas-eresearch/{namespace}/{name}"
+    return {
+        "id": 50000000 + i_project,
+        "name": name,
+        "description": None,
+        "web_url": f"https://gitlab.com/{path}",
+        "avatar_url": None,
+        "git_ssh_url": f"git@gitlab.com:{path}.git",
+        "git_http_url": f"https://gitlab.com/{path}.git",
+        "namespace": namespace,
+        "visibility_level": 20,
+        "path_with_namespace": path,
+        "default_branch": "main",
+        "ci_config_path": "",
+        "homepage": f"https://gitlab.com/{path}",
+        "url": f"git@gitlab.com:{path}.git",
+        "ssh_url": f"git@gitlab.com:{path}.git",
+        "http_url": f"https://gitlab.com/{path}.git",
+    }
+
+
+def _object_attributes(
+    kind: str, i_object: int, project: Dict, user: Dict, time_spent: int
+) -> Dict:
+    attributes = {
+        "author_id": user["id"],
+        "created_at": "2023-12-11 11:20:56 UTC",
+        "description": "## Description\r\n\r\nAdd description here.",
+        "id": 100000000 + i_object,
+        "iid": i_object,
+        "project_id": project["id"],
+        "state": "opened",
+        "time_estimate": 0,
+        "title": f"{kind.replace('_', ' ').capitalize()} {i_object}",
+        "total_time_spent": time_spent,
+        "updated_at": "2023-12-11 11:23:13 UTC",
+        "url": f"{project['web_url']}/-/{'issues' if kind == 'issue' else 'merge_requests'}/{i_object}",
+    }
+    if kind == "merge_request":
+        attributes.update(
+            {
+                "source_branch": f"feature/{i_object}",
+                "target_branch": project["default_branch"],
+                "merge_status": "can_be_merged",
+            }
+        )
+    return attributes
+
+
+def generate_events(
+    n_events: int,
+    time_tracking_fraction: float = 0.25,
+    merge_request_fraction: float = 0.2,
+    n_devs: int = 20,
+    n_projects: int = 50,
+    n_objects_per_project: int = 40,
+    start: datetime.datetime = datetime.datetime(2023, 1, 1),
+    days: int = 730,
+    seed: int = 0,
+) -> Iterator[GeneratedEvent]:
+    """Generate realistic GitLab issue and merge request webhook events
+
+    Parameters
+    ----------
+    n_events : int
+        Number of events to generate
+    time_tracking_fraction : float
+        Fraction of the events which change the time spent on their issue or merge request
+    merge_request_fraction : float
+        Fraction of the events which are merge request (rather than issue) events
+    n_devs : int
+        Number of devs sending events
+    n_projects : int
+        Number of projects events are sent from
+    n_objects_per_project : int
+        Number of issues (and of merge requests) in each project
+    start : datetime.datetime
+        Time of the first event
+    days : int
+        Number of days the events are spread (evenly, in order) over
+    seed : int
+        Seed for the random number generator
+
+    Yields
+    ------
+    GeneratedEvent:
+        The events, in time order
+    """
+    rng = random.Random(seed)
+    users = [_user(i_dev) for i_dev in range(n_devs)]
+    projects = [_project(i_project) for i_project in range(n_projects)]
+    time_spent: Dict = {}
+    step = datetime.timedelta(days=days) / max(n_events, 1)
+
+    for i_event in range(n_events):
+        kind = "merge_request" if rng.random() < merge_request_fraction else "issue"
+        user = users[rng.randrange(n_devs)]
+        project = projects[rng.randrange(n_projects)]
+        i_object = rng.randrange(n_objects_per_project) + 1
+        key = (kind, project["id"], i_object)
+        previous = time_spent.get(key, 0)
+
+        changes: Dict = {
+            "updated_at": {
+                "previous": "2023-12-11 11:20:56 UTC",
+                "current": "2023-12-11 11:23:13 UTC",
+            }
+        }
+        if rng.random() < time_tracking_fraction:
+            # Mostly time logged, occasionally some removed
+            if previous > 0 and rng.random() < 0.05:
+                current = previous - TIME_STEP * rng.randint(1, previous // TIME_STEP)
+            else:
+                current = previous + TIME_STEP * rng.randint(1, 16)
+            changes["total_time_spent"] = {"previous": previous, "current": current}
+            time_spent[key] = current
+        elif rng.random() < 0.5:
+            changes["labels"] = {"previous": [], "current": [{"title": "in progress"}]}
+
+        payload = {
+            "object_kind": kind,
+            "event_type": kind,
+            "user": user,
+            "project": project,
+            "object_attributes": _object_attributes(
+                kind, i_object, project, user, time_spent.get(key, 0)
+            ),
+            "labels": [],
+            "changes": changes,
+            "repository": {
+                "name": project["name"],
+                "url": project["url"],
+                "description": None,
+                "homepage": project["homepage"],
+            },
+        }
+        event_type = "Merge Request Hook" if kind == "merge_request" else "Issue Hook"
+        yield GeneratedEvent(
+            event_type,
+            str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            start + i_event * step,
+            payload,
+        )
+
+
+def write_database(
+    filename: str | Path, n_events: int, chunk_size: int = 10000, **kwargs
+) -> int:
+    """Write generated events (and their time entries) straight to an app database
+
+    This bypasses the app, so that large databases can be generated quickly.  The
+    monthly totals are rebuilt from the time entries once they are written.
+
+    Parameters
+    ----------
+    filename : str | Path
+        Database to write to (created if needed)
+    n_events : int
+        Number of events to generate
+    chunk_size : int
+        Number of events to write per transaction
+    **kwargs :
+        Passed to generate_events()
+
+    Returns
+    -------
+    int:
+        Number of time entries written
+    """
+    engine = create_engine(f"sqlite:///{filename}")
+    models.Base.metadata.create_all(bind=engine)
+
+    con = sqlite3.connect(filename)
+    try:
+        con.execute(f"PRAGMA user_version = {models.SCHEMA_VERSION}")
+        event_id = con.execute("SELECT max(id) FROM events").fetchone()[0] or 0
+        n_entries = 0
+        events, entries = [], []
+        for i_event, event in enumerate(generate_events(n_events, **kwargs)):
+            event_id += 1
+            time = event.time.strftime(TIME_STR_FMT)
+            events.append(
+                (
+                    event_id,
+                    time,
+                    event.payload["user"]["id"],
+                    json.dumps(event.payload),
+                    event.uuid,
+                )
+            )
+            for entry in payloads.time_entries_from_payload(event.payload):
+                entries.append(
+                    (
+                        event_id,
+                        time,
+                        entry["dev"],
+                        entry["project"],
+                        entry["hours"],
+                        entry["issue"],
+                    )
+                )
+            if len(events) == chunk_size or i_event == n_events - 1:
+                with con:
+                    con.executemany(
+                        "INSERT INTO events (id, time, dev_id, payload, uuid) VALUES (?, ?, ?, ?, ?)",
+                        events,
+                    )
+                    con.executemany(
+                        "INSERT INTO time_entries (event_id, time, dev, project, hours, issue) VALUES (?, ?, ?, ?, ?, ?)",
+                        entries,
+                    )
+                n_entries += len(entries)
+                events, entries = [], []
+    finally:
+        con.close()
+
+    with Session(engine) as db:
+        crud.rebuild_monthly_totals(db)
+        db.commit()
+    engine.dispose()
+    return n_entries
@@ -0,0 +1,318 @@
+import importlib
+import json
+import os
+import pytest
+import subprocess
+import sys
+from fastapi.testclient import TestClient
+from pathlib import Path
+from typing import Any, Dict, List
+
+import cas_eresearch_gitlab_app.database as database
+import cas_eresearch_gitlab_app.models as models
+from cas_eresearch_gitlab_app.client import Client
+
+from .test_events import PAYLOADS
+
+TOKEN = "test-token"
+HEADERS = {"X-Gitlab-Token": TOKEN, "X-Gitlab-Event": "Issue Hook"}
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory: pytest.TempPathFactory):
+    """Run the app, with its database in a temporary working directory"""
+    cwd = os.getcwd()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("SECRET_TOKEN", TOKEN)
+        os.chdir(tmp_path_factory.mktemp("app"))
+        try:
+            # The database location is fixed when the engines are created
+            importlib.reload(database)
+            importlib.reload(models)
+            if "cas_eresearch_gitlab_app.app" in sys.modules:
+                app = importlib.reload(sys.modules["cas_eresearch_gitlab_app.app"])
+            else:
+                app = importlib.import_module("cas_eresearch_gitlab_app.app")
+            with TestClient(app.app) as client:
+                for payload in PAYLOADS:
+                    response = client.post("/", headers=HEADERS, json=payload)
+                    assert response.status_code == 200
+                yield client
+        finally:
+            os.chdir(cwd)
+
+
+def test_create_event_invalid(client: TestClient) -> None:
+    """Make sure that invalid tokens and payloads are rejected
+
+    Parameters
+    ----------
+    client : TestClient
+        Client for the app, generated from a pytest fixture
+    """
+    response = client.post("/", headers={"X-Gitlab-Token": "x"}, json=PAYLOADS[0])
+    assert response.status_code == 401
+    response = client.post("/", headers=HEADERS, json={"no_user": None})
+    assert response.status_code == 400
+
+
+def test_get_events_pages(client: TestClient) -> None:
+    """Make sure that filtered events can be paged through
+
+    Parameters
+    ----------
+    client : TestClient
+        Client for the app, generated from a pytest fixture
+    """
+    params: Dict[str, Any] = {"dev": "dev_a", "limit": 1}
+    response = client.get("/events", headers=HEADERS, params=params)
+    page = response.json()
+    assert [event["project"] for event in page["events"]] == ["group/project_1"]
+
+    params["cursor"] = page["next_cursor"]
+    page = client.get("/events", headers=HEADERS, params=params).json()
+    assert [event["project"] for event in page["events"]] == ["group/project_2"]
+
+    params["cursor"] = page["next_cursor"]
+    page = client.get("/events", headers=HEADERS, params=params).json()
+    assert page == {"events": [], "next_cursor": None}
+
+
+def test_get_events_formats(client: TestClient) -> None:
+    """Make sure that the streamed and legacy formats hold the same events, unfiltered
+
+    Parameters
+    ----------
+    client : TestClient
+        Client for the app, generated from a pytest fixture
+    """
+    response = client.get("/events", headers=HEADERS, params={"format": "ndjson"})
+    assert response.headers["content-type"] == "application/x-ndjson"
+    events_streamed = [json.loads(line) for line in response.text.splitlines()]
+
+    events_legacy = json.loads(client.get("/events", headers=HEADERS).json())
+    assert [event["time"] for event in events_streamed] == list(
+        events_legacy["time"].values()
+    )
+
+    # The legacy format holds every event, so filters are refused rather than ignored
+    params = {"format": "legacy", "dev": "dev_a"}
+    response = client.get("/events", headers=HEADERS, params=params)
+    assert response.status_code == 400
+    response = client.get("/events", headers=HEADERS, params={"format": "legacy"})
+    assert json.loads(response.json()) == events_legacy
+
+
+def test_get_totals(client: TestClient) -> None:
+    """Make sure that totals are grouped hierarchically
+
+    Parameters
+    ----------
+    client : TestClient
+        Client for the app, generated from a pytest fixture
+    """
+    params: Dict[str, Any] = {"levels": ["project", "dev"]}
+    totals = client.get("/totals", headers=HEADERS, params=params).json()
+    assert totals["time"] == 3.0
+    assert [group["name"] for group in totals["groups"]] == [
+        "group/project_1",
+        "group/project_2",
+    ]
+    assert [
+        (group["name"], group["time"]) for group in totals["groups"][0]["groups"]
+    ] == [
+        ("dev_b", 1.5),
+        ("dev_a", 1.0),
+    ]
+
+    params = {"levels": ["dev"], "project": "group/project_2"}
+    totals = client.get("/totals", headers=HEADERS, params=params).json()
+    assert totals["groups"] == [{"name": "dev_a", "time": 0.5, "count": 1}]
+
+    params = {"levels": ["time"]}
+    response = client.get("/totals", headers=HEADERS, params=params)
+    assert response.status_code == 400
+
+
+def test_client_sync(client: TestClient, tmp_path: Path) -> None:
+    """Make sure that the client only fetches events it has not already cached
+
+    Parameters
+    ----------
+    client : TestClient
+        Client for the app, generated from a pytest fixture
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    events_client = Client(
+        url=str(client.base_url), token=TOKEN, cache_dir=tmp_path, session=client
+    )
+    assert events_client.sync() == 3
+    assert events_client.sync() == 0
+    response = client.get(
+        "/events",
+        headers={**HEADERS, "If-None-Match": events_client._read_state()["etag"]},
+        params={"format": "json", "cursor": 0},
+    )
+    assert response.status_code == 304
+
+    client.post("/", headers=HEADERS, json=PAYLOADS[0])
+    assert events_client.sync() == 1
+
+    ds = events_client.get()
+    assert ds.count() == 4
+    assert ds.df["time"].sum() == 4.0
+
+
+def test_create_event_duplicate(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Make sure that retried deliveries are answered as before but stored once
+
+    Parameters
+    ----------
+    client : TestClient
+        Client for the app, generated from a pytest fixture
+    monkeypatch : pytest.MonkeyPatch
+        Patching helper, generated from a pytest fixture
+    """
+
+    def count_events():
+        params = {"format": "json", "limit": 10000}
+        return len(
+            client.get("/events", headers=HEADERS, params=params).json()["events"]
+        )
+
+    n_events = count_events()
+    headers = {**HEADERS, "X-Gitlab-Event-UUID": "0b7e4b2f-duplicate"}
+    responses = [client.post("/", headers=headers, json=PAYLOADS[0]) for _ in range(2)]
+    assert [response.json() for response in responses] == [
+        {"message": "Webhook processed successfully"}
+    ] * 2
+    assert count_events() == n_events + 1
+
+    # Also once the event has been forgotten by the app
+    app = sys.modules["cas_eresearch_gitlab_app.app"]
+    monkeypatch.setattr(app, "recent_events", type(app.recent_events)())
+    response = client.post("/", headers=headers, json=PAYLOADS[0])
+    assert response.status_code == 200
+    assert count_events() == n_events + 1
+
+
+def test_create_event_unmatched(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Make sure that events matching no ingest rule are not stored
+
+    Parameters
+    ----------
+    client : TestClient
+        Client for the app, generated from a pytest fixture
+    monkeypatch : pytest.MonkeyPatch
+        Patching helper, generated from a pytest fixture
+    """
+    params: Dict[str, Any] = {"format": "json", "limit": 10000}
+    n_events = len(
+        client.get("/events", headers=HEADERS, params=params).json()["events"]
+    )
+
+    headers = {**HEADERS, "X-Gitlab-Event": "Pipeline Hook"}
+    response = client.post("/", headers=headers, json=PAYLOADS[0])
+    assert response.json() == {"message": "Webhook processed successfully"}
+    response = client.post("/", headers=headers, content=b"not even JSON")
+    assert response.status_code == 200
+
+    app = sys.modules["cas_eresearch_gitlab_app.app"]
+    monkeypatch.setattr(
+        app, "ingest_rules", app.ingest.IngestRules("Issue Hook:100", "reject")
+    )
+    response = client.post("/", headers=headers, json=PAYLOADS[0])
+    assert response.status_code == 422
+    response = client.post("/", headers=HEADERS, json=PAYLOADS[0])
+    assert response.status_code == 413
+
+    events = client.get("/events", headers=HEADERS, params=params).json()["events"]
+    assert len(events) == n_events
+
+
+def test_get_metrics(client: TestClient) -> None:
+    """Make sure that metrics are reported in the Prometheus text format
+
+    Parameters
+    ----------
+    client : TestClient
+        Client for the app, generated from a pytest fixture
+    """
+    assert client.get("/metrics").status_code == 401
+    client.get("/events", headers=HEADERS)
+
+    response = client.get("/metrics", headers=HEADERS)
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    assert (
+        'cas_eresearch_gitlab_app_http_requests_total{method="POST",route="/",status="200"}'
+        in [line.rsplit(" ", 1)[0] for line in lines]
+    )
+    assert any(
+        line.startswith("cas_eresearch_gitlab_app_db_commit_duration_seconds_count")
+        for line in lines
+    )
+    assert any(
+        line.startswith("cas_eresearch_gitlab_app_dataset_rows ") for line in lines
+    )
+    assert any(
+        line.startswith("cas_eresearch_gitlab_app_database_size_bytes ")
+        for line in lines
+    )
+
+
+def test_get_events_cached(client: TestClient) -> None:
+    """Make sure that repeated polls are answered from the cache until the next write
+
+    Parameters
+    ----------
+    client : TestClient
+        Client for the app, generated from a pytest fixture
+    """
+    app = sys.modules["cas_eresearch_gitlab_app.app"]
+    all_params: List[Dict[str, Any]] = [{}, {"format": "json"}, {"levels": ["dev"]}]
+    for params in all_params:
+        route = "/totals" if "levels" in params else "/events"
+        response = client.get(route, headers=HEADERS, params=params)
+        etag = response.headers["ETag"]
+
+        hits = app.response_cache.hits
+        repeat = client.get(route, headers=HEADERS, params=params)
+        assert app.response_cache.hits == hits + 1
+        assert repeat.content == response.content
+        assert repeat.headers["ETag"] == etag
+
+        headers = {**HEADERS, "If-None-Match": etag}
+        assert client.get(route, headers=headers, params=params).status_code == 304
+
+        client.post("/", headers=HEADERS, json=PAYLOADS[0])
+        response = client.get(route, headers=headers, params=params)
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        assert response.content != repeat.content
+
+
+def test_invalid_storage_settings(tmp_path: Path) -> None:
+    """Make sure that the app reports invalid storage settings before exiting
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", "import cas_eresearch_gitlab_app.app"],
+        cwd=tmp_path,
+        env={**os.environ, "SECRET_TOKEN": TOKEN, "STORAGE_PROFILE": "fast"},
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 1
+    assert result.stderr.startswith(
+        "Invalid storage configuration: Invalid storage profile (fast)"
+    )
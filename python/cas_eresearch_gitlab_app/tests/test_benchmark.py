@@ -0,0 +1,59 @@
+import sqlite3
+from pathlib import Path
+
+import cas_eresearch_gitlab_app.payloads as payloads
+from cas_eresearch_gitlab_app.tests import benchmark
+from cas_eresearch_gitlab_app.tests.resources.payloads import (
+    generate_events,
+    write_database,
+)
+
+
+def test_generate_events() -> None:
+    """Make sure that generated events are consistent and reproducible"""
+    events = list(generate_events(2000, time_tracking_fraction=0.3))
+    assert [event.uuid for event in events[:10]] == [
+        event.uuid for event in generate_events(10, time_tracking_fraction=0.3)
+    ]
+    assert len({event.uuid for event in events}) == len(events)
+
+    entries = [
+        entry
+        for event in events
+        for entry in payloads.time_entries_from_payload(event.payload)
+    ]
+    assert 500 < len(entries) < 700
+    assert sum(entry["hours"] for entry in entries) > 0
+
+
+def test_write_database(tmp_path: Path) -> None:
+    """Make sure that generated databases hold the events, their time entries and the monthly totals
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    n_entries = write_database(tmp_path / "test.db", 250, chunk_size=100)
+    con = sqlite3.connect(tmp_path / "test.db")
+    assert con.execute("SELECT count(*) FROM events").fetchone()[0] == 250
+    assert con.execute("SELECT count(*) FROM time_entries").fetchone()[0] == n_entries
+    # The rollup matches the time entries
+    assert (
+        con.execute("SELECT sum(count) FROM monthly_totals").fetchone()[0] == n_entries
+    )
+    con.close()
+
+
+def test_benchmark_run(tmp_path: Path) -> None:
+    """Make sure that the benchmarks run (at a small scale)
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    results = benchmark.run(n_events=200, n_ingest=20, path=tmp_path)
+    assert results["ingest"]["n_events"] == 20
+    assert results["dataset"]["n_rows"] == results["generate"]["n_time_entries"]
+    assert results["reports"]["plot_seconds"] > 0
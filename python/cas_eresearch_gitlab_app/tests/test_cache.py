@@ -0,0 +1,50 @@
+import sqlite3
+from pathlib import Path
+
+import cas_eresearch_gitlab_app.cache as cache
+
+
+def test_response_cache() -> None:
+    """Make sure that responses are only returned for their generation, and evicted LRU"""
+    response_cache = cache.ResponseCache(max_bytes=10)
+    response_cache.put("a", 1, b"aaaa")
+    response_cache.put("b", 1, b"bbbb")
+    assert response_cache.get("a", 1) == b"aaaa"
+    assert response_cache.get("a", 2) is None
+    assert (response_cache.hits, response_cache.misses) == (1, 1)
+
+    # 'b' is the least recently used
+    response_cache.put("c", 1, b"cccc")
+    assert response_cache.get("b", 1) is None
+    assert response_cache.get("c", 1) == b"cccc"
+    assert response_cache.size == 8
+
+    # Replaced entries are not counted twice, and oversized ones are not kept
+    response_cache.put("c", 2, b"cc")
+    assert (len(response_cache), response_cache.size) == (2, 6)
+    response_cache.put("d", 2, b"d" * 11)
+    assert response_cache.get("d", 2) is None
+    assert len(response_cache) == 2
+
+
+def test_write_generation(tmp_path: Path) -> None:
+    """Make sure that the generation changes with writes, from any connection
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    filename = tmp_path / "test.db"
+    generation = cache.WriteGeneration(filename)
+    assert generation.current() == 0
+    assert generation.bump() == 1
+    assert generation.current() == 1
+
+    con = sqlite3.connect(filename)
+    with con:
+        con.execute("CREATE TABLE events (id INTEGER PRIMARY KEY)")
+    con.close()
+    assert generation.current() == 2
+    assert generation.current() == 2
+    assert generation.etag(2, "key") == f'W/"{generation.boot_id}-2-key"'
@@ -1,7 +1,21 @@
+import asyncio
+import datetime
+import json
+import os
+import subprocess
+import sys
+
 import cas_eresearch_gitlab_app
 import cas_eresearch_gitlab_app.cli as cli
+import cas_eresearch_gitlab_app.crud as crud
+import cas_eresearch_gitlab_app.models as models
+import cas_eresearch_gitlab_app.spool as spool
 from click.testing import CliRunner
 from pathlib import Path
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import Session
+
+from .test_events import PAYLOADS
 
 
 def test_cli_help(tmp_path: Path) -> None:
@@ -42,3 +56,109 @@ def test_cli_version(tmp_path: Path) -> None:
         assert result.exit_code == 0
 
         assert result.output == f"cli, version {cas_eresearch_gitlab_app.__version__}\n"
+
+
+def test_cli_invalid_storage_settings(tmp_path: Path) -> None:
+    """Make sure that invalid storage settings are reported, rather than exiting on import
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    # The settings are read when the database engines are set up, so a fresh
+    # interpreter is needed
+    env = {**os.environ, "SQLITE_WRITER_POOL_SIZE": "one"}
+    result = subprocess.run(
+        [sys.executable, "-c", "import cas_eresearch_gitlab_app.models"],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert "InvalidStorageSettingsError" in result.stderr
+
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from cas_eresearch_gitlab_app.cli import cli; cli()",
+            "rebuild-totals",
+            str(tmp_path),
+        ],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 1
+    assert result.stderr == (
+        "Error: Invalid storage configuration: "
+        "Invalid SQLITE_WRITER_POOL_SIZE (one); must be an integer.\n"
+    )
+
+
+def test_cli_rebuild_totals(tmp_path: Path) -> None:
+    """Make sure that databases are upgraded before their totals are rebuilt
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    filename = tmp_path / "test.db"
+    engine = create_engine(f"sqlite:///{filename}")
+    with engine.begin() as con:
+        # The events table as written by the first version of the app
+        con.execute(
+            text(
+                "CREATE TABLE events (id INTEGER PRIMARY KEY, time DATETIME, dev_id INTEGER, payload JSON)"
+            )
+        )
+        con.execute(
+            text(
+                "INSERT INTO events (time, dev_id, payload) VALUES ('2024-01-15 00:00:00.000000', 1, :payload)"
+            ),
+            {"payload": json.dumps(PAYLOADS[0])},
+        )
+
+    result = CliRunner().invoke(cli.cli, ["rebuild-totals", str(filename)])
+    assert result.exit_code == 0
+    with Session(engine) as db:
+        assert crud.get_schema_version(db) == models.SCHEMA_VERSION
+    assert "Monthly totals rebuilt (1 rows)." in result.output
+
+
+def test_cli_replay_spool(tmp_path: Path) -> None:
+    """Make sure that databases are upgraded before spooled events are replayed
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    writer = spool.SpoolWriter(tmp_path / "spool", sync_interval=0.001)
+    asyncio.run(
+        writer.submit(time=datetime.datetime.now(), payload=PAYLOADS[0], uuid="a")
+    )
+    writer.stop()
+
+    filename = tmp_path / "test.db"
+    engine = create_engine(f"sqlite:///{filename}")
+    with engine.begin() as con:
+        # The events table as written by schema version 1, without UUIDs
+        con.execute(
+            text(
+                "CREATE TABLE events (id INTEGER PRIMARY KEY, time DATETIME, dev_id INTEGER, payload JSON)"
+            )
+        )
+        con.execute(text("PRAGMA user_version = 1"))
+
+    result = CliRunner().invoke(
+        cli.cli, ["replay-spool", str(tmp_path / "spool"), str(filename)]
+    )
+    assert result.exit_code == 0
+    assert "1 spooled events replayed." in result.output
+    with Session(engine) as db:
+        assert crud.get_schema_version(db) == models.SCHEMA_VERSION
+        assert db.scalars(select(models.Event.uuid)).all() == ["a"]
@@ -0,0 +1,162 @@
+import asyncio
+import datetime
+import pytest
+from pathlib import Path
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+import cas_eresearch_gitlab_app.crud as crud
+import cas_eresearch_gitlab_app.models as models
+
+
+def test_create_event_async(tmp_path: Path) -> None:
+    """Make sure that events written through the async path can be read back
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    filename_db = tmp_path / "test.db"
+    models.Base.metadata.create_all(bind=create_engine(f"sqlite:///{filename_db}"))
+
+    async def create_and_get():
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{filename_db}")
+        session_factory = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+        async with session_factory() as db:
+            event = await crud.create_event_async(
+                db=db, time=datetime.datetime.now(), payload={"user": {"id": 7}}
+            )
+            db_events = await crud.get_events_async(db)
+        await async_engine.dispose()
+        return event, db_events
+
+    event, db_events = asyncio.run(create_and_get())
+    assert event.id == 1
+    assert [db_event.dev_id for db_event in db_events] == [7]
+
+
+def test_create_event_duplicate_uuid(tmp_path: Path) -> None:
+    """Make sure that an event redelivered with the same UUID is only stored once
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        time = datetime.datetime.now()
+        event = crud.create_event(db, time, {"user": {"id": 7}}, uuid="a")
+        event_retried = crud.create_event(db, time, {"user": {"id": 7}}, uuid="a")
+        assert event_retried.id == event.id
+
+        event_ids = crud.create_events(
+            db,
+            [
+                crud.build_event(time, {"user": {"id": 8}}, uuid=uuid)
+                for uuid in ["b", "a", "b", None]
+            ],
+        )
+        assert event_ids == [2, 1, 2, 3]
+        assert len(crud.get_events(db)) == 3
+
+
+def test_add_event_uuids(tmp_path: Path) -> None:
+    """Make sure that the UUID column is added to databases without one
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    with engine.begin() as con:
+        # The events table as written by schema version 1
+        con.execute(
+            text(
+                "CREATE TABLE events (id INTEGER PRIMARY KEY, time DATETIME, dev_id INTEGER, payload JSON)"
+            )
+        )
+        con.execute(text("PRAGMA user_version = 1"))
+    models.Base.metadata.create_all(bind=engine)
+
+    with Session(engine) as db:
+        assert crud.upgrade_database(db) == 1
+        assert crud.get_schema_version(db) == models.SCHEMA_VERSION
+        crud.create_event(db, datetime.datetime.now(), {"user": {"id": 7}}, uuid="a")
+        with pytest.raises(IntegrityError):
+            db.execute(text("INSERT INTO events (dev_id, uuid) VALUES (8, 'a')"))
+
+
+def test_monthly_totals(tmp_path: Path) -> None:
+    """Make sure that the monthly totals kept on ingest match a rebuild and the entries
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    models.Base.metadata.create_all(bind=engine)
+
+    def payload(dev, t_previous, t_current):
+        return {
+            "user": {"id": 1, "name": dev},
+            "project": {"namespace": "group", "name": "project"},
+            "object_attributes": {"title": "issue"},
+            "changes": {
+                "total_time_spent": {"previous": t_previous, "current": t_current}
+            },
+        }
+
+    def monthly_totals(db):
+        return db.execute(
+            select(
+                models.MonthlyTotal.month,
+                models.MonthlyTotal.dev,
+                models.MonthlyTotal.hours,
+                models.MonthlyTotal.count,
+            ).order_by(models.MonthlyTotal.month, models.MonthlyTotal.dev)
+        ).all()
+
+    with Session(engine) as db:
+        crud.create_event(db, datetime.datetime(2024, 1, 5), payload("a", 0, 3600))
+        crud.create_event(db, datetime.datetime(2024, 1, 9), payload("a", 3600, 5400))
+        crud.create_events(
+            db,
+            [
+                crud.build_event(datetime.datetime(2024, 2, 1), payload("b", 0, 900)),
+                crud.build_event(
+                    datetime.datetime(2024, 2, 2), payload("a", 0, 900), uuid="x"
+                ),
+                crud.build_event(
+                    datetime.datetime(2024, 2, 2), payload("a", 0, 900), uuid="x"
+                ),
+            ],
+        )
+        expected = [
+            ("2024-01", "a", 1.5, 2),
+            ("2024-02", "a", 0.25, 1),
+            ("2024-02", "b", 0.25, 1),
+        ]
+        assert monthly_totals(db) == expected
+
+        assert crud.rebuild_monthly_totals(db) == 3
+        assert monthly_totals(db) == expected
+
+        # Totals over whole months come from the rollup, others from the entries
+        until = datetime.datetime(2024, 2, 1)
+        for since, table in [
+            (datetime.datetime(2024, 1, 1), "monthly_totals"),
+            (datetime.datetime(2023, 12, 31), "time_entries"),
+        ]:
+            stmt = crud.select_totals(["dev"], since=since, until=until)
+            assert f"FROM {table}" in str(stmt)
+            rows = db.execute(crud.select_totals(["dev"], since=since, until=until))
+            assert crud.totals_tree(rows, ["dev"])["groups"] == [
+                {"name": "a", "time": 1.5, "count": 2}
+            ]
@@ -0,0 +1,374 @@
+import datetime
+import json
+import os
+import pandas as pd
+import pytest
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from typing import Dict
+
+import cas_eresearch_gitlab_app.crud as crud
+import cas_eresearch_gitlab_app.events as events
+import cas_eresearch_gitlab_app.models as models
+import cas_eresearch_gitlab_app.partitions as partitions
+
+
+def _payload(
+    dev: str, project: str, issue: str, t_previous: int, t_current: int
+) -> Dict:
+    return {
+        "user": {"id": abs(hash(dev)), "name": dev},
+        "project": {"namespace": "group", "name": project},
+        "object_attributes": {"title": issue},
+        "changes": {"total_time_spent": {"previous": t_previous, "current": t_current}},
+    }
+
+
+PAYLOADS = [
+    _payload("dev_a", "project_1", "issue 1", 0, 3600),
+    {"user": {"id": 1, "name": "dev_a"}, "changes": {}},
+    _payload("dev_b", "project_1", "issue 2", 3600, 9000),
+    _payload("dev_a", "project_2", "issue 3", 0, 1800),
+]
+
+
+def test_create_event_time_entries(session_factory) -> None:
+    """Make sure that time entries are extracted from payloads at ingest
+
+    Parameters
+    ----------
+    session_factory :
+        Session factory for a temporary database, generated from a pytest fixture
+    """
+    with session_factory() as db:
+        crud.upgrade_database(db)
+        for payload in PAYLOADS:
+            crud.create_event(db, time=datetime.datetime.now(), payload=payload)
+        time_entries = db.query(models.TimeEntry).all()
+
+    assert [entry.event_id for entry in time_entries] == [1, 3, 4]
+    assert [entry.hours for entry in time_entries] == [1.0, 1.5, 0.5]
+    assert time_entries[0].project == "group/project_1"
+
+    # Events with malformed time tracking are stored, without time entries
+    payload = _payload("dev_a", "project_1", "issue 1", 0, 3600)
+    del payload["object_attributes"]
+    with session_factory() as db:
+        db_event = crud.create_event(db, time=datetime.datetime.now(), payload=payload)
+        assert db_event.payload == payload
+        assert db_event.time_entries == []
+
+    ds = events.DataSet("./")
+    assert ds.count() == 3
+    assert ds.df["time"].sum() == 3.0
+
+
+def test_upgrade_database(session_factory) -> None:
+    """Make sure that time entries are backfilled for databases without them
+
+    Parameters
+    ----------
+    session_factory :
+        Session factory for a temporary database, generated from a pytest fixture
+    """
+    # Write events the way earlier versions of the app did
+    with session_factory() as db:
+        time = datetime.datetime(2024, 1, 1)
+        for i_payload, payload in enumerate(PAYLOADS):
+            db.add(
+                models.Event(
+                    dev_id=payload["user"]["id"],
+                    time=time + datetime.timedelta(days=i_payload),
+                    payload=payload,
+                )
+            )
+        db.commit()
+
+    df_legacy = events.DataSet("./").df
+
+    with session_factory() as db:
+        assert crud.upgrade_database(db) == 0
+        assert crud.get_schema_version(db) == models.SCHEMA_VERSION
+        assert db.query(models.TimeEntry).count() == 3
+
+    df_upgraded = events.DataSet("./").df
+    assert df_upgraded.equals(df_legacy)
+
+
+def test_upgrade_database_concurrent(session_factory) -> None:
+    """Make sure that a database is upgraded once when several processes upgrade it at once
+
+    Parameters
+    ----------
+    session_factory :
+        Session factory for a temporary database, generated from a pytest fixture
+    """
+    with session_factory() as db:
+        time = datetime.datetime(2024, 1, 1)
+        for payload in PAYLOADS:
+            db.add(models.Event(dev_id=1, time=time, payload=payload))
+        db.commit()
+
+    def upgrade():
+        # Each with its own connection, as in separate processes
+        engine = create_engine("sqlite:///test.db")
+        try:
+            with sessionmaker(bind=engine)() as db:
+                return crud.upgrade_database(db)
+        finally:
+            engine.dispose()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        versions = list(executor.map(lambda _: upgrade(), range(4)))
+
+    assert sorted(versions) == [0] + [models.SCHEMA_VERSION] * 3
+    with session_factory() as db:
+        assert db.query(models.TimeEntry).count() == 3
+        assert db.query(models.MonthlyTotal).count() == 3
+
+
+def test_extract_events(session_factory) -> None:
+    """Make sure that payloads parsed in SQL give the same entries as in Python
+
+    Parameters
+    ----------
+    session_factory :
+        Session factory for a temporary database, generated from a pytest fixture
+    """
+    with session_factory() as db:
+        time = datetime.datetime(2024, 1, 1, 12, 30, 15, 250)
+        for payload in PAYLOADS:
+            db.add(models.Event(dev_id=1, time=time, payload=payload))
+        db.commit()
+
+    con = sqlite3.connect("test.db")
+    try:
+        df_sql = events._extract_events(con, 0, len(PAYLOADS))
+        df_python = events._parse_events(con, 0, len(PAYLOADS))
+    finally:
+        con.close()
+
+    assert len(df_sql) == 3
+    pd.testing.assert_frame_equal(df_sql, df_python)
+
+
+def test_refresh(session_factory) -> None:
+    """Make sure that refreshing a DataSet gives the same result as reloading it
+
+    Parameters
+    ----------
+    session_factory :
+        Session factory for a temporary database, generated from a pytest fixture
+    """
+    time = datetime.datetime(2024, 1, 15)
+    with session_factory() as db:
+        crud.upgrade_database(db)
+        crud.create_event(db, time=time, payload=PAYLOADS[0])
+
+        ds = events.DataSet("./")
+        assert ds.refresh() == 0
+
+        for i_payload, payload in enumerate(PAYLOADS[1:]):
+            crud.create_event(
+                db,
+                time=time + datetime.timedelta(days=40 * (i_payload + 1)),
+                payload=payload,
+            )
+
+    assert ds.refresh() == 2
+    for column in events.CATEGORICAL_COLUMNS:
+        assert isinstance(ds.df[column].dtype, pd.CategoricalDtype)
+    months = ["2024-01", "2024-04", "2024-05"]
+    assert list(ds.df["month"].astype(str)) == months
+    assert list(json.loads(ds.to_json())["month"].values()) == months
+    ds_reloaded = events.DataSet("./")
+    assert ds.df.equals(ds_reloaded.df)
+    assert ds.time_t.equals(ds_reloaded.time_t)
+    assert ds.dates == ds_reloaded.dates
+
+
+def test_print_totals(capsys: pytest.CaptureFixture) -> None:
+    """Make sure that totals are sorted and formatted as expected
+
+    Parameters
+    ----------
+    capsys : pytest.CaptureFixture
+        Captured output, generated from a pytest fixture
+    """
+    df = pd.DataFrame(
+        {
+            "date": pd.to_datetime(["2024-01-02", "2024-01-03", "2024-02-01"]),
+            "dev": ["dev_b", "dev_a", "dev_b"],
+            "project": ["project_1", "project_1", "project_2"],
+            "issue": ["issue 1", "issue 2", "issue 3"],
+            "time": [30.0, 1.5, 20.0],
+        }
+    )
+    ds = events.DataSet(df=df)
+
+    totals = ds.totals(["project", "dev"])
+    assert totals.loc[("project_1", "dev_b")].to_dict() == {
+        "project": 31.5,
+        "dev": 30.0,
+    }
+
+    ds.print_totals(["dev", "project"], sort_levels=["project"])
+    ds.print_totals(["project"])
+    assert capsys.readouterr().out == (
+        "dev_b: 1.2w\n"
+        "    project_1: 30.0h\n"
+        "    project_2: 20.0h\n"
+        "\n"
+        "dev_a: 1.5h\n"
+        "    project_1: 1.5h\n"
+        "\n"
+        "project_1: 31.5h\n"
+        "project_2: 20.0h\n"
+    )
+
+
+def test_select() -> None:
+    """Make sure that entries are selected by value, set of values and date range"""
+    df = pd.DataFrame(
+        {
+            "date": pd.to_datetime(
+                ["2024-01-02", "2024-01-03", "2024-02-01", "2024-03-01"]
+            ),
+            "dev": ["dev_b", "dev_a", "dev_b", "dev_c"],
+            "project": ["project_1", "project_1", "project_2", "project_1"],
+            "issue": ["issue 1", "issue 2", "issue 3", 'issue "4"'],
+            "time": [30.0, 1.5, 20.0, 2.0],
+        }
+    )
+    ds = events.DataSet(df=df)
+
+    def times(ds_selected):
+        return list(ds_selected.df["time"])
+
+    assert times(ds.select(dev="dev_b")) == [30.0, 20.0]
+    assert times(ds.select(dev={"dev_a", "dev_c", "dev_d"})) == [1.5, 2.0]
+    assert times(ds.select(dev="dev_b", project="project_1")) == [30.0]
+    assert times(ds.select(since="2024-01-03", until="2024-03-01")) == [1.5, 20.0]
+    assert times(ds.select(project="project_1", since="2024-01-03")) == [1.5, 2.0]
+    assert times(ds.subselect({"issue": 'issue "4"'})) == [2.0]
+    assert ds.select(dev="dev_d").count() == 0
+
+    # Repeated values select each entry once
+    assert times(ds.select(dev=["dev_b", "dev_b"])) == [30.0, 20.0]
+    assert times(ds.select(dev=["dev_b", "dev_b"], project="project_1")) == [30.0]
+
+    # Months can be given as strings
+    assert times(ds.subselect({"month": "2024-01"})) == [30.0, 1.5]
+    assert times(ds.select(month=["2024-01", "2024-03", "2024-13"])) == [30.0, 1.5, 2.0]
+
+    # Monthly totals are only computed when asked for
+    ds_selected = ds.select(project="project_1")
+    assert ds_selected._time_t is None
+    assert list(ds_selected.time_t) == [31.5, 0.0, 2.0]
+
+    with pytest.raises(events.InvalidGroupError):
+        ds.select(team="a")
+
+
+def test_plot(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Make sure that monthly group totals are assembled and plotted
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    monkeypatch : pytest.MonkeyPatch
+        Monkeypatching object, generated from a pytest fixture
+    """
+    monkeypatch.chdir(tmp_path)
+    df = pd.DataFrame(
+        {
+            "date": pd.to_datetime(["2024-01-02", "2024-03-03", "2024-03-04"]),
+            "dev": ["dev_b", "dev_a", "dev_b"],
+            "project": ["group/project_1", "group/project_1", "group/project_2"],
+            "issue": ["issue 1", "issue 2", "issue 3"],
+            "time": [3.0, 1.5, 2.0],
+        }
+    )
+    ds = events.DataSet(df=df)
+
+    groups = ds.group("dev").reorder(column="time")
+    monthly = groups.monthly()
+    assert list(monthly.columns) == ["dev_b", "dev_a"]
+    assert monthly.to_numpy().tolist() == [[3.0, 0.0], [0.0, 0.0], [2.0, 1.5]]
+
+    ds.plot(n=1, processes=2)
+    assert sorted(path.name for path in tmp_path.glob("*.pdf")) == [
+        "plot_Projects.pdf",
+        "plot_dev_b.pdf",
+        "plot_group_project_1.pdf",
+    ]
+
+
+def test_snapshot(session_factory, tmp_path: Path) -> None:
+    """Make sure that snapshots are reloaded along with anything added since
+
+    Parameters
+    ----------
+    session_factory :
+        Session factory for a temporary database, generated from a pytest fixture
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    pytest.importorskip("pyarrow")
+
+    time = datetime.datetime(2024, 1, 15)
+    with session_factory() as db:
+        crud.upgrade_database(db)
+        crud.create_event(db, time=time, payload=PAYLOADS[0])
+        events.DataSet("./").save_snapshot(tmp_path / "snapshot.feather")
+        crud.create_event(db, time=time, payload=PAYLOADS[2])
+
+    ds = events.DataSet.load_snapshot(tmp_path / "snapshot.feather", refresh=False)
+    assert ds.count() == 1
+    ds = events.DataSet.load_snapshot(tmp_path / "snapshot.feather")
+    assert ds.count() == 2
+    assert ds.df.equals(events.DataSet("./").df)
+
+
+def test_partitions(session_factory, tmp_path: Path) -> None:
+    """Make sure that monthly partitions are read in parallel and skipped out of range
+
+    Parameters
+    ----------
+    session_factory :
+        Session factory for a temporary database, generated from a pytest fixture
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    with session_factory() as db:
+        crud.upgrade_database(db)
+        for i_month, payload in enumerate(PAYLOADS):
+            crud.create_event(db, datetime.datetime(2024, 1 + i_month, 10), payload)
+
+    path = tmp_path / "partitions"
+    written = partitions.partition_database(
+        "test.db", path, now=datetime.datetime(2024, 4, 1)
+    )
+    assert [filename.name for filename in written] == [
+        f"test-2024-0{month}.db" for month in range(1, 5)
+    ]
+    assert partitions._is_read_only(path / "test-2024-01.db")
+    assert not partitions._is_read_only(path / "test-2024-04.db")
+    assert len(partitions.partition_database("test.db", path)) == 1
+    with pytest.raises(ValueError):
+        partitions.partition_database("test.db", tmp_path)
+
+    # Read from another working directory
+    os.chdir(tmp_path.parent)
+    df_all = events.DataSet(path, processes=2).df
+    assert df_all.equals(events.DataSet(tmp_path).df)
+
+    ds = events.DataSet(path, since=datetime.datetime(2024, 2, 15))
+    assert sorted(ds._watermarks) == [f"test-2024-0{month}.db" for month in range(2, 5)]
+    pd.testing.assert_frame_equal(
+        ds.df, df_all[df_all.index >= "2024-02-15"], check_categorical=False
+    )
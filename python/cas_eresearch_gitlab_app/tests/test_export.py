@@ -0,0 +1,110 @@
+import csv
+import datetime
+import json
+import pytest
+from click.testing import CliRunner
+from pathlib import Path
+
+import cas_eresearch_gitlab_app.cli as cli
+import cas_eresearch_gitlab_app.export as export
+
+from .resources.payloads import write_database
+
+SINCE = datetime.datetime(2023, 2, 1)
+
+
+def _export(filename: Path, output_dir: Path, export_format: str) -> dict:
+    return export.export_database(
+        filename,
+        output_dir,
+        export_format=export_format,
+        tables=["events", "time_entries"],
+        since=SINCE,
+        chunk_size=7,
+        payload_fields=["user.username"],
+    )
+
+
+def test_export_database(tmp_path: Path) -> None:
+    """Make sure that the text formats hold the same (filtered) rows
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    filename = tmp_path / "test.db"
+    write_database(filename, 100, days=100)
+
+    n_rows = {
+        export_format: _export(filename, tmp_path / export_format, export_format)
+        for export_format in ["tsv", "ndjson"]
+    }
+    assert n_rows["tsv"] == n_rows["ndjson"]
+    assert 0 < n_rows["tsv"]["events"] < 100
+
+    with open(tmp_path / "tsv" / "events.tsv", newline="") as file_in:
+        rows = list(csv.DictReader(file_in, delimiter="\t"))
+    with open(tmp_path / "ndjson" / "events.ndjson") as file_in:
+        records = [json.loads(line) for line in file_in]
+    assert len(rows) == len(records) == n_rows["tsv"]["events"]
+
+    assert [row["id"] for row in rows] == [str(record["id"]) for record in records]
+    assert all(row["time"] >= f"{SINCE}" for row in rows)
+    for record in records:
+        assert record["payload.user.username"] == record["payload"]["user"]["username"]
+
+
+def test_export_parquet(tmp_path: Path) -> None:
+    """Make sure that Parquet exports hold the same (filtered) rows as the others
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    filename = tmp_path / "test.db"
+    write_database(filename, 100, days=100)
+
+    n_rows = _export(filename, tmp_path / "ndjson", "ndjson")
+    assert _export(filename, tmp_path / "parquet", "parquet") == n_rows
+
+    with open(tmp_path / "ndjson" / "events.ndjson") as file_in:
+        records = [json.loads(line) for line in file_in]
+    table = pyarrow.parquet.read_table(tmp_path / "parquet" / "events.parquet")
+    assert table.num_rows == len(records) == n_rows["events"]
+    assert table.column("id").to_pylist() == [record["id"] for record in records]
+    assert table.column("time").to_pylist()[0] >= SINCE
+    assert table.column("payload.user.username").to_pylist() == [
+        record["payload.user.username"] for record in records
+    ]
+
+
+def test_cli_export(tmp_path: Path) -> None:
+    """Make sure that the export command writes a file per table
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    filename = tmp_path / "test.db"
+    write_database(filename, 20)
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.cli, ["export", str(filename), "-o", str(tmp_path / "out"), "-c", "3"]
+    )
+    assert result.exit_code == 0
+    assert "20 rows exported from events." in result.output
+    assert {path.name for path in (tmp_path / "out").iterdir()} == {
+        "events.tsv",
+        "monthly_totals.tsv",
+        "time_entries.tsv",
+    }
+
+    result = runner.invoke(cli.cli, ["export", str(filename), "-t", "missing"])
+    assert result.exit_code != 0
+    assert "Unknown tables" in result.output
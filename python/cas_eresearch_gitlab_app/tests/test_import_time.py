@@ -0,0 +1,17 @@
+import pytest
+
+from cas_eresearch_gitlab_app.tests import benchmark
+
+
+@pytest.mark.parametrize("module", list(benchmark.IMPORT_BUDGETS))
+def test_import_time(module: str) -> None:
+    """Make sure that the CLI, client and app start quickly
+
+    Parameters
+    ----------
+    module : str
+        Module to import
+    """
+    result = benchmark.benchmark_import(module)
+    assert result["heavy_modules"] == []
+    assert result["seconds"] < result["budget_seconds"]
@@ -0,0 +1,181 @@
+import asyncio
+import datetime
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import cas_eresearch_gitlab_app.crud as crud
+import cas_eresearch_gitlab_app.ingest as ingest
+import cas_eresearch_gitlab_app.models as models
+
+
+def test_batch_writer_flush(session_factory) -> None:
+    """Make sure that events submitted together are committed in batches
+
+    Parameters
+    ----------
+    session_factory :
+        Session factory for a temporary database, generated from a pytest fixture
+    """
+    writer = ingest.BatchWriter(session_factory, batch_size=4, flush_interval=1.0)
+
+    async def submit_all(n_events):
+        time = datetime.datetime.now()
+        return await asyncio.gather(
+            *[
+                writer.submit(time=time, payload={"user": {"id": i_event}})
+                for i_event in range(n_events)
+            ]
+        )
+
+    event_ids = asyncio.run(submit_all(10))
+    writer.stop()
+
+    assert sorted(event_ids) == list(range(1, 11))
+    db = session_factory()
+    assert [event.dev_id for event in crud.get_events(db)] == list(range(10))
+    db.close()
+
+
+def test_batch_writer_queued(session_factory) -> None:
+    """Make sure that queued events are written once the writer is stopped
+
+    Parameters
+    ----------
+    session_factory :
+        Session factory for a temporary database, generated from a pytest fixture
+    """
+    writer = ingest.BatchWriter(
+        session_factory, durability=ingest.DURABILITY_QUEUED, flush_interval=10.0
+    )
+
+    async def submit():
+        return await writer.submit(
+            time=datetime.datetime.now(), payload={"user": {"id": 1}}
+        )
+
+    assert asyncio.run(submit()) is None
+    writer.stop()
+
+    db = session_factory()
+    assert len(crud.get_events(db)) == 1
+    db.close()
+
+
+def test_batch_writer_invalid_payload(session_factory) -> None:
+    """Make sure that invalid payloads are rejected before being queued
+
+    Parameters
+    ----------
+    session_factory :
+        Session factory for a temporary database, generated from a pytest fixture
+    """
+    writer = ingest.BatchWriter(session_factory)
+
+    async def submit():
+        return await writer.submit(time=datetime.datetime.now(), payload={})
+
+    with pytest.raises(models.CreateEventError):
+        asyncio.run(submit())
+    assert writer.depth() == 0
+
+
+def test_batch_writer_retry(session_factory, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Make sure that locked batches are retried, only bad events fail, and nothing waits forever
+
+    Parameters
+    ----------
+    session_factory :
+        Session factory for a temporary database, generated from a pytest fixture
+    monkeypatch : pytest.MonkeyPatch
+        Patching helper, generated from a pytest fixture
+    """
+    create_events = crud.create_events
+    failures = {"locked": 1}
+
+    def create_events_failing(db, db_events):
+        if failures["locked"]:
+            failures["locked"] -= 1
+            raise OperationalError("COMMIT", {}, Exception("database is locked"))
+        if any(db_event.dev_id == 13 for db_event in db_events):
+            raise IntegrityError("INSERT", {}, Exception("UNIQUE constraint failed"))
+        return create_events(db, db_events)
+
+    monkeypatch.setattr(crud, "create_events", create_events_failing)
+    monkeypatch.setattr(ingest, "RETRY_DELAY_MIN", 0.001)
+
+    # Queued events are not lost to a transient failure
+    writer = ingest.BatchWriter(
+        session_factory, durability=ingest.DURABILITY_QUEUED, flush_interval=10.0
+    )
+
+    async def submit_all(dev_ids):
+        time = datetime.datetime.now()
+        return await asyncio.gather(
+            *[
+                writer.submit(time=time, payload={"user": {"id": dev_id}})
+                for dev_id in dev_ids
+            ],
+            return_exceptions=True,
+        )
+
+    asyncio.run(submit_all(range(5)))
+    writer.stop()
+    db = session_factory()
+    assert len(crud.get_events(db)) == 5
+    db.close()
+
+    # One bad event does not fail the rest of its batch
+    writer = ingest.BatchWriter(session_factory, flush_interval=1.0)
+    results = asyncio.run(submit_all([10, 11, 12, 13, 14]))
+    writer.stop()
+    assert isinstance(results[3], IntegrityError)
+    assert [result for result in results if isinstance(result, int)] == [
+        6,
+        7,
+        8,
+        9,
+    ]
+
+    # Other database errors, and locks which outlast the retries, fail the batch
+    monkeypatch.setattr(ingest, "RETRY_ATTEMPTS", 3)
+    for message in ["no such table: events", "database is locked"]:
+
+        def create_events_broken(db, db_events):
+            raise OperationalError("INSERT", {}, Exception(message))
+
+        monkeypatch.setattr(crud, "create_events", create_events_broken)
+        writer = ingest.BatchWriter(session_factory, flush_interval=0.0)
+        results = asyncio.run(submit_all([20, 21]))
+        writer.stop()
+        assert all(isinstance(result, OperationalError) for result in results)
+
+
+def test_recent_events() -> None:
+    """Make sure that the least recently seen event UUIDs are forgotten first"""
+    recent_events = ingest.RecentEvents(maxsize=2)
+    recent_events.add("a", 1)
+    recent_events.add("b", 2)
+    assert "a" in recent_events
+    recent_events.add("c")
+    assert len(recent_events) == 2
+    assert "b" not in recent_events
+    assert recent_events.get("a") == 1
+    assert recent_events.get("c") is None
+
+
+def test_ingest_rules() -> None:
+    """Make sure that events are matched on their type and body size"""
+    rules = ingest.IngestRules("Issue Hook:1000, Merge Request Hook")
+    assert str(rules) == "Issue Hook:1000,Merge Request Hook"
+    assert rules.match("Issue Hook", 1000)
+    assert not rules.match("Issue Hook", 1001)
+    assert rules.match("Merge Request Hook", 10**9)
+    assert rules.match("Merge Request Hook", None)
+    assert not rules.match("Pipeline Hook", 10)
+    assert not rules.match(None, 10)
+    assert ingest.IngestRules("*:10").match(None, 10)
+
+    with pytest.raises(ValueError):
+        ingest.IngestRules("Issue Hook:big")
+    with pytest.raises(ValueError):
+        ingest.IngestRules(unmatched="ignore")
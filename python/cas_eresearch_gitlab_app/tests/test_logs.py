@@ -0,0 +1,72 @@
+import json
+import logging
+import logging.handlers
+from pathlib import Path
+
+import cas_eresearch_gitlab_app.logs as logs
+
+
+def test_configure_logging(tmp_path: Path) -> None:
+    """Make sure that records are written by the listener, as JSON and with rotation
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    logger = logging.getLogger("test_configure_logging")
+    logger.setLevel(logging.INFO)
+    filename = tmp_path / "test.log"
+    logs.configure_logging(logger, str(filename))
+    listener = logs.configure_logging(
+        logger, str(filename), log_format="json", max_bytes=1000, backup_count=2
+    )
+    # The pipeline of the first call is replaced
+    assert len(logger.handlers) == 1
+
+    for i_record in range(50):
+        logger.info("Record %d", i_record)
+    logger.debug("Filtered out")
+    logs.stop_logging(listener)
+    logs.stop_logging(listener)
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "test.log",
+        "test.log.1",
+        "test.log.2",
+    ]
+    with open(filename) as file_in:
+        entries = [json.loads(line) for line in file_in]
+    assert entries[-1]["message"] == "Record 49"
+    assert entries[-1]["level"] == "INFO"
+    logger.removeHandler(logger.handlers[0])
+
+
+def test_log_exception(tmp_path: Path) -> None:
+    """Make sure that exceptions logged through the queue reach each format
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    logger = logging.getLogger("test_log_exception")
+    for log_format in logs.LOG_FORMATS:
+        filename = tmp_path / f"test.{log_format}.log"
+        listener = logs.configure_logging(logger, str(filename), log_format=log_format)
+        try:
+            raise ValueError("Invalid value")
+        except ValueError:
+            logger.exception("Failed with %s", log_format)
+        logs.stop_logging(listener)
+
+        with open(filename) as file_in:
+            text = file_in.read()
+        if log_format == "json":
+            entry = json.loads(text)
+            assert entry["message"] == "Failed with json"
+            assert "ValueError: Invalid value" in entry["exception"]
+        else:
+            assert "Failed with text\nTraceback" in text
+            assert text.count("ValueError: Invalid value") == 1
+    logger.removeHandler(logger.handlers[0])
@@ -0,0 +1,20 @@
+import cas_eresearch_gitlab_app.metrics as metrics
+
+
+def test_histogram_render() -> None:
+    """Make sure that histograms are rendered with cumulative buckets"""
+    histogram = metrics.Histogram(
+        "test_duration_seconds", "Test", labels=("route",), buckets=(0.1, 1.0)
+    )
+    for value in [0.05, 0.5, 0.5, 5.0]:
+        histogram.observe(value, route="/")
+
+    assert histogram.render().splitlines() == [
+        "# HELP cas_eresearch_gitlab_app_test_duration_seconds Test",
+        "# TYPE cas_eresearch_gitlab_app_test_duration_seconds histogram",
+        'cas_eresearch_gitlab_app_test_duration_seconds_bucket{route="/",le="0.1"} 1.0',
+        'cas_eresearch_gitlab_app_test_duration_seconds_bucket{route="/",le="1.0"} 3.0',
+        'cas_eresearch_gitlab_app_test_duration_seconds_bucket{route="/",le="+Inf"} 4.0',
+        'cas_eresearch_gitlab_app_test_duration_seconds_sum{route="/"} 6.05',
+        'cas_eresearch_gitlab_app_test_duration_seconds_count{route="/"} 4.0',
+    ]
@@ -0,0 +1,139 @@
+import asyncio
+import datetime
+import json
+import shutil
+from pathlib import Path
+from sqlalchemy import func, select
+
+import cas_eresearch_gitlab_app.models as models
+import cas_eresearch_gitlab_app.spool as spool
+
+
+def _count_events(session_factory) -> int:
+    with session_factory() as db:
+        return db.execute(select(func.count(models.Event.id))).scalar()
+
+
+def test_spool(session_factory, tmp_path: Path) -> None:
+    """Make sure that spooled events are written once, by a single consumer
+
+    Parameters
+    ----------
+    session_factory :
+        Session factory for a temporary database, generated from a pytest fixture
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    path = tmp_path / "spool"
+    writer = spool.SpoolWriter(path, sync_interval=0.001)
+
+    async def submit_all(n_events):
+        time = datetime.datetime.now()
+        await asyncio.gather(
+            *[
+                writer.submit(
+                    time=time, payload={"user": {"id": i_event}}, uuid=f"{i_event}"
+                )
+                for i_event in range(n_events)
+            ]
+        )
+
+    asyncio.run(submit_all(10))
+    assert writer.depth() == 0
+    (segment,) = path.glob(f"*{spool.SEGMENT_SUFFIX}")
+
+    consumer = spool.SpoolConsumer(path, session_factory, batch_size=4)
+    assert consumer.acquire()
+    assert not spool.SpoolConsumer(path, session_factory).acquire()
+    assert consumer.drain() == 10
+    assert consumer.drain() == 0
+    assert _count_events(session_factory) == 10
+
+    # Once the writer has finished with it, the segment is deleted after being read
+    # (and events already stored are not written again)
+    asyncio.run(submit_all(12))
+    writer.stop()
+    shutil.copy(segment, tmp_path / "segment.copy")
+    assert consumer.drain() == 12
+    assert list(path.glob(f"*{spool.SEGMENT_SUFFIX}")) == []
+    assert _count_events(session_factory) == 12
+
+    # Replaying entries (eg. after a crash) does not store them again
+    shutil.copy(tmp_path / "segment.copy", segment)
+    assert consumer.drain() == 22
+    assert _count_events(session_factory) == 12
+    consumer.release()
+
+
+def test_spool_crashed_writer(session_factory, tmp_path: Path) -> None:
+    """Make sure that the segments of crashed writers are replayed
+
+    Parameters
+    ----------
+    session_factory :
+        Session factory for a temporary database, generated from a pytest fixture
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    path = tmp_path / "spool"
+    path.mkdir()
+    entries = [
+        {
+            "time": datetime.datetime(2024, 1, 1).isoformat(),
+            "uuid": f"{i_event}",
+            "payload": {"user": {"id": i_event}},
+        }
+        for i_event in range(3)
+    ]
+    with open(path / f"1-1{spool.SEGMENT_SUFFIX}", "w") as file_out:
+        for entry in entries:
+            file_out.write(json.dumps(entry) + "\n")
+        # Cut short by the crash
+        file_out.write('{"time": "2024-01-01')
+
+    consumer = spool.SpoolConsumer(path, session_factory, poll_interval=0.01)
+    consumer.start()
+    consumer.stop()
+    assert _count_events(session_factory) == 3
+    assert list(path.glob(f"*{spool.SEGMENT_SUFFIX}")) == []
+
+
+def test_spool_dead_letter(session_factory, tmp_path: Path) -> None:
+    """Make sure that entries which can not be stored do not hold up the others
+
+    Parameters
+    ----------
+    session_factory :
+        Session factory for a temporary database, generated from a pytest fixture
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    """
+    path = tmp_path / "spool"
+    path.mkdir()
+    time = datetime.datetime(2024, 1, 1).isoformat()
+    lines = [
+        json.dumps({"time": time, "uuid": "a", "payload": {"user": {"id": 1}}}),
+        # Accepted from the sender, but too large for the database
+        json.dumps({"time": time, "uuid": "b", "payload": {"user": {"id": 2**70}}}),
+        json.dumps({"time": time, "uuid": "c"}),
+        "not JSON",
+        json.dumps({"time": time, "uuid": "d", "payload": {"user": {"id": 4}}}),
+    ]
+    with open(path / f"1-1{spool.SEGMENT_SUFFIX}", "w") as file_out:
+        file_out.writelines(line + "\n" for line in lines)
+    # Not a segment, so left alone
+    (path / f"notes{spool.SEGMENT_SUFFIX}").touch()
+
+    consumer = spool.SpoolConsumer(path, session_factory)
+    assert consumer.acquire()
+    assert consumer.drain() == 4
+    consumer.release()
+    assert _count_events(session_factory) == 2
+    assert list(path.glob(f"*{spool.SEGMENT_SUFFIX}")) == [
+        path / f"notes{spool.SEGMENT_SUFFIX}"
+    ]
+
+    with open(path / spool.DEAD_LETTER) as file_in:
+        records = [json.loads(line) for line in file_in]
+    assert [record["entry"].get("uuid") for record in records] == [None, "c", "b"]
+    assert records[0]["entry"]["line"] == "not JSON\n"
@@ -0,0 +1,54 @@
+import pytest
+import sqlite3
+from pathlib import Path
+
+import cas_eresearch_gitlab_app.storage as storage
+
+
+def test_storage_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Make sure that storage profiles are selected and overridden from the environment
+
+    Parameters
+    ----------
+    monkeypatch : pytest.MonkeyPatch
+        Monkeypatching object, generated from a pytest fixture
+    """
+    monkeypatch.setenv("STORAGE_PROFILE", "wal")
+    monkeypatch.setenv("SQLITE_SYNCHRONOUS", "OFF")
+    monkeypatch.setenv("SQLITE_READER_POOL_SIZE", "3")
+    settings = storage.storage_settings()
+    assert settings["journal_mode"] == "WAL"
+    assert settings["synchronous"] == "OFF"
+    assert settings["reader_pool_size"] == 3
+
+    monkeypatch.setenv("SQLITE_READER_POOL_SIZE", "three")
+    with pytest.raises(ValueError, match="SQLITE_READER_POOL_SIZE"):
+        storage.storage_settings()
+
+    monkeypatch.setenv("STORAGE_PROFILE", "fast")
+    with pytest.raises(storage.InvalidStorageProfileError):
+        storage.storage_settings()
+
+
+def test_connect_read_only(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Make sure that read-only connections can not write
+
+    Parameters
+    ----------
+    tmp_path : Path
+        Temporary path, generated from a pytest fixture
+    monkeypatch : pytest.MonkeyPatch
+        Monkeypatching object, generated from a pytest fixture
+    """
+    monkeypatch.setenv("STORAGE_PROFILE", "wal")
+    filename = tmp_path / "test db.db"
+    con = sqlite3.connect(filename)
+    storage.apply_pragmas(con, storage.storage_settings())
+    con.execute("CREATE TABLE events (id INTEGER)")
+    con.close()
+
+    con = storage.connect_read_only(filename)
+    assert con.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    with pytest.raises(sqlite3.OperationalError):
+        con.execute("INSERT INTO events VALUES (1)")
+    con.close()